@@ -0,0 +1,69 @@
+# Backend/app/engine.py
+"""
+Standalone matching-engine worker:
+
+    python -m app.engine
+
+Runs what the API otherwise runs on its startup timer: open-order matching,
+the SL/target watcher and the EOD sweep (plus the tick-driven engine when
+ENGINE_MODE=tick). It uses the same paper_trading.db as the API, so start it
+from the same directory.
+
+Set RUN_ENGINE_IN_API=0 for the API processes so matching only happens
+here. Orders the API places or edits reach this process's trigger book
+through orders.book_seq on every cycle (and every ENGINE_BOOK_POLL
+seconds in tick mode). The worker still takes the "order-engine" lease, so a second worker
+(or an API that still runs the loop) stays idle instead of doubling work.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+env_path = BASE_DIR / ".env"
+if env_path.exists():
+    load_dotenv(env_path)
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from app.routers import orders  # noqa: E402  (env must be loaded first)
+from app.services.order_engine import ENGINE_MODE, ENGINE_SWEEP_SECONDS  # noqa: E402
+
+
+def main() -> None:
+    stop = threading.Event()
+
+    def _shutdown(signum, _frame):
+        print(f"ℹ️ engine: signal {signum}, stopping")
+        stop.set()
+
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    print(f"ℹ️ engine: mode={ENGINE_MODE} sweep={ENGINE_SWEEP_SECONDS}s db={os.path.abspath(orders.DB_PATH)}")
+    orders.start_background()
+    next_sweep = 0.0
+    try:
+        while not stop.is_set():
+            # Orders are placed and edited by the API processes; between sweeps
+            # the book follows their writes (tick mode) every ENGINE_BOOK_POLL.
+            try:
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + ENGINE_SWEEP_SECONDS
+                    orders.run_background_jobs()
+                else:
+                    orders.sync_trigger_book()
+            except Exception as e:
+                print(f"⚠️ engine sweep failed: {e}")
+            stop.wait(min(ENGINE_SWEEP_SECONDS, orders.ENGINE_BOOK_POLL))
+    finally:
+        orders.stop_background()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,25 @@
 # app/routers/orders.py
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
+import os
+import json
 import sqlite3
-from datetime import datetime, time
-import requests
+import threading
+import time as _time
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime, time, timedelta
 from pytz import timezone
 from fastapi_utils.tasks import repeat_every
 
+from app.services.price_service import get_live_price, get_live_prices, get_price_within, get_prices_within
+from app.services.trigger_book import TriggerBook
+from app.services.order_engine import OrderEngine, ENGINE_MODE, ENGINE_SWEEP_SECONDS
+from app.services import kite_ws_manager
+from app.services.leader import Lease
+
 router = APIRouter(prefix="/orders", tags=["orders"])
 
 DB_PATH = "paper_trading.db"
@@ -64,6 +75,10 @@ class CloseRequest(BaseModel):
     username: str
     script: str
 
+class BatchOrderData(BaseModel):
+    orders: List[OrderData]
+    atomic: Optional[bool] = True   # one failing leg rejects the whole basket
+
 # Treat prices within one paisa as equal to avoid float edge cases
 PRICE_EPS = 0.01
 
@@ -77,6 +92,25 @@ def le(a: float, b: float) -> bool:
     if a is None or b is None: return False
     return float(a) <= float(b) + PRICE_EPS
 
+# Open LIMIT orders indexed by trigger price (see services/trigger_book.py).
+# Kept in step on place/modify/cancel/fill in this process. Writes from
+# other processes are picked up every matching cycle through
+# orders.book_seq (bumped by DB triggers on any Open-order insert/edit);
+# a full reload every TRIGGER_BOOK_RESYNC seconds is only a safety net.
+TRIGGER_BOOK = TriggerBook(eps=PRICE_EPS)
+TRIGGER_BOOK_RESYNC = float(os.getenv("TRIGGER_BOOK_RESYNC", "60"))
+_BOOK_LOADED_AT = 0.0
+_BOOK_SEQ = 0       # highest orders.book_seq applied to TRIGGER_BOOK
+_BOOK_SYNC_LOCK = threading.Lock()
+# Tick mode: how often the leader polls book_seq between sweeps, so Open
+# orders written by other processes (API workers when the engine runs on
+# its own) start streaming and matching without waiting for the sweep.
+ENGINE_BOOK_POLL = float(os.getenv("ENGINE_BOOK_POLL", "1"))
+# position_ledger is rebuilt from orders once per process before first use
+_LEDGER_READY = False
+# DB files whose schema _ensure_tables has created/migrated in this process
+_TABLES_READY: set = set()
+
 def _clean_level(x):
     """
     Convert DB value to float level.
@@ -105,6 +139,17 @@ def is_after_market_close() -> bool:
 # -------------------- DB helpers --------------------
 
 def _ensure_tables(c: sqlite3.Cursor):
+    """
+    Schema setup for DB_PATH, once per process: the CREATE / ALTER /
+    TRIGGER work below runs on the first call, later calls (every request
+    path) are a set lookup.
+    """
+    if DB_PATH in _TABLES_READY:
+        return
+    _create_tables(c)
+    _TABLES_READY.add(DB_PATH)
+
+def _create_tables(c: sqlite3.Cursor):
     # --- base tables ---
     c.execute("""
       CREATE TABLE IF NOT EXISTS funds (
@@ -175,6 +220,128 @@ def _ensure_tables(c: sqlite3.Cursor):
       )
     """)
 
+    # --- today's net qty + latest SL/target per (user, script), kept by _on_fills ---
+    # Lets the SL/target watcher skip aggregating the orders table every cycle.
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS position_ledger (
+        trade_date TEXT NOT NULL,      -- YYYY-MM-DD of the Closed rows
+        username   TEXT NOT NULL,
+        script     TEXT NOT NULL,
+        net_qty    INTEGER NOT NULL DEFAULT 0,   -- closed BUY - SELL
+        long_sl    REAL,               -- latest BUY carrying SL/target
+        long_tgt   REAL,
+        long_seg   TEXT,
+        short_sl   REAL,               -- latest SELL carrying SL/target
+        short_tgt  REAL,
+        short_seg  TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (trade_date, username, script)
+      )
+    """)
+
+    # --- materialized Positions tab: today's FIFO lots/exits per (user, script) ---
+    # _on_fills bumps `version` and marks the row dirty; get_positions replays
+    # only dirty scripts and stores the result, so a poll is a keyed read.
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS position_state (
+        trade_date TEXT NOT NULL,
+        username   TEXT NOT NULL,
+        script     TEXT NOT NULL,               -- upper-case
+        state      TEXT,                        -- JSON (see _fifo_positions), NULL until first replay
+        version    INTEGER NOT NULL DEFAULT 0,  -- bumped by every fill
+        dirty      INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT,
+        PRIMARY KEY (trade_date, username, script)
+      )
+    """)
+
+    # --- realized trades of PAST days, written once by _realize_past_days ---
+    # kind='SELL': a SELL row matched FIFO against long lots
+    # kind='COVER': a BUY row matched FIFO against SELL FIRST (short) lots
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS realized_trades (
+        order_id    INTEGER PRIMARY KEY,   -- the exiting row in orders
+        username    TEXT NOT NULL,
+        trade_date  TEXT NOT NULL,
+        script      TEXT NOT NULL,
+        kind        TEXT NOT NULL,         -- 'SELL' / 'COVER'
+        segment     TEXT,
+        entry_qty   INTEGER NOT NULL,      -- qty matched against open lots
+        entry_price REAL,                  -- avg price of the matched lots
+        entry_date  TEXT,                  -- datetime of the first matched lot
+        exit_qty    INTEGER NOT NULL,
+        exit_price  REAL NOT NULL,
+        exit_date   TEXT NOT NULL,
+        invested_value REAL,
+        pnl         REAL
+      )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_realized_user_date ON realized_trades (username, exit_date, order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_realized_user_script_date ON realized_trades (username, script, exit_date, order_id)")
+    # history scans: one user's Closed rows in time order
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_status_dt ON orders (username, status, datetime)")
+    # FIFO lots still open at the end of `upto_date`, so the next day continues from here
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS realized_state (
+        username   TEXT PRIMARY KEY,
+        upto_date  TEXT NOT NULL,
+        lots       TEXT NOT NULL,          -- JSON {script: {"long": [[qty, price, dt]], "short": [...]}}
+        updated_at TEXT
+      )
+    """)
+
+    # --- every avg_buy_price a holding has had, logged by triggers on portfolio ---
+    # History prices a SELL of carried holdings (no open lots) at the average
+    # as it stood when the SELL happened, not at today's average.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='portfolio_cost'")
+    new_cost_log = c.fetchone() is None
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS portfolio_cost (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        username      TEXT NOT NULL,
+        script        TEXT NOT NULL,       -- upper-case
+        avg_buy_price REAL NOT NULL,
+        changed_at    TEXT NOT NULL        -- localtime, same format as orders.datetime
+      )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_cost_user ON portfolio_cost (username, changed_at)")
+    for event in ("INSERT", "UPDATE OF avg_buy_price"):
+        c.execute(f"""
+          CREATE TRIGGER IF NOT EXISTS trg_portfolio_cost_{event.split()[0].lower()}
+          AFTER {event} ON portfolio
+          BEGIN
+            INSERT INTO portfolio_cost (username, script, avg_buy_price, changed_at)
+            VALUES (NEW.username, UPPER(NEW.script), NEW.avg_buy_price, datetime('now','localtime'));
+          END
+        """)
+    if new_cost_log:
+        # holdings from before the log existed: their average is all we know
+        c.execute("""
+          INSERT INTO portfolio_cost (username, script, avg_buy_price, changed_at)
+          SELECT username, UPPER(script), avg_buy_price, '' FROM portfolio
+        """)
+
+    # --- realized P&L per day, written at EOD and by backfill_pnl_rollup ---
+    c.execute("""
+      CREATE TABLE IF NOT EXISTS pnl_daily (
+        username     TEXT NOT NULL,
+        trade_date   TEXT NOT NULL,
+        script       TEXT NOT NULL,
+        segment      TEXT NOT NULL,
+        realized_pnl REAL NOT NULL DEFAULT 0,   -- FIFO, booked on the exiting row's day
+        turnover     REAL NOT NULL DEFAULT 0,   -- sum(qty * price) of Closed rows
+        buy_qty      INTEGER NOT NULL DEFAULT 0,
+        sell_qty     INTEGER NOT NULL DEFAULT 0,
+        trades       INTEGER NOT NULL DEFAULT 0,
+        source       TEXT,                      -- 'eod' (saw the whole day) / 'backfill'
+        updated_at   TEXT,
+        PRIMARY KEY (username, trade_date, script, segment)
+      )
+    """)
+    c.execute("PRAGMA table_info(pnl_daily)")
+    if "source" not in [r[1].lower() for r in c.fetchall()]:
+        c.execute("ALTER TABLE pnl_daily ADD COLUMN source TEXT")
+
     # --- lightweight migrations for existing DBs ---
     
     # orders: add is_short if missing
@@ -186,6 +353,33 @@ def _ensure_tables(c: sqlite3.Cursor):
     except Exception:
         pass
 
+    # orders: book_seq, a global change counter for Open orders. Any insert,
+    # or edit of an order that is or was Open, takes MAX+1 (writers are
+    # serialized, so it grows in commit order). Every process applies
+    # `book_seq > last seen` to its TRIGGER_BOOK, whoever did the write.
+    try:
+        c.execute("PRAGMA table_info(orders)")
+        if "book_seq" not in [r[1].lower() for r in c.fetchall()]:
+            c.execute("ALTER TABLE orders ADD COLUMN book_seq INTEGER")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_orders_book_seq ON orders (book_seq)")
+        c.execute("""
+          CREATE TRIGGER IF NOT EXISTS trg_orders_book_ins AFTER INSERT ON orders
+          WHEN NEW.status='Open'
+          BEGIN
+            UPDATE orders SET book_seq=(SELECT COALESCE(MAX(book_seq),0)+1 FROM orders) WHERE id=NEW.id;
+          END
+        """)
+        c.execute("""
+          CREATE TRIGGER IF NOT EXISTS trg_orders_book_upd
+          AFTER UPDATE OF script, order_type, price, is_short, status ON orders
+          WHEN OLD.status='Open' OR NEW.status='Open'
+          BEGIN
+            UPDATE orders SET book_seq=(SELECT COALESCE(MAX(book_seq),0)+1 FROM orders) WHERE id=NEW.id;
+          END
+        """)
+    except Exception as e:
+        print(f"⚠️ book_seq migration failed: {e}")
+
     # portfolio_exits: add segment / exit_side if missing
     try:
         c.execute("PRAGMA table_info(portfolio_exits)")
@@ -246,10 +440,130 @@ def _upsert_portfolio_short(
         )
 
 
+# Matching engine: in ENGINE_MODE=tick, pushed ticks wake it for just the
+# symbols that moved; the timer below is then only a safety sweep.
+# With several API workers only the holder of the "order-engine" lease runs
+# the engine and the EOD sweep; the others just serve HTTP.
+LEASE = Lease("order-engine", DB_PATH, on_change=lambda leader: _sync_engine_subs())
+ENGINE = OrderEngine(lambda symbols: process_open_orders(symbols) if LEASE.is_leader() else None)
+_ENGINE_WATCH: set = set()     # symbols with open triggers or today's nets
+# The part of _ENGINE_WATCH this process holds a stream reference for. Only
+# these are ever unsubscribed, so /quotes/stream clients and get_quote()
+# pins on the same symbols keep theirs.
+_ENGINE_SUBS: set = set()
+_ENGINE_SUBS_LOCK = threading.Lock()
+_EOD_SWEPT_ON: Optional[str] = None
+
+def _engine_watch(symbols, replace: bool = False):
+    """Track the symbols the matcher cares about; in tick mode the leader also streams them."""
+    wanted = {(s or "").upper() for s in symbols if s}
+    with _ENGINE_SUBS_LOCK:
+        if replace:
+            _ENGINE_WATCH.intersection_update(wanted)
+        _ENGINE_WATCH.update(wanted)
+    _sync_engine_subs()
+
+def _sync_engine_subs():
+    """
+    Stream every watched symbol while we lead in tick mode, nothing otherwise.
+    Runs on every watch change and when the lease is gained or lost.
+    """
+    with _ENGINE_SUBS_LOCK:
+        want = set(_ENGINE_WATCH) if ENGINE_MODE == "tick" and LEASE.is_leader() else set()
+        for sym in want - _ENGINE_SUBS:
+            if kite_ws_manager.subscribe(sym) is not None:
+                _ENGINE_SUBS.add(sym)
+        for sym in _ENGINE_SUBS - want:
+            kite_ws_manager.unsubscribe(sym)
+            _ENGINE_SUBS.discard(sym)
+
+def _on_price_ticks(keys):
+    # watchlist-only symbols tick too; don't wake the matcher for them
+    if not LEASE.is_leader():
+        return
+    mine = [k for k in keys if k in _ENGINE_WATCH]
+    if mine:
+        ENGINE.notify(mine)
+
+kite_ws_manager.add_tick_listener(_on_price_ticks)
+
+def _run_eod_sweep():
+    """After cutoff, run the EOD pipeline once for every user with open or today's rows."""
+    global _EOD_SWEPT_ON
+    if not is_after_market_close():
+        return
+    today = _now_ist().strftime("%Y-%m-%d")
+    if _EOD_SWEPT_ON == today:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        c = conn.cursor()
+        _ensure_tables(c)
+        c.execute(
+            """
+            SELECT DISTINCT username FROM orders
+             WHERE status='Open' OR (status='Closed' AND substr(datetime,1,10)=?)
+            """,
+            (today,),
+        )
+        users = [r[0] for r in c.fetchall()]
+    finally:
+        conn.close()
+    skipped = 0
+    for username in users:
+        try:
+            skipped += run_eod_pipeline(username) or 0
+        except Exception as e:
+            print(f"⚠️ EOD sweep failed for {username}: {e}")
+            return      # retry the whole (idempotent) sweep next tick
+    if skipped:
+        # no tradable price for some square-offs: leave the day open, retry next tick
+        print(f"⚠️ EOD sweep: {skipped} square-off(s) had no price, retrying")
+        return
+    _EOD_SWEPT_ON = today
+
+def start_background():
+    LEASE.start()
+    ENGINE.start()
+
+def stop_background():
+    ENGINE.stop()
+    LEASE.stop()
+    _sync_engine_subs()     # no longer leading: drop our stream references
+
+def run_background_jobs():
+    """One sweep: matching + SL/target, then EOD if due. No-op unless we hold the lease."""
+    _sync_engine_subs()     # catches a lease that ran out without a heartbeat noticing
+    if not LEASE.is_leader():
+        return
+    process_open_orders()
+    _run_eod_sweep()
+
+# RUN_ENGINE_IN_API=0 when the engine runs as its own process (python -m app.engine);
+# the API then only serves HTTP.
+RUN_ENGINE_IN_API = os.getenv("RUN_ENGINE_IN_API", "1") == "1"
+
 @router.on_event("startup")
-@repeat_every(seconds=10)  # run every 10 sec
+def start_order_engine() -> None:
+    if RUN_ENGINE_IN_API:
+        start_background()
+
+@router.on_event("shutdown")
+def stop_order_engine() -> None:
+    if RUN_ENGINE_IN_API:
+        stop_background()
+
+@router.on_event("startup")
+@repeat_every(seconds=ENGINE_SWEEP_SECONDS)  # safety sweep (every 10 sec by default)
 def auto_process_orders() -> None:
-    process_open_orders()
+    if RUN_ENGINE_IN_API:
+        run_background_jobs()
+
+@router.on_event("startup")
+@repeat_every(seconds=ENGINE_BOOK_POLL)
+def auto_sync_trigger_book() -> None:
+    if RUN_ENGINE_IN_API:
+        sync_trigger_book()
 
 def _ensure_funds_row(c: sqlite3.Cursor, username: str) -> float:
     c.execute("SELECT available_amount FROM funds WHERE username = ?", (username,))
@@ -259,32 +573,233 @@ def _ensure_funds_row(c: sqlite3.Cursor, username: str) -> float:
         return 0.0
     return float(row[0])
 
+def _load_trigger_book(c: sqlite3.Cursor):
+    global _BOOK_LOADED_AT, _BOOK_SEQ
+    with _BOOK_SYNC_LOCK:
+        # seq first: a write landing between the two reads is simply re-applied
+        c.execute("SELECT COALESCE(MAX(book_seq),0) FROM orders")
+        seq = int(c.fetchone()[0] or 0)
+        c.execute("SELECT id, script, order_type, price, is_short FROM orders WHERE status='Open'")
+        TRIGGER_BOOK.load(c.fetchall())
+        _BOOK_LOADED_AT = _time.monotonic()
+        _BOOK_SEQ = seq
+
+def _refresh_trigger_book(c: sqlite3.Cursor) -> set:
+    """
+    Apply Open-order writes made since the last look, by any process.
+    Returns the symbols that gained an Open order.
+    """
+    global _BOOK_SEQ
+    added = set()
+    with _BOOK_SYNC_LOCK:
+        c.execute(
+            "SELECT id, script, order_type, price, is_short, status, book_seq FROM orders WHERE book_seq > ?",
+            (_BOOK_SEQ,),
+        )
+        for oid, script, otype, trig, is_short, status, seq in c.fetchall():
+            if status == "Open":
+                TRIGGER_BOOK.add(oid, script, otype, trig, is_short)
+                added.add((script or "").upper())
+            else:
+                TRIGGER_BOOK.remove(oid)
+            _BOOK_SEQ = max(_BOOK_SEQ, int(seq))
+    return added
+
+def sync_trigger_book():
+    """
+    Tick mode, leader only: pull other processes' Open-order writes into the
+    book between sweeps, stream their symbols and match them right away.
+    """
+    if ENGINE_MODE != "tick" or not LEASE.is_leader() or not TRIGGER_BOOK.loaded:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        added = _refresh_trigger_book(conn.cursor())
+    except Exception as e:
+        print(f"⚠️ trigger book sync failed: {e}")
+        return
+    finally:
+        conn.close()
+    if added:
+        _engine_watch(added)
+        ENGINE.notify(added)
+
+def _sync_trigger_book(c: sqlite3.Cursor, order_id: int):
+    """Re-read one order after an edit: keep it in the book only while Open."""
+    c.execute("SELECT script, order_type, price, is_short, status FROM orders WHERE id=?", (order_id,))
+    row = c.fetchone()
+    if row and row[4] == "Open":
+        TRIGGER_BOOK.add(order_id, row[0], row[1], row[2], row[3])
+    else:
+        TRIGGER_BOOK.remove(order_id)
+
 # -------------------- Price helpers --------------------
 
-def get_live_price(symbol: str, timeout: float = 1.5) -> float:
+# get_live_price() comes from app.services.price_service: an in-process cache
+# read (no HTTP loopback to our own /quotes). Returns 0.0 if we can't price.
+
+
+# -------------------- Position ledger --------------------
+
+def _on_fills(c: sqlite3.Cursor, fills):
     """
-    Fetch live price from our /quotes endpoint.
-    Uses a sane timeout, a couple of quick retries, and robust float parsing.
-    Returns 0.0 only if we truly can't get a price.
+    Fill hook: call for every Closed row written (same transaction).
+    `fills` = iterable of (username, script, side, qty, stoploss, target, segment).
+    Bumps today's net qty and, if the fill carries a level, makes it the
+    latest long (BUY) / short (SELL) SL/target for the pair.
     """
-    url = f"http://127.0.0.1:8000/quotes?symbols={symbol}"
-    for _ in range(3):  # quick retries
-        try:
-            resp = requests.get(url, timeout=timeout)
-            arr = resp.json() or []
-            if not arr or not isinstance(arr[0], dict):
-                continue
-            px = arr[0].get("price")
-            # handle strings like "53", "53.00", or "₹53.00"
-            if isinstance(px, str):
-                px = px.replace("₹", "").replace(",", "").strip()
-            val = float(px)
-            if val > 0:
-                return val
-        except Exception:
-            pass
-    return 0.0
+    fills = list(fills)
+    if not fills:
+        return
+    c.executemany(
+        """
+        INSERT INTO position_ledger (trade_date, username, script, net_qty, updated_at)
+        VALUES (date('now','localtime'), ?, ?, ?, datetime('now','localtime'))
+        ON CONFLICT(trade_date, username, script)
+        DO UPDATE SET net_qty = net_qty + excluded.net_qty, updated_at = excluded.updated_at
+        """,
+        [(u, s, int(q) if str(side).upper() == "BUY" else -int(q)) for u, s, side, q, _sl, _tgt, _seg in fills],
+    )
+    _touch_positions(c, {(u, (s or "").upper()) for u, s, *_ in fills})
+    for side, prefix in (("BUY", "long"), ("SELL", "short")):
+        levels = [
+            (sl, tgt, seg, u, s)
+            for u, s, sd, _q, sl, tgt, seg in fills
+            if str(sd).upper() == side and (_clean_level(sl) or _clean_level(tgt))
+        ]
+        if levels:
+            c.executemany(
+                f"""
+                UPDATE position_ledger
+                   SET {prefix}_sl=?, {prefix}_tgt=?, {prefix}_seg=?
+                 WHERE trade_date=date('now','localtime') AND username=? AND script=?
+                """,
+                levels,
+            )
+
+def _touch_positions(c: sqlite3.Cursor, keys, trade_date: Optional[str] = None):
+    """Mark today's Positions state for these (username, SCRIPT) pairs stale."""
+    c.executemany(
+        """
+        INSERT INTO position_state (trade_date, username, script, version, dirty, updated_at)
+        VALUES (COALESCE(?, date('now','localtime')), ?, ?, 1, 1, datetime('now','localtime'))
+        ON CONFLICT(trade_date, username, script)
+        DO UPDATE SET version = version + 1, dirty = 1, updated_at = excluded.updated_at
+        """,
+        [(trade_date, u, s) for u, s in keys],
+    )
 
+def _on_fill(c: sqlite3.Cursor, username: str, script: str, side: str, qty: int,
+             stoploss=None, target=None, segment=None):
+    _on_fills(c, [(username, script, side, qty, stoploss, target, segment)])
+
+def _rebuild_ledger(c: sqlite3.Cursor, username: Optional[str] = None, script: Optional[str] = None):
+    """
+    Recompute today's ledger rows from orders (all users, one user, or one
+    user+script). Call after paths that DELETE Closed rows, and on startup.
+    """
+    today = _now_ist().strftime("%Y-%m-%d")
+    where, args = "", [today]
+    if username is not None:
+        where += " AND username=?"
+        args.append(username)
+    if script is not None:
+        where += " AND script=?"
+        args.append(script)
+
+    c.execute(f"DELETE FROM position_ledger WHERE trade_date=?{where}", args)
+    c.execute(
+        f"""
+        SELECT username, script, order_type, qty, stoploss, target, segment
+          FROM orders
+         WHERE status='Closed' AND substr(datetime,1,10)=?{where}
+         ORDER BY datetime ASC, id ASC
+        """,
+        args,
+    )
+    ledger: Dict[tuple, list] = {}
+    for u, s, side, qty, sl, tgt, seg in c.fetchall():
+        e = ledger.setdefault((u, s), [0, None, None, None, None, None, None])
+        buy = str(side).upper() == "BUY"
+        e[0] += int(qty or 0) if buy else -int(qty or 0)
+        if _clean_level(sl) or _clean_level(tgt):
+            if buy:
+                e[1:4] = [sl, tgt, seg]
+            else:
+                e[4:7] = [sl, tgt, seg]
+    c.executemany(
+        """
+        INSERT INTO position_ledger
+          (trade_date, username, script, net_qty, long_sl, long_tgt, long_seg,
+           short_sl, short_tgt, short_seg, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now','localtime'))
+        """,
+        [(today, u, s, *e) for (u, s), e in ledger.items()],
+    )
+    # rows may have been deleted: every pair in scope gets replayed on next read
+    c.execute(
+        f"""
+        UPDATE position_state SET version = version + 1, dirty = 1
+         WHERE trade_date=?{where.replace("script=?", "script=UPPER(?)")}
+        """,
+        args,
+    )
+    _touch_positions(c, {(u, (s or "").upper()) for u, s in ledger}, today)
+
+def _ensure_ledger(conn: sqlite3.Connection, c: sqlite3.Cursor):
+    """Once per process: rebuild today's ledger/positions from orders, drop older days."""
+    global _LEDGER_READY
+    if _LEDGER_READY:
+        return
+    # fills made before this process started (or by an older build)
+    today = _now_ist().strftime("%Y-%m-%d")
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("DELETE FROM position_ledger WHERE trade_date < ?", (today,))
+    c.execute("DELETE FROM position_state WHERE trade_date < ?", (today,))
+    _rebuild_ledger(c)
+    conn.commit()
+    _LEDGER_READY = True
+
+def _sl_target_exits(ledger_rows, live_by_script: Dict[str, float]):
+    """
+    SL/target decisions for ledger rows
+    (username, script, net_qty, long_sl, long_tgt, long_seg, short_sl, short_tgt, short_seg).
+    Returns (username, script, exit side, qty, live, segment, sl, target) per exit.
+    """
+    exits = []
+    for username, script, net, l_sl, l_tgt, l_seg, s_sl, s_tgt, s_seg in ledger_rows:
+        net = int(net or 0)
+        if net == 0:
+            continue
+        live = live_by_script.get((script or "").upper(), 0.0)
+        if not live or live <= 0:
+            continue
+
+        # LONG net -> levels of the last BUY; SHORT net -> last SELL (SELL FIRST)
+        sl, tgt, seg = (l_sl, l_tgt, l_seg) if net > 0 else (s_sl, s_tgt, s_seg)
+        sl  = _clean_level(sl)
+        tgt = _clean_level(tgt)
+        if sl is None and tgt is None:
+            continue
+        seg = (seg or "intraday").lower()
+
+        # Long:  exit when live >= target OR live <= stoploss
+        # ✅ Your SELL FIRST convention for shorts:
+        #        auto-cover when live <= stoploss  OR  live >= target
+        if (tgt is not None and ge(live, tgt)) or (sl is not None and le(live, sl)):
+            exits.append((username, script, "SELL" if net > 0 else "BUY", abs(net), float(live), seg, sl, tgt))
+    return exits
+
+def _read_ledger(c: sqlite3.Cursor, today: str):
+    c.execute(
+        """
+        SELECT username, script, net_qty, long_sl, long_tgt, long_seg, short_sl, short_tgt, short_seg
+          FROM position_ledger
+         WHERE trade_date=? AND net_qty != 0
+        """,
+        (today,),
+    )
+    return c.fetchall()
 
 # -------------------- Common insert helpers --------------------
 
@@ -310,6 +825,7 @@ def _insert_closed(
         (username, script, side.upper(), qty, float(price), (segment or "intraday").lower(),
          stoploss, target, int(is_short)),
     )
+    _on_fill(c, username, script, side.upper(), qty, stoploss, target, (segment or "intraday").lower())
 
 
 def _sum_closed(c: sqlite3.Cursor, username: str, script: str, side: str) -> int:
@@ -400,6 +916,7 @@ def _cancel_open_limit_and_refund(c: sqlite3.Cursor, username: str, segment: Opt
         )
     else:
         c.execute("UPDATE orders SET status='Cancelled' WHERE username=? AND status='Open'", (username,))
+    TRIGGER_BOOK.remove_many(oid for oid, *_ in rows)
 
 def run_eod_pipeline(username: str):
     """
@@ -414,17 +931,22 @@ def run_eod_pipeline(username: str):
         - SELL FIRST remainder     -> auto BUY at LIVE and add to portfolio (no history)
 
     Also cancels all still-open limit orders and refunds BUY blocks.
-    Idempotent.
+    Idempotent. Returns how many square-offs were skipped for lack of a
+    tradable price; those positions are left as they are for a rerun.
     """
     if not is_after_market_close():
-        return
+        return 0
+    skipped = 0
 
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     try:
         _ensure_tables(c)
-        _ensure_funds_row(c, username)
+        conn.commit()
         today = _now_ist().strftime("%Y-%m-%d")
+        # FIFO lots carried into today, for the P&L rollup below
+        book = _realize_past_days(conn, c, username, today)
+        _ensure_funds_row(c, username)
 
         # 0) Cancel still-open limits (both segments) and refund BUY blocks
         _cancel_open_limit_and_refund(c, username, segment="intraday")
@@ -448,6 +970,7 @@ def run_eod_pipeline(username: str):
 
             live = get_live_price(script)
             if live <= 0:
+                skipped += 1
                 continue
 
             if net > 0:
@@ -479,6 +1002,10 @@ def run_eod_pipeline(username: str):
                   VALUES (?, ?, ?, ?, datetime('now','localtime'), 'intraday', 'BUY')
                 """, (username, script, qty, live))
 
+        # P&L rollup now, while today's delivery BUY / SELL FIRST rows still
+        # exist: step 2 deletes them, and their turnover and qty with them.
+        _rollup_today(c, username, today, book)
+
         # 2) DELIVERY: normal sells -> history, long remainders -> portfolio,
         #              SELL FIRST remainder -> auto BUY at LIVE and add to portfolio.
         c.execute("""
@@ -526,8 +1053,13 @@ def run_eod_pipeline(username: str):
             sells_shortfirst = [(int(q), float(p)) for q, p in c.fetchall()]
             sell_sf_qty = sum(q for q, _ in sells_shortfirst)
 
-            # 2a) normal sells -> history
-            for q, p in sells_normal:
+            # 2a) normal sells -> history (a rerun skips the ones already recorded)
+            c.execute("""
+                SELECT COUNT(*) FROM portfolio_exits
+                 WHERE username=? AND script=? AND segment='delivery' AND exit_side='SELL'
+                   AND substr(datetime,1,10)=?
+            """, (username, script, today))
+            for q, p in sells_normal[int(c.fetchone()[0] or 0):]:
                 c.execute("""
                     INSERT INTO portfolio_exits (username, script, qty, price, datetime, segment, exit_side)
                     VALUES (?, ?, ?, ?, datetime('now','localtime'), 'delivery', 'SELL')
@@ -552,10 +1084,13 @@ def run_eod_pipeline(username: str):
             if net_today < 0 and sell_sf_qty > 0:
                 qty_to_buy = abs(net_today)
                 live = get_live_price(script)
-                if live > 0 and qty_to_buy > 0:
-                    c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?",
-                              (live * qty_to_buy, username))
-                    _upsert_portfolio(c, username, script, qty_to_buy, live)
+                if live <= 0:
+                    # keep the SELL FIRST rows so a rerun can still cover them
+                    skipped += 1
+                    continue
+                c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?",
+                          (live * qty_to_buy, username))
+                _upsert_portfolio(c, username, script, qty_to_buy, live)
 
                 # remove today's SELL FIRST rows so they don't linger in history/positions
                 c.execute("""
@@ -565,7 +1100,10 @@ def run_eod_pipeline(username: str):
                        AND substr(datetime,1,10)=?
                 """, (username, script, today))
 
+        # square-offs were inserted and delivery rows deleted above
+        _rebuild_ledger(c, username)
         conn.commit()
+        return skipped
     except Exception as e:
         conn.rollback()
         print("⚠️ run_eod_pipeline error:", e)
@@ -574,8 +1112,12 @@ def run_eod_pipeline(username: str):
         conn.close()
 
 def _run_eod_if_due(username: str):
-    """Run once at/after cutoff; safe to call from views."""
-    if is_after_market_close():
+    """
+    Run once at/after cutoff; safe to call from views. Only the engine
+    leader mutates: other processes (API workers with RUN_ENGINE_IN_API=0,
+    followers) leave it to the leader's _run_eod_sweep().
+    """
+    if is_after_market_close() and LEASE.is_leader():
         run_eod_pipeline(username)
 
 def _sum_closed_today_any(c: sqlite3.Cursor, username: str, script: str, side: str) -> int:
@@ -803,6 +1345,7 @@ def _move_positions_to_portfolio_or_history(username: str):
            WHERE username=? AND status='Closed'
              AND substr(datetime,1,10)=?
         """, (username, today))
+        _rebuild_ledger(c, username)
 
         conn.commit()
     except Exception as e:
@@ -876,268 +1419,302 @@ def run_eod(username: str):
 
 # -------------------- Place order --------------------
 
-@router.post("", response_model=Dict[str, Any])   # ✅ no trailing slash
-def place_order(order: OrderData):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        _ensure_tables(c)
-
-        script = order.script.upper()
-        seg = (order.segment or "intraday").lower()
-        side_buy = order.order_type.upper() == "BUY"
-        trigger_price = float(order.price or 0.0)
-        qty_req = int(order.qty)
-        if qty_req <= 0:
-            raise HTTPException(status_code=400, detail="Quantity must be greater than zero.")
-
-        live_price = get_live_price(script)
-        available = _ensure_funds_row(c, order.username)
-
-        # -------- SELL flow --------
-        if not side_buy:
-            today = _now_ist().strftime("%Y-%m-%d")
+def _place_order_txn(c: sqlite3.Cursor, order: OrderData, live_price: float,
+                     price_age: Optional[float], opened: list) -> Dict[str, Any]:
+    """
+    Place one order on an open cursor: validate, execute or insert as Open.
+    Does NOT commit. Orders left Open are appended to `opened` as
+    (id, script, side, trigger, is_short) for _track_opened() after commit.
+    Raises HTTPException on validation errors.
+    """
+    script = order.script.upper()
+    seg = (order.segment or "intraday").lower()
+    side_buy = order.order_type.upper() == "BUY"
+    trigger_price = float(order.price or 0.0)
+    qty_req = int(order.qty)
+    if qty_req <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be greater than zero.")
+
+    # Never fill on a price we can't date: get_prices_within() already
+    # zeroes fallback ticks and anything past ORDER_PRICE_REJECT_AGE.
+    if price_age is None:
+        live_price = 0.0
+    price_age = round(price_age, 3) if price_age is not None else None
+    no_price = (f"Quotes stale or offline (last price {price_age:.0f}s old) — use LIMIT."
+                if price_age is not None else "Market closed or quotes unavailable — use LIMIT.")
+    available = _ensure_funds_row(c, order.username)
+
+    # -------- SELL flow --------
+    if not side_buy:
+        today = _now_ist().strftime("%Y-%m-%d")
 
-            # Today's net BUYs
-            c.execute(
-                """
-                SELECT COALESCE(SUM(CASE WHEN order_type='BUY' THEN qty ELSE 0 END),0) -
-                       COALESCE(SUM(CASE WHEN order_type='SELL' THEN qty ELSE 0 END),0)
-                  FROM orders
-                 WHERE username=? AND script=? AND status='Closed'
-                   AND substr(datetime,1,10)=?
-                """,
-                (order.username, script, today),
-            )
-            today_net_buy = int(c.fetchone()[0] or 0)
+        # Today's net BUYs
+        c.execute(
+            """
+            SELECT COALESCE(SUM(CASE WHEN order_type='BUY' THEN qty ELSE 0 END),0) -
+                   COALESCE(SUM(CASE WHEN order_type='SELL' THEN qty ELSE 0 END),0)
+              FROM orders
+             WHERE username=? AND script=? AND status='Closed'
+               AND substr(datetime,1,10)=?
+            """,
+            (order.username, script, today),
+        )
+        today_net_buy = int(c.fetchone()[0] or 0)
 
-            # Portfolio holdings
-            c.execute(
-                "SELECT COALESCE(SUM(qty),0) FROM portfolio WHERE username=? AND script=?",
-                (order.username, script),
+        # Portfolio holdings
+        c.execute(
+            "SELECT COALESCE(SUM(qty),0) FROM portfolio WHERE username=? AND script=?",
+            (order.username, script),
+        )
+        portfolio_qty = int(c.fetchone()[0] or 0)
+
+        owned_total = today_net_buy + portfolio_qty
+        qty_to_sell = qty_req
+        capped = False
+
+        if owned_total == 0 and not order.allow_short:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "code": "NEEDS_CONFIRM_SHORT",
+                    "message": f"You didn't buy {script}. Do you still want to sell first?",
+                    "script": script,
+                    "requested_qty": qty_req,
+                    "owned_qty": 0
+                }
             )
-            portfolio_qty = int(c.fetchone()[0] or 0)
-
-            owned_total = today_net_buy + portfolio_qty
-            qty_to_sell = qty_req
-            capped = False
-
-            if owned_total == 0 and not order.allow_short:
-                raise HTTPException(
-                    status_code=409,
-                    detail={
-                        "code": "NEEDS_CONFIRM_SHORT",
-                        "message": f"You didn't buy {script}. Do you still want to sell first?",
-                        "script": script,
-                        "requested_qty": qty_req,
-                        "owned_qty": 0
-                    }
-                )
-
-            if owned_total > 0 and qty_req > owned_total and not order.allow_short:
-                qty_to_sell = owned_total
-                capped = True
 
-            will_short = 0
-            if order.allow_short and qty_to_sell > owned_total:
-                will_short = 1
+        if owned_total > 0 and qty_req > owned_total and not order.allow_short:
+            qty_to_sell = owned_total
+            capped = True
 
-            # MARKET SELL
-            if trigger_price == 0:
-                if live_price <= 0:
-                    raise HTTPException(status_code=400, detail="Market closed or quotes unavailable — use LIMIT.")
+        will_short = 0
+        if order.allow_short and qty_to_sell > owned_total:
+            will_short = 1
 
-                # credit funds
-                c.execute(
-                    "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
-                    (live_price * qty_to_sell, order.username),
-                )
+        # MARKET SELL
+        if trigger_price == 0:
+            if live_price <= 0:
+                raise HTTPException(status_code=400, detail=no_price)
 
-                # reduce portfolio
-                consume_today = max(0, min(qty_to_sell, today_net_buy))
-                remaining_after_today = qty_to_sell - consume_today
-                consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
-
-                if consume_portfolio > 0:
-                    new_portfolio_qty = portfolio_qty - consume_portfolio
-                    if new_portfolio_qty == 0:
-                        c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
-                    else:
-                        c.execute(
-                            "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
-                            (new_portfolio_qty, order.username, script),
-                        )
-
-                # record execution
-                c.execute(
-                    """
-                    INSERT INTO orders
-                      (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
-                    VALUES
-                      (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, ?)
-                    """,
-                    (order.username, script, qty_to_sell, live_price, seg, order.stoploss, order.target, int(will_short)),
-                )
+            # credit funds
+            c.execute(
+                "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
+                (live_price * qty_to_sell, order.username),
+            )
 
-                conn.commit()
-                return {
-                    "success": True, "message": "EXECUTED", "triggered": True,
-                    "segment": seg, "capped_to_owned": capped,
-                    "executed_qty": qty_to_sell, "short_first": bool(will_short),
-                }
+            # reduce portfolio
+            consume_today = max(0, min(qty_to_sell, today_net_buy))
+            remaining_after_today = qty_to_sell - consume_today
+            consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
 
-            # LIMIT SELL
-            if trigger_price > 0 and live_price > 0:
-                if will_short:
-                    # ✅ SELL FIRST: execute only when live <= trigger; fill at TRIGGER
-                    if le(live_price, trigger_price):
-                        exec_price = trigger_price
-                        credit = exec_price * qty_to_sell
-
-                        # credit funds
-                        c.execute(
-                            "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
-                            (credit, order.username),
-                        )
-
-                        # reduce portfolio if any (same logic as market sell)
-                        consume_today = max(0, min(qty_to_sell, today_net_buy))
-                        remaining_after_today = qty_to_sell - consume_today
-                        consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
-
-                        if consume_portfolio > 0:
-                            new_portfolio_qty = portfolio_qty - consume_portfolio
-                            if new_portfolio_qty == 0:
-                                c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
-                            else:
-                                c.execute(
-                                    "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
-                                    (new_portfolio_qty, order.username, script),
-                                )
-
-                        # record execution at TRIGGER price
-                        c.execute(
-                            """
-                            INSERT INTO orders
-                              (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
-                            VALUES
-                              (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, 1)
-                            """,
-                            (order.username, script, qty_to_sell, exec_price, seg, order.stoploss, order.target),
-                        )
-
-                        conn.commit()
-                        return {
-                            "success": True, "message": "EXECUTED", "triggered": True,
-                            "segment": seg, "capped_to_owned": capped,
-                            "executed_qty": qty_to_sell, "short_first": True,
-                        }
-                    # else: fall through to place as Open
+            if consume_portfolio > 0:
+                new_portfolio_qty = portfolio_qty - consume_portfolio
+                if new_portfolio_qty == 0:
+                    c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
                 else:
-                    # Normal (non-short) SELL: execute when live >= trigger; fill at LIVE
-                    if ge(live_price, trigger_price):
-                        # credit funds at live
-                        c.execute(
-                            "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
-                            (live_price * qty_to_sell, order.username),
-                        )
-
-                        # reduce portfolio like MARKET SELL
-                        consume_today = max(0, min(qty_to_sell, today_net_buy))
-                        remaining_after_today = qty_to_sell - consume_today
-                        consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
-
-                        if consume_portfolio > 0:
-                            new_portfolio_qty = portfolio_qty - consume_portfolio
-                            if new_portfolio_qty == 0:
-                                c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
-                            else:
-                                c.execute(
-                                    "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
-                                    (new_portfolio_qty, order.username, script),
-                                )
-
-                        # record execution at LIVE price
-                        c.execute(
-                            """
-                            INSERT INTO orders
-                              (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
-                            VALUES
-                              (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, 0)
-                            """,
-                            (order.username, script, qty_to_sell, live_price, seg, order.stoploss, order.target),
-                        )
-
-                        conn.commit()
-                        return {
-                            "success": True, "message": "EXECUTED", "triggered": True,
-                            "segment": seg, "capped_to_owned": capped,
-                            "executed_qty": qty_to_sell, "short_first": False,
-                        }
-
-            # Otherwise place LIMIT SELL as Open (no SL/Target trigger while open)
+                    c.execute(
+                        "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
+                        (new_portfolio_qty, order.username, script),
+                    )
+
+            # record execution
             c.execute(
                 """
                 INSERT INTO orders
                   (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
-                VALUES (?, ?, 'SELL', ?, ?, ?, ?, 'Open', ?, NULL, ?, ?, ?)
+                VALUES
+                  (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, ?)
                 """,
-                (order.username, script, qty_to_sell, trigger_price,
-                 (order.exchange or "NSE").upper(), seg,
-                 _now_ist().strftime("%Y-%m-%d %H:%M:%S"),
-                 order.stoploss, order.target, int(will_short)),
+                (order.username, script, qty_to_sell, live_price, seg, order.stoploss, order.target, int(will_short)),
             )
-            conn.commit()
+            _on_fill(c, order.username, script, "SELL", qty_to_sell, order.stoploss, order.target, seg)
+
             return {
-                "success": True, "message": "PLACED", "triggered": False,
+                "success": True, "message": "EXECUTED", "triggered": True,
                 "segment": seg, "capped_to_owned": capped,
-                "placed_qty": qty_to_sell, "short_first": bool(will_short),
+                "executed_qty": qty_to_sell, "short_first": bool(will_short),
+                "price_age": price_age,
             }
 
-        # -------- BUY flow --------
+        # LIMIT SELL
+        if trigger_price > 0 and live_price > 0:
+            if will_short:
+                # ✅ SELL FIRST: execute only when live <= trigger; fill at TRIGGER
+                if le(live_price, trigger_price):
+                    exec_price = trigger_price
+                    credit = exec_price * qty_to_sell
 
-        # MARKET BUY
-        if trigger_price == 0:
-            if live_price <= 0:
-                raise HTTPException(status_code=400, detail="Market closed or quotes unavailable — use LIMIT.")
-            cost = live_price * qty_req
-            if available < cost:
-                raise HTTPException(status_code=400, detail="❌ Insufficient funds")
-            c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?", (cost, order.username))
-            _insert_closed(c, order.username, script, "BUY", qty_req, live_price, seg,
-                           stoploss=order.stoploss, target=order.target)
-            conn.commit()
-            return {"success": True, "message": "EXECUTED", "triggered": True, "segment": seg}
-
-        # LIMIT BUY
-        # User error auto-correct: if live <= limit, execute now at LIVE
-        if trigger_price > 0 and live_price > 0 and le(live_price, trigger_price):
-            exec_price = live_price
-            cost = exec_price * qty_req
-            if available < cost:
-                raise HTTPException(status_code=400, detail="❌ Insufficient funds")
-            c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?", (cost, order.username))
-            _insert_closed(c, order.username, script, "BUY", qty_req, exec_price, seg,
-                           stoploss=order.stoploss, target=order.target)
-            conn.commit()
-            return {"success": True, "message": "EXECUTED", "triggered": True, "segment": seg}
+                    # credit funds
+                    c.execute(
+                        "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
+                        (credit, order.username),
+                    )
+
+                    # reduce portfolio if any (same logic as market sell)
+                    consume_today = max(0, min(qty_to_sell, today_net_buy))
+                    remaining_after_today = qty_to_sell - consume_today
+                    consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
+
+                    if consume_portfolio > 0:
+                        new_portfolio_qty = portfolio_qty - consume_portfolio
+                        if new_portfolio_qty == 0:
+                            c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
+                        else:
+                            c.execute(
+                                "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
+                                (new_portfolio_qty, order.username, script),
+                            )
+
+                    # record execution at TRIGGER price
+                    c.execute(
+                        """
+                        INSERT INTO orders
+                          (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
+                        VALUES
+                          (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, 1)
+                        """,
+                        (order.username, script, qty_to_sell, exec_price, seg, order.stoploss, order.target),
+                    )
+                    _on_fill(c, order.username, script, "SELL", qty_to_sell, order.stoploss, order.target, seg)
+
+                    return {
+                        "success": True, "message": "EXECUTED", "triggered": True,
+                        "segment": seg, "capped_to_owned": capped,
+                        "executed_qty": qty_to_sell, "short_first": True,
+                        "price_age": price_age,
+                    }
+                # else: fall through to place as Open
+            else:
+                # Normal (non-short) SELL: execute when live >= trigger; fill at LIVE
+                if ge(live_price, trigger_price):
+                    # credit funds at live
+                    c.execute(
+                        "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
+                        (live_price * qty_to_sell, order.username),
+                    )
 
-        # Otherwise place as OPEN (no SL/Target trigger while open)
+                    # reduce portfolio like MARKET SELL
+                    consume_today = max(0, min(qty_to_sell, today_net_buy))
+                    remaining_after_today = qty_to_sell - consume_today
+                    consume_portfolio = max(0, min(remaining_after_today, portfolio_qty))
+
+                    if consume_portfolio > 0:
+                        new_portfolio_qty = portfolio_qty - consume_portfolio
+                        if new_portfolio_qty == 0:
+                            c.execute("DELETE FROM portfolio WHERE username=? AND script=?", (order.username, script))
+                        else:
+                            c.execute(
+                                "UPDATE portfolio SET qty=?, updated_at=datetime('now','localtime') WHERE username=? AND script=?",
+                                (new_portfolio_qty, order.username, script),
+                            )
+
+                    # record execution at LIVE price
+                    c.execute(
+                        """
+                        INSERT INTO orders
+                          (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
+                        VALUES
+                          (?, ?, 'SELL', ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, 0)
+                        """,
+                        (order.username, script, qty_to_sell, live_price, seg, order.stoploss, order.target),
+                    )
+                    _on_fill(c, order.username, script, "SELL", qty_to_sell, order.stoploss, order.target, seg)
+
+                    return {
+                        "success": True, "message": "EXECUTED", "triggered": True,
+                        "segment": seg, "capped_to_owned": capped,
+                        "executed_qty": qty_to_sell, "short_first": False,
+                        "price_age": price_age,
+                    }
+
+        # Otherwise place LIMIT SELL as Open (no SL/Target trigger while open)
         c.execute(
             """
             INSERT INTO orders
-              (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target)
-            VALUES (?, ?, 'BUY', ?, ?, ?, ?, 'Open', ?, NULL, ?, ?)
+              (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
+            VALUES (?, ?, 'SELL', ?, ?, ?, ?, 'Open', ?, NULL, ?, ?, ?)
             """,
-            (
-                order.username, script, qty_req, trigger_price,
-                (order.exchange or "NSE").upper(), seg,
-                _now_ist().strftime("%Y-%m-%d %H:%M:%S"),
-                order.stoploss, order.target,
-            ),
+            (order.username, script, qty_to_sell, trigger_price,
+             (order.exchange or "NSE").upper(), seg,
+             _now_ist().strftime("%Y-%m-%d %H:%M:%S"),
+             order.stoploss, order.target, int(will_short)),
         )
+        opened.append((c.lastrowid, script, "SELL", trigger_price, int(will_short)))
+        return {
+            "success": True, "message": "PLACED", "triggered": False,
+            "segment": seg, "capped_to_owned": capped,
+            "placed_qty": qty_to_sell, "short_first": bool(will_short),
+            "order_id": c.lastrowid,
+            "price_age": price_age,
+        }
+
+    # -------- BUY flow --------
+
+    # MARKET BUY
+    if trigger_price == 0:
+        if live_price <= 0:
+            raise HTTPException(status_code=400, detail=no_price)
+        cost = live_price * qty_req
+        if available < cost:
+            raise HTTPException(status_code=400, detail="❌ Insufficient funds")
+        c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?", (cost, order.username))
+        _insert_closed(c, order.username, script, "BUY", qty_req, live_price, seg,
+                       stoploss=order.stoploss, target=order.target)
+        return {"success": True, "message": "EXECUTED", "triggered": True, "segment": seg, "price_age": price_age}
+
+    # LIMIT BUY
+    # User error auto-correct: if live <= limit, execute now at LIVE
+    if trigger_price > 0 and live_price > 0 and le(live_price, trigger_price):
+        exec_price = live_price
+        cost = exec_price * qty_req
+        if available < cost:
+            raise HTTPException(status_code=400, detail="❌ Insufficient funds")
+        c.execute("UPDATE funds SET available_amount = available_amount - ? WHERE username=?", (cost, order.username))
+        _insert_closed(c, order.username, script, "BUY", qty_req, exec_price, seg,
+                       stoploss=order.stoploss, target=order.target)
+        return {"success": True, "message": "EXECUTED", "triggered": True, "segment": seg, "price_age": price_age}
+
+    # Otherwise place as OPEN (no SL/Target trigger while open)
+    c.execute(
+        """
+        INSERT INTO orders
+          (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target)
+        VALUES (?, ?, 'BUY', ?, ?, ?, ?, 'Open', ?, NULL, ?, ?)
+        """,
+        (
+            order.username, script, qty_req, trigger_price,
+            (order.exchange or "NSE").upper(), seg,
+            _now_ist().strftime("%Y-%m-%d %H:%M:%S"),
+            order.stoploss, order.target,
+        ),
+    )
+    opened.append((c.lastrowid, script, "BUY", trigger_price, 0))
+    return {"success": True, "message": "PLACED", "triggered": False, "segment": seg,
+            "order_id": c.lastrowid, "price_age": price_age}
+
+
+def _track_opened(opened: list):
+    """After commit: index newly Open orders for the matcher."""
+    for order_id, script, side, trigger, is_short in opened:
+        TRIGGER_BOOK.add(order_id, script, side, trigger, is_short)
+    _engine_watch([o[1] for o in opened])
+
+
+@router.post("", response_model=Dict[str, Any])   # ✅ no trailing slash
+def place_order(order: OrderData):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    try:
+        _ensure_tables(c)
+
+        # Latency budget: a recent cached tick, else one short-deadline fetch.
+        live_price, price_age = get_price_within(order.script.upper())
+        opened: list = []
+        result = _place_order_txn(c, order, live_price, price_age, opened)
         conn.commit()
-        return {"success": True, "message": "PLACED", "triggered": False, "segment": seg}
+        _track_opened(opened)
+        return result
 
     except HTTPException:
         conn.rollback()
@@ -1149,9 +1726,95 @@ def place_order(order: OrderData):
         conn.close()
 
 
-def process_open_orders():
+# Largest basket accepted by POST /orders/batch
+BATCH_MAX_LEGS = int(os.getenv("BATCH_MAX_LEGS", "100"))
+
+@router.post("/batch", response_model=Dict[str, Any])
+def place_orders_batch(batch: BatchOrderData):
+    """
+    Place a basket in ONE transaction with ONE price snapshot.
+
+    Legs run in order against the same transaction, so funds and holdings
+    are checked for the basket as a whole: a second BUY sees the funds the
+    first one spent, a SELL sees what an earlier leg bought. Each leg gets
+    its own result (same shape as POST /orders, or the error).
+
+    atomic=True (default): any failing leg rolls back the whole basket
+    (HTTP 400, per-leg results in detail). atomic=False: failing legs are
+    skipped, the rest are committed.
+    """
+    legs = batch.orders or []
+    if not legs:
+        raise HTTPException(status_code=400, detail="No orders provided")
+    if len(legs) > BATCH_MAX_LEGS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_LEGS} orders per batch")
+
+    prices = get_prices_within(leg.script for leg in legs)
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    try:
+        _ensure_tables(c)
+        conn.commit()
+        c.execute("BEGIN IMMEDIATE")
+
+        results: List[Dict[str, Any]] = []
+        opened: list = []
+        failed = 0
+        for i, leg in enumerate(legs):
+            script = (leg.script or "").upper().strip()
+            live_price, price_age = prices.get(script, (0.0, None))
+            leg_opened: list = []
+            c.execute("SAVEPOINT leg")
+            try:
+                res = _place_order_txn(c, leg, live_price, price_age, leg_opened)
+                c.execute("RELEASE SAVEPOINT leg")
+                opened += leg_opened
+                results.append({"leg": i, "script": script, **res})
+            except Exception as e:
+                c.execute("ROLLBACK TO SAVEPOINT leg")
+                c.execute("RELEASE SAVEPOINT leg")
+                failed += 1
+                status = e.status_code if isinstance(e, HTTPException) else 400
+                detail = e.detail if isinstance(e, HTTPException) else f"❌ Order failed: {str(e)}"
+                results.append({"leg": i, "script": script, "success": False,
+                                "status_code": status, "detail": detail})
+
+        if failed and batch.atomic:
+            conn.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "code": "BASKET_REJECTED",
+                    "message": f"{failed} of {len(legs)} order(s) failed; nothing was placed.",
+                    "results": results,
+                },
+            )
+
+        conn.commit()
+        _track_opened(opened)
+        ok = [r for r in results if r.get("success")]
+        return {
+            "success": failed == 0,
+            "executed": sum(1 for r in ok if r.get("message") == "EXECUTED"),
+            "placed": sum(1 for r in ok if r.get("message") == "PLACED"),
+            "failed": failed,
+            "results": results,
+        }
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=400, detail=f"❌ Batch failed: {str(e)}")
+    finally:
+        conn.close()
+
+
+def process_open_orders(symbols: Optional[List[str]] = None):
     """
-    Background job (run every few seconds):
+    Matching cycle: the timer sweep (symbols=None, everything) or the tick
+    engine (symbols = the ones that just ticked).
 
       PASS 1) Trigger OPEN limit orders strictly on their trigger price.
               • BUY executes when live <= trigger (fills at trigger).
@@ -1164,234 +1827,184 @@ def process_open_orders():
               • If today's net is SHORT (<0): auto BUY  qty at LIVE when live <= stoploss OR live >= target.
                 (Matches your SELL FIRST convention: SL=lower bound, Target=upper bound.)
               Funds are adjusted, a Closed row is inserted, and a portfolio_exits row is recorded.
+
+      Both passes read ONE batched price snapshot taken at the start of the
+      cycle (one upstream call for all distinct symbols, not one per order).
+      Decisions are made in memory and written in ONE short write
+      transaction (BEGIN IMMEDIATE + executemany): no per-order claim
+      commits, and a second runner simply waits for the lock.
     """
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     try:
         _ensure_tables(c)
+        conn.commit()
 
-        # ---------------- PASS 1: trigger OPEN orders (with atomic claim; execute IN-PLACE) ----------------
-        c.execute("""
-            SELECT id, username, script, order_type, qty, price, segment, stoploss, target, is_short
-              FROM orders
-             WHERE status='Open'
-             ORDER BY datetime ASC, id ASC
-        """)
-        rows = c.fetchall()
+        _ensure_ledger(conn, c)
 
-        for row in rows:
-            order_id, username, script, side, qty, trigger_price, segment, stoploss, target, is_short = row
+        if not TRIGGER_BOOK.loaded or _time.monotonic() - _BOOK_LOADED_AT >= TRIGGER_BOOK_RESYNC:
+            _load_trigger_book(c)
+        else:
+            _refresh_trigger_book(c)
 
-            # Atomically "claim" this row so only one runner handles it.
-            c.execute("UPDATE orders SET status='Processing' WHERE id=? AND status='Open'", (order_id,))
-            if c.rowcount == 0:
-                continue
-            conn.commit()  # make the claim visible immediately
+        # tick arrival times for the symbols evaluated now (trigger-to-fill metric)
+        only = {(s or "").upper() for s in symbols} if symbols is not None else None
+        seen = ENGINE.take_dirty(only)
+
+        # PASS 2 candidates (non-flat ledger rows) up front, so the whole cycle is
+        # priced from ONE batched snapshot of every distinct symbol.
+        today = _now_ist().strftime("%Y-%m-%d")
+        ledger_rows = _read_ledger(c, today)
+        book_syms = TRIGGER_BOOK.symbols()
+
+        wanted = set(book_syms) | {(r[1] or "").upper() for r in ledger_rows}
+        if only is None:
+            _engine_watch(wanted, replace=True)
+        else:
+            wanted &= only
+            book_syms = [sym for sym in book_syms if sym in only]
+            ledger_rows = [r for r in ledger_rows if (r[1] or "").upper() in only]
+        if not wanted:
+            return
+        live_by_script: Dict[str, float] = get_live_prices(sorted(wanted))
+
+        crossed: List[int] = TRIGGER_BOOK.crossed_all({sym: live_by_script.get(sym, 0.0) for sym in book_syms})
+        if not crossed and not _sl_target_exits(ledger_rows, live_by_script):
+            return      # nothing to write this cycle
+
+        # ---------------- one write transaction for the whole cycle ----------------
+        c.execute("BEGIN IMMEDIATE")
+        funds_delta: Dict[str, float] = {}
+
+        # ---------------- PASS 1: trigger OPEN orders (execute IN-PLACE) ----------------
+        rows = []
+        for i in range(0, len(crossed), 500):
+            chunk = crossed[i:i + 500]
+            c.execute(f"""
+                SELECT id, username, script, order_type, qty, price, is_short, stoploss, target, segment
+                  FROM orders
+                 WHERE status='Open' AND id IN ({",".join("?" * len(chunk))})
+            """, chunk)
+            rows += c.fetchall()
+        rows.sort(key=lambda r: r[0])   # oldest first, like the old full scan
+
+        available: Dict[str, float] = {}
+        buyers = sorted({r[1] for r in rows if r[3] == "BUY"})
+        for i in range(0, len(buyers), 500):
+            chunk = buyers[i:i + 500]
+            c.execute(
+                f"SELECT username, available_amount FROM funds WHERE username IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            available.update({u: float(a or 0.0) for u, a in c.fetchall()})
 
-            live_price = get_live_price(script)
+        fills = []          # (fill price, is_short, id)
+        filled = []         # ledger hook rows
+        for order_id, username, script, side, qty, trigger_price, is_short, sl, tgt, seg in rows:
+            live_price = live_by_script.get((script or "").upper(), 0.0)
             if not live_price or live_price <= 0:
-                # couldn't price -> revert claim so we retry later
-                c.execute("UPDATE orders SET status='Open' WHERE id=? AND status='Processing'", (order_id,))
-                conn.commit()
-                continue
+                continue    # couldn't price -> stays Open, retried next cycle
 
             trigger_price = float(trigger_price or 0.0)
             qty = int(qty or 0)
+            if trigger_price <= 0:
+                continue
 
-            try:
-                if side == "BUY":
-                    # BUY executes when live <= trigger; fill at trigger
-                    if trigger_price > 0 and le(live_price, trigger_price):
-                        exec_price = trigger_price
-                        cost = exec_price * qty
-                        available = _ensure_funds_row(c, username)
-                        if available < cost:
-                            # not enough funds now -> revert claim
-                            c.execute("UPDATE orders SET status='Open' WHERE id=? AND status='Processing'", (order_id,))
-                            conn.commit()
-                            continue
-
-                        # funds first, then convert THIS row to Closed with the exec price
-                        c.execute(
-                            "UPDATE funds SET available_amount = available_amount - ? WHERE username=?",
-                            (cost, username),
-                        )
-                        c.execute(
-                            """
-                            UPDATE orders
-                               SET status   = 'Closed',
-                                   price    = ?,        -- store fill price
-                                   datetime = datetime('now','localtime')
-                             WHERE id = ? AND status='Processing'
-                            """,
-                            (exec_price, order_id),
-                        )
-                        conn.commit()
-                    else:
-                        c.execute("UPDATE orders SET status='Open' WHERE id=? AND status='Processing'", (order_id,))
-                        conn.commit()
-
-                elif side == "SELL":
-                    # SELL trigger:
-                    #   normal (is_short=0): live >= trigger
-                    #   SELL FIRST (is_short=1): live <= trigger
-                    should_exec = False
-                    if trigger_price > 0:
-                        if is_short:
-                            should_exec = le(live_price, trigger_price)
-                        else:
-                            should_exec = ge(live_price, trigger_price)
-
-                    if should_exec:
-                        exec_price = trigger_price
-                        credit = exec_price * qty
-
-                        # credit funds immediately
-                        c.execute(
-                            "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
-                            (credit, username),
-                        )
-
-                        # 🔒 Preserve short flag on the executed row
-                        c.execute(
-                            """
-                            UPDATE orders
-                               SET status    = 'Closed',
-                                   price     = ?,        -- store fill price
-                                   datetime  = datetime('now','localtime'),
-                                   is_short  = COALESCE(is_short, ?)
-                             WHERE id = ? AND status='Processing'
-                            """,
-                            (exec_price, int(is_short or 0), order_id),
-                        )
-                        conn.commit()
-                    else:
-                        c.execute("UPDATE orders SET status='Open' WHERE id=? AND status='Processing'", (order_id,))
-                        conn.commit()
-
-            except Exception:
-                # On any error, try to revert to Open so it can be retried safely
-                c.execute("UPDATE orders SET status='Open' WHERE id=? AND status='Processing'", (order_id,))
-                conn.commit()
-                raise
-
-        # ---------------- PASS 2: SL/Target watcher on today's executed net positions ----------------
-        today = _now_ist().strftime("%Y-%m-%d")
-        c.execute(
-            """
-            SELECT DISTINCT username, script
-              FROM orders
-             WHERE status='Closed' AND substr(datetime,1,10)=?
-            """,
-            (today,),
-        )
-        pairs = c.fetchall()
-
-        for username, script in pairs:
-            live = get_live_price(script)
-            if not live or live <= 0:
+            if side == "BUY":
+                # BUY executes when live <= trigger; fill at trigger
+                if not le(live_price, trigger_price):
+                    continue
+                cost = trigger_price * qty
+                if available.get(username, 0.0) < cost:
+                    continue    # not enough funds now -> stays Open
+                available[username] = available.get(username, 0.0) - cost
+                funds_delta[username] = funds_delta.get(username, 0.0) - cost
+            elif side == "SELL":
+                # SELL trigger:
+                #   normal (is_short=0): live >= trigger
+                #   SELL FIRST (is_short=1): live <= trigger
+                if is_short:
+                    if not le(live_price, trigger_price):
+                        continue
+                elif not ge(live_price, trigger_price):
+                    continue
+                funds_delta[username] = funds_delta.get(username, 0.0) + trigger_price * qty
+            else:
                 continue
+            # 🔒 Preserve short flag on the executed row
+            fills.append((trigger_price, int(is_short or 0), order_id))
+            filled.append((username, script, side, qty, sl, tgt, seg))
 
-            # Net BUY - SELL for today across all segments
-            c.execute(
+        if fills:
+            c.executemany(
                 """
-                SELECT COALESCE(SUM(CASE WHEN order_type='BUY'  THEN qty ELSE 0 END),0) -
-                       COALESCE(SUM(CASE WHEN order_type='SELL' THEN qty ELSE 0 END),0)
-                  FROM orders
-                 WHERE username=? AND script=? AND status='Closed' AND substr(datetime,1,10)=?
+                UPDATE orders
+                   SET status    = 'Closed',
+                       price     = ?,        -- store fill price
+                       datetime  = datetime('now','localtime'),
+                       is_short  = COALESCE(is_short, ?)
+                 WHERE id = ? AND status='Open'
                 """,
-                (username, script, today),
+                fills,
             )
-            net = int(c.fetchone()[0] or 0)
-            if net == 0:
-                continue
+            _on_fills(c, filled)
 
-            if net > 0:
-                # LONG net -> watch last BUY with SL/Target
-                c.execute(
-                    """
-                    SELECT stoploss, target, segment
-                      FROM orders
-                     WHERE username=? AND script=? AND status='Closed'
-                       AND order_type='BUY' AND substr(datetime,1,10)=?
-                       AND ( (stoploss IS NOT NULL AND stoploss > 0) OR
-                             (target  IS NOT NULL AND target  > 0) )
-                     ORDER BY datetime DESC, id DESC LIMIT 1
-                    """,
-                    (username, script, today),
-                )
-                row = c.fetchone()
-                if not row:
-                    continue
-                sl, tgt, seg = row
-                sl  = _clean_level(sl)
-                tgt = _clean_level(tgt)
-                seg = (seg or "intraday").lower()
-
-                # Exit long when live >= target OR live <= stoploss
-                if (tgt is not None and ge(live, tgt)) or (sl is not None and le(live, sl)):
-                    qty_to_sell = net
-                    c.execute(
-                        "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
-                        (live * qty_to_sell, username),
-                    )
-                    _insert_closed(
-                        c, username, script, "SELL", qty_to_sell, live, seg,
-                        stoploss=sl, target=tgt, is_short=0
-                    )
-                    # history marker
-                    c.execute("""
-                        INSERT INTO portfolio_exits (username, script, qty, price, datetime, segment, exit_side)
-                        VALUES (?, ?, ?, ?, datetime('now','localtime'), ?, 'SELL')
-                    """, (username, script, qty_to_sell, live, seg))
-                    conn.commit()
+        # ---------------- PASS 2: SL/Target watcher on today's executed net positions ----------------
+        # Reads the ledger after PASS 1's fills (same transaction), so they count.
+        ledger_rows = _read_ledger(c, today)
+        if only is not None:
+            ledger_rows = [r for r in ledger_rows if (r[1] or "").upper() in only]
+        exits = _sl_target_exits(ledger_rows, live_by_script)
+        for username, _s, side, qty, live, _seg, _sl, _tgt in exits:
+            sign = 1 if side == "SELL" else -1
+            funds_delta[username] = funds_delta.get(username, 0.0) + sign * live * qty
+
+        if exits:
+            c.executemany(
+                """
+                INSERT INTO orders
+                  (username, script, order_type, qty, price, exchange, segment, status, datetime, pnl, stoploss, target, is_short)
+                VALUES
+                  (?, ?, ?, ?, ?, 'NSE', ?, 'Closed', datetime('now','localtime'), 0.0, ?, ?, 0)
+                """,
+                exits,
+            )
+            # history markers (exit_side='SELL' long exit, 'BUY' short cover)
+            c.executemany(
+                """
+                INSERT INTO portfolio_exits (username, script, qty, price, datetime, segment, exit_side)
+                VALUES (?, ?, ?, ?, datetime('now','localtime'), ?, ?)
+                """,
+                [(u, s, q, p, seg, side) for u, s, side, q, p, seg, _sl, _tgt in exits],
+            )
+            _on_fills(c, [(u, s, side, q, sl, tgt, seg) for u, s, side, q, _p, seg, sl, tgt in exits])
 
-            else:
-                # SHORT net -> watch last SELL (SELL FIRST) with SL/Target
-                c.execute(
-                    """
-                    SELECT stoploss, target, segment
-                      FROM orders
-                     WHERE username=? AND script=? AND status='Closed'
-                       AND order_type='SELL' AND substr(datetime,1,10)=?
-                       AND ( (stoploss IS NOT NULL AND stoploss > 0) OR
-                             (target  IS NOT NULL AND target  > 0) )
-                     ORDER BY datetime DESC, id DESC LIMIT 1
-                    """,
-                    (username, script, today),
-                )
-                row = c.fetchone()
-                if not row:
-                    continue
-                sl, tgt, seg = row
-                sl  = _clean_level(sl)
-                tgt = _clean_level(tgt)
-                seg = (seg or "intraday").lower()
-
-                # ✅ Your SELL FIRST convention:
-                # auto-cover when live <= stoploss  OR  live >= target
-                if (sl is not None and le(live, sl)) or (tgt is not None and ge(live, tgt)):
-                    qty_to_buy = abs(net)
-                    c.execute(
-                        "UPDATE funds SET available_amount = available_amount - ? WHERE username=?",
-                        (live * qty_to_buy, username),
-                    )
-                    _insert_closed(
-                        c, username, script, "BUY", qty_to_buy, live, seg,
-                        stoploss=sl, target=tgt, is_short=0
-                    )
-                    # history marker (short cover)
-                    c.execute("""
-                        INSERT INTO portfolio_exits (username, script, qty, price, datetime, segment, exit_side)
-                        VALUES (?, ?, ?, ?, datetime('now','localtime'), ?, 'BUY')
-                    """, (username, script, qty_to_buy, live, seg))
-                    conn.commit()
+        if funds_delta:
+            c.executemany(
+                "UPDATE funds SET available_amount = available_amount + ? WHERE username=?",
+                [(d, u) for u, d in funds_delta.items() if d],
+            )
+
+        conn.commit()
+        ENGINE.record_fills(seen, [(f[1] or "").upper() for f in filled] + [(e[1] or "").upper() for e in exits])
+        TRIGGER_BOOK.remove_many(oid for _p, _s, oid in fills)
+        # crossed but no longer Open (filled or cancelled elsewhere)
+        TRIGGER_BOOK.remove_many(set(crossed) - {r[0] for r in rows})
 
     except Exception as e:
+        conn.rollback()
         print("⚠️ Error in process_open_orders:", e)
     finally:
         conn.close()
 
+@router.get("/engine/stats")
+def get_engine_stats():
+    """Matching engine mode, run counters and trigger-to-fill latency percentiles."""
+    out = ENGINE.stats()
+    out["trigger_book"] = dict(TRIGGER_BOOK.stats(), book_seq=_BOOK_SEQ)
+    out["lease"] = LEASE.stats()
+    return out
+
 # -------------------- Open orders --------------------
 
 @router.get("/{username}")
@@ -1441,6 +2054,292 @@ def get_open_orders(username: str):
 
 # -------------------- Positions (EXECUTED ONLY) --------------------
 
+def _fifo_positions(rows) -> Dict[str, Dict[str, Any]]:
+    """
+    Replay executed rows (id, script, order_type, qty, price, stoploss, target,
+    datetime, segment, is_short), oldest first, into per-script FIFO state.
+    The state is plain lists/dicts so it can be stored as JSON in position_state.
+    """
+    # per-script state
+    state: Dict[str, Dict[str, Any]] = {}
+    # state[script] = {
+    #   "long_lots":   [{"qty":int, "price":float}],
+    #   "short_lots":  [{"qty":int, "price":float, "sl":opt, "tgt":opt, "segment":str}],
+    #   "long_exits":  [records],
+    #   "short_covers":[records],
+    #   "segment": str,
+    #   "last_sl": opt, "last_tgt": opt,
+    #   "first": [datetime, id] of the script's first fill (tab order)
+    # }
+
+    for oid, script, side, qty, price, sl, tgt, dt, segment, is_short in rows:
+        script  = (script or "").upper()
+        side    = (side or "").upper()
+        segment = (segment or "").lower()
+        qty     = int(qty or 0)
+        price   = float(price or 0.0)
+
+        st = state.setdefault(script, {
+            "long_lots":   [],
+            "short_lots":  [],
+            "long_exits":  [],
+            "short_covers":[],
+            "segment": segment,
+            "last_sl": None,
+            "last_tgt": None,
+            "first": [dt, oid],
+        })
+
+        if side == "BUY":
+            # 1) try to cover existing shorts first
+            to_match = qty
+            while to_match > 0 and st["short_lots"]:
+                lot = st["short_lots"][0]
+                use = min(lot["qty"], to_match)
+                # short cover: entry at short price, exit at this BUY price
+                entry = float(lot["price"])
+                exitp = price
+                per_share = entry - exitp
+                pnl_val = per_share * use
+                pct = ((per_share / entry) * 100.0) if entry else 0.0
+
+                st["short_covers"].append({
+                    "qty": use,
+                    "datetime": dt,
+                    "entry_price": entry,
+                    "exit_price": exitp,
+                    "pnl_value": round(pnl_val, 2),
+                    "pnl_percent": round(pct, 2),
+                    "segment": lot.get("segment", segment),
+                    "sl": lot.get("sl"),
+                    "tgt": lot.get("tgt"),
+                })
+
+                lot["qty"] -= use
+                to_match   -= use
+                if lot["qty"] == 0:
+                    st["short_lots"].pop(0)
+
+            # 2) any remainder becomes a LONG lot
+            remain = to_match
+            if remain > 0:
+                st["long_lots"].append({"qty": remain, "price": price})
+                st["last_sl"]  = sl
+                st["last_tgt"] = tgt
+                st["segment"]  = segment
+
+        elif side == "SELL":
+            # 1) close existing long lots first (long exit)
+            to_match = qty
+            while to_match > 0 and st["long_lots"]:
+                lot = st["long_lots"][0]
+                use = min(lot["qty"], to_match)
+                entry = float(lot["price"])
+                exitp = price
+                per_share = exitp - entry
+                pnl_val = per_share * use
+                pct = ((exitp / entry - 1.0) * 100.0) if entry else 0.0
+
+                st["long_exits"].append({
+                    "qty": use,
+                    "datetime": dt,
+                    "entry_price": entry,
+                    "exit_price": exitp,
+                    "pnl_value": round(pnl_val, 2),
+                    "pnl_percent": round(pct, 2),
+                    "segment": segment,
+                    "sl": sl,
+                    "tgt": tgt,
+                })
+
+                lot["qty"] -= use
+                to_match   -= use
+                if lot["qty"] == 0:
+                    st["long_lots"].pop(0)
+
+            # 2) any remainder becomes a SHORT lot (SELL FIRST)
+            remain = to_match
+            if remain > 0:
+                st["short_lots"].append({
+                    "qty": remain,
+                    "price": price,
+                    "sl": sl,
+                    "tgt": tgt,
+                    "segment": segment,
+                })
+
+    return state
+
+def _position_rows(script: str, st: Dict[str, Any], now, today: str, live) -> List[Dict[str, Any]]:
+    """Positions tab rows for one script's FIFO state, marked to `live`."""
+    out: List[Dict[str, Any]] = []
+    # show inactive long exits (SELL) before cutoff
+    if now < EOD_CUTOFF:
+        for s in st["long_exits"]:
+            abs_ps = (float(s["exit_price"]) - float(s["entry_price"]))
+            abs_pct = ((float(s["exit_price"]) / float(s["entry_price"]) - 1.0) * 100.0) if s["entry_price"] else 0.0
+            script_pnl = abs_ps * int(s["qty"])
+
+            out.append({
+                "symbol": script,
+                "type": "SELL",
+                "qty": s["qty"],
+                "total": s["qty"],
+                "price": float(s["entry_price"]),     # entry
+                "exit_price": float(s["exit_price"]), # locked
+                "live_price": float(s["exit_price"]),
+                "pnl_value": s["pnl_value"],
+                "pnl_percent": s["pnl_percent"],
+                "abs_per_share": round(abs_ps, 4),
+                "abs_pct": round(abs_pct, 4),
+                "script_pnl": round(script_pnl, 2),
+                "stoploss": s.get("sl") or st["last_sl"],
+                "target":  s.get("tgt") or st["last_tgt"],
+                "inactive": True,
+                "datetime": s["datetime"],
+                "segment": s.get("segment", st["segment"]),
+                "short_first": False,
+            })
+
+        # inactive short covers (BUY) before cutoff
+        # Show inactive short covers as grey SELL FIRST rows (not BUY)
+        for s in st["short_covers"]:
+            # short math: profit if entry > exit
+            abs_ps   = float(s["entry_price"]) - float(s["exit_price"])
+            abs_pct  = ((abs_ps / float(s["entry_price"])) * 100.0) if s["entry_price"] else 0.0
+            script_pnl = abs_ps * int(s["qty"])
+
+            out.append({
+                "symbol": script,
+                "type": "SELL",                         # keep SELL so UI shows SELL FIRST badge
+                "qty": s["qty"],
+                "total": s["qty"],
+                "price": float(s["entry_price"]),       # original short entry
+                "exit_price": float(s["exit_price"]),   # locked at cover price
+                "live_price": float(s["exit_price"]),   # lock live too
+                "pnl_value": s["pnl_value"],
+                "pnl_percent": s["pnl_percent"],
+                "abs_per_share": round(abs_ps, 4),
+                "abs_pct": round(abs_pct, 4),
+                "script_pnl": round(script_pnl, 2),
+                "stoploss": s.get("sl") or st["last_sl"],
+                "target":  s.get("tgt") or st["last_tgt"],
+                "inactive": True,                       # grey / unclickable
+                "short_first": True,                    # show “SELL FIRST” badge
+                "datetime": s["datetime"],
+                "segment": s.get("segment", st["segment"]),
+                "status": "Closed",
+                "status_msg": f"Covered @ ₹{float(s['exit_price']):.2f}",
+            })
+
+        # still-open shorts (SELL FIRST) → active SELL row
+        for lot in st["short_lots"]:
+            lp = float(live or 0.0)
+            entry = float(lot["price"])
+            per_share = entry - lp
+            pct = ((per_share / entry) * 100.0) if entry else 0.0
+            pnl_val = per_share * int(lot["qty"])
+
+            out.append({
+                "symbol": script,
+                "type": "SELL",
+                "qty": lot["qty"],
+                "total": lot["qty"],
+                "price": entry,
+                "live_price": lp,
+                "pnl_value": round(pnl_val, 2),
+                "pnl_percent": round(pct, 2),
+                "abs_per_share": round(per_share, 4),
+                "abs_pct": round(pct, 4),
+                "script_pnl": round(pnl_val, 2),
+                "stoploss": lot.get("sl") or st["last_sl"],
+                "target":  lot.get("tgt") or st["last_tgt"],
+                "inactive": False,
+                "datetime": today + " 00:00:00",
+                "segment": lot.get("segment", st["segment"]),
+                "short_first": True,
+            })
+
+    # open longs (BUY)
+    if st["long_lots"] and (st["segment"] == "delivery" or now < DISPLAY_CUTOFF):
+        wq = sum(l["qty"] for l in st["long_lots"])
+        wavg_entry_open = (sum(l["qty"] * l["price"] for l in st["long_lots"]) / wq) if wq else 0.0
+        per_share = float(live or 0.0) - float(wavg_entry_open or 0.0)
+        pct = (((float(live or 0.0) / wavg_entry_open) - 1.0) * 100.0) if wavg_entry_open else 0.0
+        pnl_val = per_share * wq
+
+        out.append({
+            "symbol": script,
+            "type": "BUY",
+            "qty": wq,
+            "total": wq,
+            "price": float(wavg_entry_open),
+            "live_price": float(live or 0.0),
+            "pnl_value": round(pnl_val, 2),
+            "pnl_percent": round(pct, 2),
+            "abs_per_share": round(per_share, 4),
+            "abs_pct": round(pct, 4),
+            "script_pnl": round(pnl_val, 2),
+            "stoploss": st["last_sl"],
+            "target": st["last_tgt"],
+            "inactive": False,
+            "segment": st["segment"],
+        })
+
+    return out
+
+def _load_position_state(conn: sqlite3.Connection, c: sqlite3.Cursor, username: str, today: str):
+    """
+    Today's FIFO state per script for `username`: stored state for clean
+    rows, a replay of just that script's rows for dirty ones. A replay is
+    written back only if no fill bumped the version meanwhile.
+    """
+    c.execute(
+        "SELECT script, state, version, dirty FROM position_state WHERE trade_date=? AND username=?",
+        (today, username),
+    )
+    state: Dict[str, Dict[str, Any]] = {}
+    stale: Dict[str, int] = {}
+    for script, blob, version, dirty in c.fetchall():
+        if dirty or blob is None:
+            stale[script] = version
+        else:
+            st = json.loads(blob)
+            if st:
+                state[script] = st
+    if not stale:
+        return state
+
+    scripts = sorted(stale)
+    rows = []
+    for i in range(0, len(scripts), 500):
+        chunk = scripts[i:i + 500]
+        c.execute(
+            f"""
+            SELECT id, script, order_type, qty, price, stoploss, target, datetime, segment, is_short
+              FROM orders
+             WHERE username = ?
+               AND status   = 'Closed'
+               AND substr(datetime,1,10) = ?
+               AND UPPER(script) IN ({",".join("?" * len(chunk))})
+             ORDER BY datetime ASC, id ASC
+            """,
+            (username, today, *chunk),
+        )
+        rows += c.fetchall()    # FIFO is per script, so per-chunk order is enough
+    fresh = _fifo_positions(rows)
+
+    c.executemany(
+        """
+        UPDATE position_state SET state=?, dirty=0, updated_at=datetime('now','localtime')
+         WHERE trade_date=? AND username=? AND script=? AND version=?
+        """,
+        [(json.dumps(fresh.get(s, {})), today, username, s, v) for s, v in stale.items()],
+    )
+    conn.commit()
+    state.update(fresh)
+    return state
+
 @router.get("/positions/{username}")
 def get_positions(username: str):
     """
@@ -1449,6 +2348,9 @@ def get_positions(username: str):
       • Pairs FIFO short SELL FIRST with BUY covers (inactive BUY rows with exit_price locked).
       • Remaining longs → active BUY; remaining shorts → active SELL FIRST.
       • Adds abs_per_share, abs_pct, script_pnl for direct UI use.
+
+    The FIFO state comes from position_state (kept current by the fill hook),
+    so a poll is a keyed read plus one batched price lookup for marking to market.
     """
     _run_eod_if_due(username)
 
@@ -1459,245 +2361,22 @@ def get_positions(username: str):
     c = conn.cursor()
     try:
         _ensure_tables(c)
+        conn.commit()
+        _ensure_ledger(conn, c)
 
-        # all executed today, oldest first
-        c.execute(
-            """
-            SELECT script, order_type, qty, price, stoploss, target, datetime, segment, is_short
-              FROM orders
-             WHERE username = ?
-               AND status   = 'Closed'
-               AND substr(datetime,1,10) = ?
-             ORDER BY datetime ASC, id ASC
-            """,
-            (username, today),
+        state = _load_position_state(conn, c, username, today)
+
+        # only scripts that will show an active row need a live price
+        open_syms = sorted(
+            s for s, st in state.items()
+            if (st["short_lots"] and now < EOD_CUTOFF)
+            or (st["long_lots"] and (st["segment"] == "delivery" or now < DISPLAY_CUTOFF))
         )
-        rows = c.fetchall()
+        live_by_script = get_live_prices(open_syms) if open_syms else {}
 
         positions: List[Dict[str, Any]] = []
-
-        # per-script state
-        state: Dict[str, Dict[str, Any]] = {}
-        # state[script] = {
-        #   "long_lots":   [{"qty":int, "price":float}],
-        #   "short_lots":  [{"qty":int, "price":float, "sl":opt, "tgt":opt, "segment":str}],
-        #   "long_exits":  [records],
-        #   "short_covers":[records],
-        #   "segment": str,
-        #   "last_sl": opt, "last_tgt": opt
-        # }
-
-        for script, side, qty, price, sl, tgt, dt, segment, is_short in rows:
-            script  = (script or "").upper()
-            side    = (side or "").upper()
-            segment = (segment or "").lower()
-            qty     = int(qty or 0)
-            price   = float(price or 0.0)
-
-            st = state.setdefault(script, {
-                "long_lots":   [],
-                "short_lots":  [],
-                "long_exits":  [],
-                "short_covers":[],
-                "segment": segment,
-                "last_sl": None,
-                "last_tgt": None,
-            })
-
-            if side == "BUY":
-                # 1) try to cover existing shorts first
-                to_match = qty
-                while to_match > 0 and st["short_lots"]:
-                    lot = st["short_lots"][0]
-                    use = min(lot["qty"], to_match)
-                    # short cover: entry at short price, exit at this BUY price
-                    entry = float(lot["price"])
-                    exitp = price
-                    per_share = entry - exitp
-                    pnl_val = per_share * use
-                    pct = ((per_share / entry) * 100.0) if entry else 0.0
-
-                    st["short_covers"].append({
-                        "qty": use,
-                        "datetime": dt,
-                        "entry_price": entry,
-                        "exit_price": exitp,
-                        "pnl_value": round(pnl_val, 2),
-                        "pnl_percent": round(pct, 2),
-                        "segment": lot.get("segment", segment),
-                        "sl": lot.get("sl"),
-                        "tgt": lot.get("tgt"),
-                    })
-
-                    lot["qty"] -= use
-                    to_match   -= use
-                    if lot["qty"] == 0:
-                        st["short_lots"].pop(0)
-
-                # 2) any remainder becomes a LONG lot
-                remain = to_match
-                if remain > 0:
-                    st["long_lots"].append({"qty": remain, "price": price})
-                    st["last_sl"]  = sl
-                    st["last_tgt"] = tgt
-                    st["segment"]  = segment
-
-            elif side == "SELL":
-                # 1) close existing long lots first (long exit)
-                to_match = qty
-                while to_match > 0 and st["long_lots"]:
-                    lot = st["long_lots"][0]
-                    use = min(lot["qty"], to_match)
-                    entry = float(lot["price"])
-                    exitp = price
-                    per_share = exitp - entry
-                    pnl_val = per_share * use
-                    pct = ((exitp / entry - 1.0) * 100.0) if entry else 0.0
-
-                    st["long_exits"].append({
-                        "qty": use,
-                        "datetime": dt,
-                        "entry_price": entry,
-                        "exit_price": exitp,
-                        "pnl_value": round(pnl_val, 2),
-                        "pnl_percent": round(pct, 2),
-                        "segment": segment,
-                        "sl": sl,
-                        "tgt": tgt,
-                    })
-
-                    lot["qty"] -= use
-                    to_match   -= use
-                    if lot["qty"] == 0:
-                        st["long_lots"].pop(0)
-
-                # 2) any remainder becomes a SHORT lot (SELL FIRST)
-                remain = to_match
-                if remain > 0:
-                    st["short_lots"].append({
-                        "qty": remain,
-                        "price": price,
-                        "sl": sl,
-                        "tgt": tgt,
-                        "segment": segment,
-                    })
-
-        # Build the response
-        for script, st in state.items():
-            # show inactive long exits (SELL) before cutoff
-            if now < EOD_CUTOFF:
-                for s in st["long_exits"]:
-                    abs_ps = (float(s["exit_price"]) - float(s["entry_price"]))
-                    abs_pct = ((float(s["exit_price"]) / float(s["entry_price"]) - 1.0) * 100.0) if s["entry_price"] else 0.0
-                    script_pnl = abs_ps * int(s["qty"])
-
-                    positions.append({
-                        "symbol": script,
-                        "type": "SELL",
-                        "qty": s["qty"],
-                        "total": s["qty"],
-                        "price": float(s["entry_price"]),     # entry
-                        "exit_price": float(s["exit_price"]), # locked
-                        "live_price": float(s["exit_price"]),
-                        "pnl_value": s["pnl_value"],
-                        "pnl_percent": s["pnl_percent"],
-                        "abs_per_share": round(abs_ps, 4),
-                        "abs_pct": round(abs_pct, 4),
-                        "script_pnl": round(script_pnl, 2),
-                        "stoploss": s.get("sl") or st["last_sl"],
-                        "target":  s.get("tgt") or st["last_tgt"],
-                        "inactive": True,
-                        "datetime": s["datetime"],
-                        "segment": s.get("segment", st["segment"]),
-                        "short_first": False,
-                    })
-
-                # inactive short covers (BUY) before cutoff
-                # Show inactive short covers as grey SELL FIRST rows (not BUY)
-                for s in st["short_covers"]:
-                    # short math: profit if entry > exit
-                    abs_ps   = float(s["entry_price"]) - float(s["exit_price"])
-                    abs_pct  = ((abs_ps / float(s["entry_price"])) * 100.0) if s["entry_price"] else 0.0
-                    script_pnl = abs_ps * int(s["qty"])
-
-                    positions.append({
-                        "symbol": script,
-                        "type": "SELL",                         # keep SELL so UI shows SELL FIRST badge
-                        "qty": s["qty"],
-                        "total": s["qty"],
-                        "price": float(s["entry_price"]),       # original short entry
-                        "exit_price": float(s["exit_price"]),   # locked at cover price
-                        "live_price": float(s["exit_price"]),   # lock live too
-                        "pnl_value": s["pnl_value"],
-                        "pnl_percent": s["pnl_percent"],
-                        "abs_per_share": round(abs_ps, 4),
-                        "abs_pct": round(abs_pct, 4),
-                        "script_pnl": round(script_pnl, 2),
-                        "stoploss": s.get("sl") or st["last_sl"],
-                        "target":  s.get("tgt") or st["last_tgt"],
-                        "inactive": True,                       # grey / unclickable
-                        "short_first": True,                    # show “SELL FIRST” badge
-                        "datetime": s["datetime"],
-                        "segment": s.get("segment", st["segment"]),
-                        "status": "Closed",
-                        "status_msg": f"Covered @ ₹{float(s['exit_price']):.2f}",
-                    })
-
-                # still-open shorts (SELL FIRST) → active SELL row
-                for lot in st["short_lots"]:
-                    lp = float(get_live_price(script) or 0.0)
-                    entry = float(lot["price"])
-                    per_share = entry - lp
-                    pct = ((per_share / entry) * 100.0) if entry else 0.0
-                    pnl_val = per_share * int(lot["qty"])
-
-                    positions.append({
-                        "symbol": script,
-                        "type": "SELL",
-                        "qty": lot["qty"],
-                        "total": lot["qty"],
-                        "price": entry,
-                        "live_price": lp,
-                        "pnl_value": round(pnl_val, 2),
-                        "pnl_percent": round(pct, 2),
-                        "abs_per_share": round(per_share, 4),
-                        "abs_pct": round(pct, 4),
-                        "script_pnl": round(pnl_val, 2),
-                        "stoploss": lot.get("sl") or st["last_sl"],
-                        "target":  lot.get("tgt") or st["last_tgt"],
-                        "inactive": False,
-                        "datetime": today + " 00:00:00",
-                        "segment": lot.get("segment", st["segment"]),
-                        "short_first": True,
-                    })
-
-            # open longs (BUY)
-            if st["long_lots"] and (st["segment"] == "delivery" or now < DISPLAY_CUTOFF):
-                wq = sum(l["qty"] for l in st["long_lots"])
-                wavg_entry_open = (sum(l["qty"] * l["price"] for l in st["long_lots"]) / wq) if wq else 0.0
-                live_now = get_live_price(script)
-                per_share = float(live_now or 0.0) - float(wavg_entry_open or 0.0)
-                pct = (((float(live_now or 0.0) / wavg_entry_open) - 1.0) * 100.0) if wavg_entry_open else 0.0
-                pnl_val = per_share * wq
-
-                positions.append({
-                    "symbol": script,
-                    "type": "BUY",
-                    "qty": wq,
-                    "total": wq,
-                    "price": float(wavg_entry_open),
-                    "live_price": float(live_now or 0.0),
-                    "pnl_value": round(pnl_val, 2),
-                    "pnl_percent": round(pct, 2),
-                    "abs_per_share": round(per_share, 4),
-                    "abs_pct": round(pct, 4),
-                    "script_pnl": round(pnl_val, 2),
-                    "stoploss": st["last_sl"],
-                    "target": st["last_tgt"],
-                    "inactive": False,
-                    "segment": st["segment"],
-                })
-
+        for script, st in sorted(state.items(), key=lambda kv: tuple(kv[1]["first"])):
+            positions += _position_rows(script, st, now, today, live_by_script.get(script, 0.0))
         return positions
 
     except Exception as e:
@@ -1707,6 +2386,7 @@ def get_positions(username: str):
         conn.close()
 
 
+
 @router.post("/exit")
 def exit_order(order: OrderData):
     conn = sqlite3.connect(DB_PATH)
@@ -1759,9 +2439,10 @@ def exit_order(order: OrderData):
 
         c.execute(
             """INSERT INTO orders (username, script, order_type, qty, price, datetime, segment, stoploss, target, status)
-               VALUES (?,?,?,?,datetime('now','localtime'),?,?,?,?, 'Closed')""",
+               VALUES (?,?,?,?,?,datetime('now','localtime'),?,?,?, 'Closed')""",
             (order.username, script, "SELL", exit_qty, live_price, seg, sl, tgt),
         )
+        _on_fill(c, order.username, script, "SELL", exit_qty, sl, tgt, seg)
 
         conn.commit()
         return {"message": f"Exited {exit_qty} {script} at {live_price}"}
@@ -1778,15 +2459,26 @@ def modify_order(order_id: int, order: OrderData):
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     try:
+        _ensure_tables(c)
         c.execute(
             """UPDATE orders
                SET qty=?, price=?, stoploss=?, target=?
                WHERE id=?""",
             (order.qty, order.price, order.stoploss, order.target, order_id),
         )
-        conn.commit()
         if c.rowcount == 0:
+            conn.commit()
             raise HTTPException(status_code=404, detail="Order not found")
+        c.execute("SELECT username, script, status, datetime FROM orders WHERE id=?", (order_id,))
+        username, script, status, dt = c.fetchone()
+        if status == "Closed":
+            # an executed row changed: ledger + Positions state for that pair,
+            # and realized history if the row is from a day already matched
+            _rebuild_ledger(c, username, script)
+            if (dt or "")[:10] < _now_ist().strftime("%Y-%m-%d"):
+                _forget_realized(c, username)
+        conn.commit()
+        _sync_trigger_book(c, order_id)
         return {"message": "Order modified successfully"}
     finally:
         conn.close()
@@ -1835,11 +2527,17 @@ def close_position(data: dict):
             )
 
         # cancel ALL open orders (BUY & SELL) for this symbol
+        c.execute(
+            "SELECT id FROM orders WHERE username=? AND script=? AND status='Open'",
+            (username, script),
+        )
+        cancelled_ids = [r[0] for r in c.fetchall()]
         c.execute(
             "UPDATE orders SET status='Cancelled' WHERE username=? AND script=? AND status='Open'",
             (username, script),
         )
         cancelled_count = c.rowcount
+        TRIGGER_BOOK.remove_many(cancelled_ids)
 
         # ---- refund today's executed BUY cash and remove today's rows from Positions
         c.execute(
@@ -1868,6 +2566,7 @@ def close_position(data: dict):
             (username, script, today),
         )
         deleted_today_count = c.rowcount
+        _rebuild_ledger(c, username, script)
 
         conn.commit()
 
@@ -1895,16 +2594,326 @@ def close_position(data: dict):
 
 # -------------------- History (SELL legs + portfolio exits) --------------------
 
+def _fifo_match(lots: Dict[str, deque], side: str, qty: int, price: float, dt: str,
+                is_short=0, ref_price: Optional[float] = None):
+    """
+    Stream one executed row through a script's FIFO lots
+    {"long": deque([qty, price, datetime]), "short": deque(...)}.
+
+      • SELL closes long lots first. A remainder opens a short lot if the row
+        is SELL FIRST; otherwise it sold carried holdings (their BUY rows went
+        to portfolio at EOD) and is matched at `ref_price` when we know it.
+      • BUY covers short lots first; the remainder opens a long lot.
+
+    Returns (matched qty, matched entry cost, first matched lot datetime, pnl).
+    """
+    closing = lots["long"] if side == "SELL" else lots["short"]
+    left, matched, cost, first_dt, pnl = int(qty), 0, 0.0, None, 0.0
+    while left > 0 and closing:
+        lot = closing[0]
+        take = min(lot[0], left)
+        first_dt = first_dt or lot[2]
+        matched += take
+        cost += take * lot[1]
+        pnl += ((price - lot[1]) if side == "SELL" else (lot[1] - price)) * take
+        lot[0] -= take
+        left -= take
+        if lot[0] == 0:
+            closing.popleft()
+    if left > 0:
+        if side == "BUY":
+            lots["long"].append([left, price, dt])
+        elif is_short:
+            lots["short"].append([left, price, dt])
+        elif ref_price:
+            matched += left
+            cost += left * ref_price
+            pnl += (price - ref_price) * left
+    return matched, cost, first_dt, pnl
+
+def _lots_from_json(blob: Optional[str]) -> Dict[str, Dict[str, deque]]:
+    return {
+        script: {"long": deque(v.get("long", [])), "short": deque(v.get("short", []))}
+        for script, v in json.loads(blob or "{}").items()
+    }
+
+def _lots_to_json(book: Dict[str, Dict[str, deque]]) -> str:
+    return json.dumps({
+        script: {"long": list(v["long"]), "short": list(v["short"])}
+        for script, v in book.items() if v["long"] or v["short"]
+    })
+
+def _closed_rows_between(c: sqlite3.Cursor, username: str, lo: str, hi: str):
+    """
+    Closed rows with lo < datetime < hi, oldest first. Bounds are compared
+    on the raw text so an index on datetime can be used: "YYYY-MM-DD" sorts
+    before every time of that day and "YYYY-MM-DD~" after all of them.
+    """
+    c.execute(
+        """
+        SELECT id, script, order_type, qty, price, datetime, segment, is_short
+          FROM orders
+         WHERE username = ? AND status = 'Closed'
+           AND datetime > ? AND datetime < ?
+         ORDER BY datetime ASC, id ASC
+        """,
+        (username, lo, hi),
+    )
+    return c.fetchall()
+
+def _realize_past_days(conn: sqlite3.Connection, c: sqlite3.Cursor, username: str, today: str):
+    """
+    Extend realized_trades with every day before `today` not yet processed,
+    continuing the FIFO from the lots saved in realized_state. Each past day
+    is matched once; later calls only read. Returns the lots open at the end
+    of the last processed day (the starting point for today).
+    """
+    def _state():
+        c.execute("SELECT upto_date, lots FROM realized_state WHERE username=?", (username,))
+        row = c.fetchone()
+        return (row[0], row[1]) if row else ("", None)
+
+    upto, blob = _state()
+    rows = _closed_rows_between(c, username, upto + "~" if upto else "", today)
+    if not rows:
+        return _lots_from_json(blob)
+
+    c.execute("BEGIN IMMEDIATE")
+    seen_upto = upto
+    upto, blob = _state()       # another request may have done it meanwhile
+    if upto != seen_upto:
+        rows = _closed_rows_between(c, username, upto + "~" if upto else "", today)
+    book = _lots_from_json(blob)
+    if not rows:
+        conn.rollback()
+        return book
+
+    ref = _portfolio_refs(c, username, today)
+
+    realized = []
+    for oid, script, side, qty, price, dt, seg, is_short in rows:
+        script, side = (script or "").upper(), (side or "").upper()
+        qty, price = int(qty or 0), float(price or 0.0)
+        lots = book.setdefault(script, {"long": deque(), "short": deque()})
+        matched, cost, first_dt, pnl = _fifo_match(lots, side, qty, price, dt, is_short, ref(script, dt))
+        if side == "SELL" or matched:
+            realized.append((
+                oid, username, dt[:10], script, "SELL" if side == "SELL" else "COVER", (seg or "").lower(),
+                matched, (cost / matched) if matched else 0.0, first_dt,
+                qty, price, dt, cost, pnl,
+            ))
+
+    c.executemany(
+        """
+        INSERT OR IGNORE INTO realized_trades
+          (order_id, username, trade_date, script, kind, segment, entry_qty, entry_price, entry_date,
+           exit_qty, exit_price, exit_date, invested_value, pnl)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        realized,
+    )
+    c.execute(
+        """
+        INSERT INTO realized_state (username, upto_date, lots, updated_at)
+        VALUES (?, ?, ?, datetime('now','localtime'))
+        ON CONFLICT(username) DO UPDATE SET upto_date=excluded.upto_date, lots=excluded.lots,
+                                            updated_at=excluded.updated_at
+        """,
+        (username, rows[-1][5][:10], _lots_to_json(book)),
+    )
+    conn.commit()
+    return book
+
+def _forget_realized(c: sqlite3.Cursor, username: str):
+    """A past Closed row changed: drop the user's realized trades so they are matched again."""
+    c.execute("DELETE FROM realized_trades WHERE username=?", (username,))
+    c.execute("DELETE FROM realized_state WHERE username=?", (username,))
+
+def _sell_item(script, matched, cost, first_dt, qty, price, dt, pnl, source) -> Dict[str, Any]:
+    return {
+        "symbol": script,
+        "buy_qty": int(matched),
+        "buy_price": round((cost / matched) if matched else 0.0, 2),
+        "buy_date": first_dt,
+        "sell_qty": int(qty),
+        "sell_avg_price": round(float(price), 2),
+        "sell_date": dt,
+        "invested_value": round(cost, 2),
+        "pnl": round(pnl, 2),
+        "type": "SELL",
+        "source": source,
+    }
+
+def _portfolio_refs(c: sqlite3.Cursor, username: str, hi: str):
+    """
+    Average cost of carried holdings, for sells that find no open lots:
+    ref(SCRIPT, datetime) -> the avg_buy_price in effect at that moment
+    (from portfolio_cost, changes before `hi`), or None if it wasn't held.
+    """
+    c.execute(
+        """
+        SELECT script, changed_at, avg_buy_price FROM portfolio_cost
+         WHERE username = ? AND changed_at < ?
+         ORDER BY changed_at, id
+        """,
+        (username, hi),
+    )
+    times: Dict[str, List[str]] = {}
+    prices: Dict[str, List[float]] = {}
+    for script, at, avg in c.fetchall():
+        times.setdefault(script, []).append(at)
+        prices.setdefault(script, []).append(float(avg or 0.0))
+
+    def ref(script: str, dt: str) -> Optional[float]:
+        i = bisect_right(times.get(script, ()), dt)
+        return prices[script][i - 1] if i else None
+    return ref
+
+def _stream_rows(rows, book, ref) -> Dict[int, tuple]:
+    """_fifo_match every row (as from _closed_rows_between) in order; {order id: match}."""
+    matched_by_id: Dict[int, tuple] = {}
+    for oid, script, side, qty, price, dt, _seg, is_short in rows:
+        script = (script or "").upper()
+        lots = book.setdefault(script, {"long": deque(), "short": deque()})
+        matched_by_id[oid] = _fifo_match(lots, (side or "").upper(), int(qty or 0), float(price or 0.0),
+                                         dt, is_short, ref(script, dt))
+    return matched_by_id
+
+def _today_history(c: sqlite3.Cursor, username: str, today: str, book) -> List[tuple]:
+    """
+    Today's History rows (shown after the cutoff) as ((datetime, id), item).
+    Today's Closed rows are streamed on top of the carried lots `book`.
+    """
+    rows = _closed_rows_between(c, username, today, today + "~")
+    matched_by_id = _stream_rows(rows, book, _portfolio_refs(c, username, today + "~"))
+    by_key: Dict[tuple, deque] = {}      # (SCRIPT, side, qty, price) -> row ids, for portfolio_exits
+    for oid, script, side, qty, price, *_ in rows:
+        key = ((script or "").upper(), (side or "").upper(), int(qty or 0), round(float(price or 0.0), 2))
+        by_key.setdefault(key, deque()).append(oid)
+
+    def _match_of(pe_id, script, side, qty, price):
+        """(order id, match) of the order row behind a portfolio_exits row; -pe_id if none."""
+        ids = by_key.get((script, side, int(qty), round(float(price), 2)))
+        if ids:
+            oid = ids.popleft()
+            return oid, matched_by_id[oid]
+        return -pe_id, (0, 0.0, None, 0.0)
+
+    out: List[tuple] = []
+
+    # today's exits from portfolio_exits (EOD square-off / delivery sells / covers)
+    c.execute(
+        """
+        SELECT id, script, qty, price, datetime, exit_side
+          FROM portfolio_exits
+         WHERE username = ?
+           AND substr(datetime,1,10) = ?
+        ORDER BY datetime ASC
+        """,
+        (username, today),
+    )
+    for pe_id, script, qty, price, dt, exit_side in c.fetchall():
+        script = (script or "").upper()
+        if (exit_side or "").upper() == "SELL":
+            oid, (matched, cost, first_dt, pnl) = _match_of(pe_id, script, "SELL", qty, price)
+            out.append(((dt, oid), _sell_item(script, matched, cost, first_dt, qty, price, dt, pnl,
+                                              "portfolio_exits(today)")))
+        else:
+            # short cover → P&L vs the SELL FIRST lots it closed
+            oid, (matched, cost, _first, pnl) = _match_of(pe_id, script, "BUY", qty, price)
+            out.append(((dt, oid), {
+                "symbol": script,
+                "sell_qty": int(matched),
+                "sell_avg_price": round((cost / matched) if matched else 0.0, 2),
+                "cover_qty": int(qty),
+                "cover_buy_price": round(float(price), 2),
+                "sell_date": dt,
+                "pnl": round(pnl, 2),
+                "type": "COVER",
+                "source": "portfolio_exits(today)"
+            }))
+
+    # today's MANUAL sells from orders that are NOT already in portfolio_exits
+    # (avoid duplicating EOD-generated exits)
+    c.execute(
+        """
+        SELECT o.id, o.script, o.qty, o.price, o.datetime
+          FROM orders o
+         WHERE o.username=? AND o.status='Closed' AND o.order_type='SELL'
+           AND substr(o.datetime,1,10)=?
+           AND NOT EXISTS (
+                SELECT 1 FROM portfolio_exits pe
+                 WHERE pe.username = o.username
+                   AND pe.script   = o.script
+                   AND pe.exit_side='SELL'
+                   AND substr(pe.datetime,1,10)=substr(o.datetime,1,10)
+                   AND pe.qty = o.qty
+                   AND ABS(pe.price - o.price) < 0.01
+           )
+         ORDER BY o.datetime ASC
+        """,
+        (username, today),
+    )
+    for oid, script, sell_qty, sell_price, dt in c.fetchall():
+        matched, cost, first_dt, pnl = matched_by_id.get(oid, (0, 0.0, None, 0.0))
+        out.append(((dt, oid), _sell_item((script or "").upper(), matched, cost, first_dt,
+                                          sell_qty, sell_price, dt, pnl, "orders(today-manual)")))
+    return out
+
+def _parse_cursor(cursor: Optional[str]):
+    """X-Next-Cursor value "<datetime>|<id>" -> (datetime, id)."""
+    if not cursor:
+        return None
+    try:
+        dt, oid = cursor.rsplit("|", 1)
+        return dt, int(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _parse_day(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be YYYY-MM-DD")
+
+# History page size (GET /orders/history?limit=...)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "500"))
+
 @router.get("/history/{username}")
-def get_history(username: str) -> List[Dict[str, Any]]:
+def get_history(
+    username: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    script: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     """
-    History tab:
+    History tab, newest first, one page at a time:
       - Always include past-day SELLs from `orders`.
       - After cutoff (15:45 IST):
           * include today's exits from `portfolio_exits` (auto square-off, delivery sells, covers)
           * PLUS manual SELLs from today's `orders` that do not already appear in `portfolio_exits`
             (to avoid duplicates with EOD-generated records).
+
+    Query: from / to (YYYY-MM-DD, inclusive, on sell_date), script, limit,
+    cursor. When more rows exist the X-Next-Cursor response header holds
+    the cursor for the next (older) page; it is absent on the last page.
+
+    P&L is FIFO: one ordered scan of the user's Closed rows feeds _fifo_match.
+    Past days are matched once into realized_trades (see _realize_past_days);
+    only today's rows are streamed per request, starting from the saved lots.
+    A page of past days is a keyset range on (exit_date, order_id).
     """
+    after = _parse_cursor(cursor)
+    day_from = _parse_day(from_date, "from")
+    day_to = _parse_day(to_date, "to")
+    script_u = (script or "").upper().strip() or None
+
     _run_eod_if_due(username)
 
     now = _now_ist().time()
@@ -1914,216 +2923,249 @@ def get_history(username: str) -> List[Dict[str, Any]]:
     c = conn.cursor()
     try:
         _ensure_tables(c)
+        conn.commit()
 
-        history: List[Dict[str, Any]] = []
-
-        # ---- 1) Previous-days sells from orders (never today here)
-        c.execute(
-            """
-            SELECT script, qty, price, datetime
-              FROM orders
-             WHERE username = ?
-               AND status   = 'Closed'
-               AND order_type = 'SELL'
-               AND substr(datetime,1,10) < ?
-             ORDER BY datetime ASC
-            """,
-            (username, today),
-        )
-        sells_prev = c.fetchall()
-        for script, sell_qty, sell_price, dt in sells_prev:
-            # first BUY ref
+        book = _realize_past_days(conn, c, username, today)
+
+        # (key, item) newest first; key = (datetime, id) is the cursor position
+        page: List[tuple] = []
+
+        # ---- today's rows (after cutoff) sort above every past day
+        if now >= EOD_CUTOFF and (day_from or today) <= today <= (day_to or today):
+            rows = _today_history(c, username, today, book)
+            page = sorted(
+                (r for r in rows
+                 if (script_u is None or r[1]["symbol"] == script_u) and (after is None or r[0] < after)),
+                key=lambda r: r[0], reverse=True,
+            )[:limit + 1]
+
+        # ---- previous days (already matched), straight off the index
+        if len(page) <= limit:
+            where, args = ["username = ?", "kind = 'SELL'"], [username]
+            if script_u:
+                where.append("script = ?")
+                args.append(script_u)
+            if day_from:
+                where.append("exit_date >= ?")
+                args.append(day_from)
+            if day_to:
+                where.append("exit_date < ?")
+                args.append(day_to + "~")
+            if after:
+                where.append("(exit_date < ? OR (exit_date = ? AND order_id < ?))")
+                args += [after[0], after[0], after[1]]
             c.execute(
-                """
-                SELECT price, datetime
-                  FROM orders
-                 WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                 ORDER BY datetime ASC LIMIT 1
+                f"""
+                SELECT order_id, script, entry_qty, exit_qty, exit_price, exit_date, entry_date, invested_value, pnl
+                  FROM realized_trades
+                 WHERE {" AND ".join(where)}
+                 ORDER BY exit_date DESC, order_id DESC
+                 LIMIT ?
                 """,
-                (username, script),
+                (*args, limit + 1 - len(page)),
             )
-            row = c.fetchone()
-            buy_price = row[0] if row else 0
-            buy_date = row[1] if row else None
+            page += [
+                ((dt, oid), _sell_item(sym, matched, float(invested or 0.0), first_dt, qty, price, dt,
+                                       float(pnl or 0.0), "orders(prev_days)"))
+                for oid, sym, matched, qty, price, dt, first_dt, invested, pnl in c.fetchall()
+            ]
+
+        if len(page) > limit:
+            page = page[:limit]
+            last_dt, last_id = page[-1][0]
+            response.headers["X-Next-Cursor"] = f"{last_dt}|{last_id}"
+        return [item for _key, item in page]
 
-            # avg buy + total buy qty
-            c.execute(
-                """
-                SELECT AVG(price), SUM(qty)
-                  FROM orders
-                 WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                """,
-                (username, script),
-            )
-            avg_buy_price, buy_qty = c.fetchone() or (0, 0)
-
-            pnl = (float(sell_price) - float(avg_buy_price or 0)) * int(sell_qty)
-            invested_value = (float(avg_buy_price or 0)) * int(buy_qty or 0)
-
-            history.append({
-                "symbol": script.upper(),
-                "buy_qty": int(buy_qty or 0),
-                "buy_price": round(float(buy_price or 0), 2),
-                "buy_date": buy_date,
-                "sell_qty": int(sell_qty),
-                "sell_avg_price": round(float(sell_price), 2),
-                "sell_date": dt,
-                "invested_value": round(invested_value, 2),
-                "pnl": round(pnl, 2),
-                "type": "SELL",
-                "source": "orders(prev_days)"
-            })
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("⚠️ Error in get_history:", e)
+        raise HTTPException(status_code=500, detail="Server error in /history")
+    finally:
+        conn.close()
 
-        # ---- 2) After cutoff, include today's exits + manual sells
-        if now >= EOD_CUTOFF:
-            # 2a) today's exits from portfolio_exits (EOD square-off / delivery sells / covers)
-            c.execute(
-                """
-                SELECT script, qty, price, datetime, exit_side
-                  FROM portfolio_exits
-                 WHERE username = ?
-                   AND substr(datetime,1,10) = ?
-                ORDER BY datetime ASC
-                """,
-                (username, today),
-            )
-            exits = c.fetchall()
-            for script, qty, price, dt, exit_side in exits:
-                if (exit_side or "").upper() == "SELL":
-                    # compare against avg BUY for P&L
-                    c.execute(
-                        """
-                        SELECT price, datetime
-                          FROM orders
-                         WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                         ORDER BY datetime ASC LIMIT 1
-                        """,
-                        (username, script),
-                    )
-                    row = c.fetchone()
-                    buy_price = row[0] if row else 0
-                    buy_date = row[1] if row else None
 
-                    c.execute(
-                        """
-                        SELECT AVG(price), SUM(qty)
-                          FROM orders
-                         WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                        """,
-                        (username, script),
-                    )
-                    avg_buy_price, buy_qty = c.fetchone() or (0, 0)
-
-                    pnl = (float(price) - float(avg_buy_price or 0)) * int(qty)
-                    invested_value = (float(avg_buy_price or 0)) * int(buy_qty or 0)
-
-                    history.append({
-                        "symbol": script.upper(),
-                        "buy_qty": int(buy_qty or 0),
-                        "buy_price": round(float(buy_price or 0), 2),
-                        "buy_date": buy_date,
-                        "sell_qty": int(qty),
-                        "sell_avg_price": round(float(price), 2),
-                        "sell_date": dt,
-                        "invested_value": round(invested_value, 2),
-                        "pnl": round(pnl, 2),
-                        "type": "SELL",
-                        "source": "portfolio_exits(today)"
-                    })
-                else:
-                    # short cover → P&L vs avg SELL
-                    c.execute(
-                        """
-                        SELECT AVG(price), SUM(qty)
-                          FROM orders
-                         WHERE username=? AND script=? AND order_type='SELL' AND status='Closed'
-                        """,
-                        (username, script),
-                    )
-                    avg_sell_price, total_sell_qty = c.fetchone() or (0, 0)
-                    pnl = (float(avg_sell_price or 0) - float(price)) * int(qty)
-
-                    history.append({
-                        "symbol": script.upper(),
-                        "sell_qty": int(total_sell_qty or 0),
-                        "sell_avg_price": round(float(avg_sell_price or 0), 2),
-                        "cover_qty": int(qty),
-                        "cover_buy_price": round(float(price), 2),
-                        "sell_date": dt,
-                        "pnl": round(pnl, 2),
-                        "type": "COVER",
-                        "source": "portfolio_exits(today)"
-                    })
-
-            # 2b) today's MANUAL sells from orders that are NOT already in portfolio_exits
-            #     (avoid duplicating EOD-generated exits)
-            c.execute(
-                """
-                SELECT o.script, o.qty, o.price, o.datetime
-                  FROM orders o
-                 WHERE o.username=? AND o.status='Closed' AND o.order_type='SELL'
-                   AND substr(o.datetime,1,10)=?
-                   AND NOT EXISTS (
-                        SELECT 1 FROM portfolio_exits pe
-                         WHERE pe.username = o.username
-                           AND pe.script   = o.script
-                           AND pe.exit_side='SELL'
-                           AND substr(pe.datetime,1,10)=substr(o.datetime,1,10)
-                           AND pe.qty = o.qty
-                           AND ABS(pe.price - o.price) < 0.01
-                   )
-                 ORDER BY o.datetime ASC
-                """,
-                (username, today),
-            )
-            manual_sells = c.fetchall()
+# -------------------- Daily P&L rollup --------------------
+
+def _rollup_rows(rows, pnl_by_id: Dict[int, float]) -> Dict[tuple, list]:
+    """(trade_date, SCRIPT, segment) -> [realized_pnl, turnover, buy_qty, sell_qty, trades]."""
+    out: Dict[tuple, list] = {}
+    for oid, script, side, qty, price, dt, seg, _is_short in rows:
+        qty, price = int(qty or 0), float(price or 0.0)
+        e = out.setdefault((dt[:10], (script or "").upper(), (seg or "intraday").lower()), [0.0, 0.0, 0, 0, 0])
+        e[0] += pnl_by_id.get(oid, 0.0)
+        e[1] += qty * price
+        if (side or "").upper() == "BUY":
+            e[2] += qty
+        else:
+            e[3] += qty
+        e[4] += 1
+    return out
+
+def _write_rollup(c: sqlite3.Cursor, username: str, first_day: str, last_day: str, agg: Dict[tuple, list],
+                  source: str = "eod"):
+    """
+    Replace the user's pnl_daily rows for first_day..last_day with `agg`.
+    A backfill never replaces days the EOD rollup wrote: EOD ran before the
+    delivery BUY / SELL FIRST rows were moved out of orders, the backfill
+    can only see what is left.
+    """
+    keep = set()
+    if source != "eod":
+        c.execute(
+            "SELECT DISTINCT trade_date FROM pnl_daily WHERE username=? AND trade_date >= ? AND trade_date <= ? AND source='eod'",
+            (username, first_day, last_day),
+        )
+        keep = {r[0] for r in c.fetchall()}
+    c.execute(
+        f"""
+        DELETE FROM pnl_daily WHERE username=? AND trade_date >= ? AND trade_date <= ?
+        {"" if source == "eod" else "AND source IS NOT 'eod'"}
+        """,
+        (username, first_day, last_day),
+    )
+    c.executemany(
+        """
+        INSERT INTO pnl_daily
+          (username, trade_date, script, segment, realized_pnl, turnover, buy_qty, sell_qty, trades, source, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now','localtime'))
+        """,
+        [(username, d, s, seg, round(e[0], 2), round(e[1], 2), e[2], e[3], e[4], source)
+         for (d, s, seg), e in agg.items() if d not in keep],
+    )
 
-            for script, sell_qty, sell_price, dt in manual_sells:
-                # same enrichment as above
-                c.execute(
-                    """
-                    SELECT price, datetime
-                      FROM orders
-                     WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                     ORDER BY datetime ASC LIMIT 1
-                    """,
-                    (username, script),
-                )
-                row = c.fetchone()
-                buy_price = row[0] if row else 0
-                buy_date = row[1] if row else None
+def _rollup_today(c: sqlite3.Cursor, username: str, today: str, book):
+    """EOD: today's rows streamed on top of the carried lots (no commit)."""
+    rows = _closed_rows_between(c, username, today, today + "~")
+    matched = _stream_rows(rows, book, _portfolio_refs(c, username, today + "~"))
+    _write_rollup(c, username, today, today, _rollup_rows(rows, {oid: m[3] for oid, m in matched.items()}))
+
+# Days per backfill transaction
+PNL_BACKFILL_CHUNK_DAYS = int(os.getenv("PNL_BACKFILL_CHUNK_DAYS", "30"))
 
+def backfill_pnl_rollup(username: Optional[str] = None, chunk_days: int = PNL_BACKFILL_CHUNK_DAYS,
+                        since: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Rebuild pnl_daily for past days (all users, or one) from orders and
+    realized_trades, `chunk_days` days per transaction so the write lock is
+    never held for long. Today, and past days the EOD pipeline already
+    rolled up, are left alone. Idempotent.
+    """
+    chunk_days = max(1, int(chunk_days))
+    today = _now_ist().strftime("%Y-%m-%d")
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    stats = {"users": 0, "days": 0, "chunks": 0, "rows": 0}
+    try:
+        _ensure_tables(c)
+        conn.commit()
+        if username:
+            users = [username]
+        else:
+            c.execute("SELECT DISTINCT username FROM orders WHERE status='Closed' AND datetime < ?", (today,))
+            users = [r[0] for r in c.fetchall()]
+
+        last = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=1)).date()
+        for user in users:
+            _realize_past_days(conn, c, user, today)
+            c.execute(
+                "SELECT MIN(datetime) FROM orders WHERE username=? AND status='Closed' AND datetime > ? AND datetime < ?",
+                (user, since or "", today),
+            )
+            first = c.fetchone()[0]
+            if not first:
+                continue
+            stats["users"] += 1
+            day = datetime.strptime(first[:10], "%Y-%m-%d").date()
+            while day <= last:
+                end = min(day + timedelta(days=chunk_days - 1), last)
+                lo, hi = day.isoformat(), end.isoformat()
+                rows = _closed_rows_between(c, user, lo, hi + "~")
                 c.execute(
-                    """
-                    SELECT AVG(price), SUM(qty)
-                      FROM orders
-                     WHERE username=? AND script=? AND order_type='BUY' AND status='Closed'
-                    """,
-                    (username, script),
+                    "SELECT order_id, pnl FROM realized_trades WHERE username=? AND exit_date > ? AND exit_date < ?",
+                    (user, lo, hi + "~"),
                 )
-                avg_buy_price, buy_qty = c.fetchone() or (0, 0)
-
-                pnl = (float(sell_price) - float(avg_buy_price or 0)) * int(sell_qty)
-                invested_value = (float(avg_buy_price or 0)) * int(buy_qty or 0)
-
-                history.append({
-                    "symbol": script.upper(),
-                    "buy_qty": int(buy_qty or 0),
-                    "buy_price": round(float(buy_price or 0), 2),
-                    "buy_date": buy_date,
-                    "sell_qty": int(sell_qty),
-                    "sell_avg_price": round(float(sell_price), 2),
-                    "sell_date": dt,
-                    "invested_value": round(invested_value, 2),
-                    "pnl": round(pnl, 2),
-                    "type": "SELL",
-                    "source": "orders(today-manual)"
-                })
+                pnl_by_id = {oid: float(p or 0.0) for oid, p in c.fetchall()}
+                agg = _rollup_rows(rows, pnl_by_id)
 
-        return history
+                c.execute("BEGIN IMMEDIATE")
+                _write_rollup(c, user, lo, hi, agg, source="backfill")
+                conn.commit()
+                stats["chunks"] += 1
+                stats["days"] += len({k[0] for k in agg})
+                stats["rows"] += len(agg)
+                day = end + timedelta(days=1)
+        return stats
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
+@router.post("/pnl/backfill")
+def pnl_backfill(username: Optional[str] = None, chunk_days: int = Query(PNL_BACKFILL_CHUNK_DAYS, ge=1, le=366),
+                 since: Optional[str] = None):
+    """On-demand job: fill pnl_daily for past days (see backfill_pnl_rollup)."""
+    since = _parse_day(since, "since")
+    try:
+        return {"success": True, **backfill_pnl_rollup(username, chunk_days, since)}
     except Exception as e:
-        print("⚠️ Error in get_history:", e)
-        raise HTTPException(status_code=500, detail="Server error in /history")
+        raise HTTPException(status_code=500, detail=f"Backfill failed: {e}")
+
+@router.get("/pnl/{username}")
+def get_pnl(
+    username: str,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    script: Optional[str] = None,
+    group_by: Optional[str] = Query(None, pattern="^(day|script|segment)$"),
+):
+    """
+    Realized P&L over a date range (inclusive, YYYY-MM-DD) as a SUM over
+    pnl_daily. group_by=day|script|segment adds per-group rows.
+    """
+    day_from = _parse_day(from_date, "from")
+    day_to = _parse_day(to_date, "to")
+    where, args = ["username = ?"], [username]
+    if day_from:
+        where.append("trade_date >= ?")
+        args.append(day_from)
+    if day_to:
+        where.append("trade_date <= ?")
+        args.append(day_to)
+    if script:
+        where.append("script = ?")
+        args.append(script.upper().strip())
+    cols = "ROUND(SUM(realized_pnl),2), ROUND(SUM(turnover),2), SUM(buy_qty), SUM(sell_qty), SUM(trades)"
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    try:
+        _ensure_tables(c)
+        c.execute(f"SELECT {cols} FROM pnl_daily WHERE {' AND '.join(where)}", args)
+        pnl, turnover, buy_qty, sell_qty, trades = c.fetchone()
+        out = {
+            "username": username,
+            "from": day_from,
+            "to": day_to,
+            "script": script.upper().strip() if script else None,
+            "realized_pnl": float(pnl or 0.0),
+            "turnover": float(turnover or 0.0),
+            "buy_qty": int(buy_qty or 0),
+            "sell_qty": int(sell_qty or 0),
+            "trades": int(trades or 0),
+        }
+        if group_by:
+            col = {"day": "trade_date", "script": "script", "segment": "segment"}[group_by]
+            c.execute(
+                f"SELECT {col}, {cols} FROM pnl_daily WHERE {' AND '.join(where)} GROUP BY {col} ORDER BY {col}",
+                args,
+            )
+            out["groups"] = [
+                {group_by: k, "realized_pnl": float(p or 0.0), "turnover": float(t or 0.0),
+                 "buy_qty": int(b or 0), "sell_qty": int(sq or 0), "trades": int(n or 0)}
+                for k, p, t, b, sq, n in c.fetchall()
+            ]
+        return out
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
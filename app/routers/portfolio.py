@@ -3,13 +3,13 @@ from fastapi import APIRouter, HTTPException, UploadFile, File
 import sqlite3
 from typing import Dict, Any
 from datetime import datetime
-import requests
 import pandas as pd
 
+from app.services.price_service import get_display_price
+
 router = APIRouter(prefix="/portfolio", tags=["portfolio"])
 
 DB_PATH = "paper_trading.db"
-QUOTES_API = "http://127.0.0.1:8000/quotes?symbols="
 
 
 # ---------- DB helpers ----------
@@ -38,16 +38,8 @@ def _ensure_portfolio_schema(conn: sqlite3.Connection) -> None:
 
 
 def _get_live_price(symbol: str) -> float:
-    try:
-        r = requests.get(QUOTES_API + symbol, timeout=2)
-        arr = r.json() or []
-        if arr and isinstance(arr[0], dict):
-            px = arr[0].get("price")
-            if px is not None:
-                return float(px)
-    except Exception:
-        pass
-    return 0.0
+    # display only: a degraded/fallback quote beats showing 0
+    return get_display_price(symbol)
 
 
 # ---------- API ----------
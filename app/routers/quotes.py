@@ -1,157 +1,194 @@
-from fastapi import APIRouter, HTTPException
-from app.services.kite_ws_manager import get_quote, get_instrument, subscribe_symbol
-import os
-from kiteconnect import KiteConnect
+# Backend/app/routers/quotes.py
+import asyncio
+import threading
+import time
+from typing import Dict, List, Set
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from app.services import kite_ws_manager as manager
+from app.services.kite_ws_manager import get_instrument, cache_stats
+from app.services.price_service import get_ticks, get_ticks_async, run_blocking
 
 router = APIRouter(prefix="/quotes", tags=["quotes"])
 
-API_KEY = os.getenv("KITE_API_KEY")
-ACCESS_TOKEN = os.getenv("KITE_ACCESS_TOKEN")
-
-kite = None
-if API_KEY and ACCESS_TOKEN:
-    kite = KiteConnect(api_key=API_KEY)
-    kite.set_access_token(ACCESS_TOKEN)
-
-try:
-    @router.get("")
-
-    async def get_quotes(symbols: str):
-        syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
-        if not syms:
-            raise HTTPException(status_code=400, detail="No symbols provided")
-
-        out = []
-        for sym in syms:
-            # Ensure subscription in WS
-            subscribe_symbol(sym)
-
-            tick = get_quote(sym)
-            inst = get_instrument(sym)
-
-            if inst is None:
-                out.append({
-                    "symbol": sym,
-                    "mapped_symbol": sym,  # preserve field from your current API
-                    "price": None,
-                    "change": None,
-                    "pct_change": None,
-                    "exchange": None,
-                    "dayHigh": None,
-                    "dayLow": None,
-                    "error": "Symbol not found in instruments"
-                })
-                continue
-
-            price = None
-            change = None
-            pct = None
-            day_high = None
-            day_low = None
-
-            if tick:
-                price = tick.get("last_price")
-                ohlc = tick.get("ohlc") or {}
-                prev = ohlc.get("close")
-
-                if price is not None and prev:
-                    change = price - prev
-                    pct = (change / prev) * 100
-
-            # Add REST-based day high/low
-            if kite:
-                try:
-                    q = kite.quote(f"{inst['exchange']}:{sym}")
-                    qdata = q[f"{inst['exchange']}:{sym}"]
-                    day_high = qdata.get("ohlc", {}).get("high")
-                    day_low = qdata.get("ohlc", {}).get("low")
-                except Exception as e:
-                    print(f"⚠️ Failed to fetch high/low for {sym}: {e}")
-
-            out.append({
-                "symbol": sym,
-                "mapped_symbol": sym,  # keep for backward compatibility
-                "price": round(price, 2) if price is not None else None,
-                "change": round(change, 2) if change is not None else None,
-                "pct_change": round(pct, 2) if pct is not None else None,
-                "exchange": inst.get("exchange"),
-                "dayHigh": day_high,
-                "dayLow": day_low,
-                "lot_size": inst.get("lot_size"),
-                "segment": inst.get("segment"),
-                "instrument_type": inst.get("instrument_type"),
-            })
-
-        return out
-        IS_ZERODHA=1
-except:
-    # Backend/app/routers/quotes.py
-    import yfinance as yf
-    print("yfinance Module Run To Fetch the real time price")
-    from fastapi import APIRouter, HTTPException
-
-    router = APIRouter(prefix="/quotes", tags=["quotes"])
-
-    MANUAL_PRICE = 28
-    MANUAL = 0
-
-
-    def map_symbol(symbol: str) -> str:
-        symbol = symbol.upper()
-        if symbol == "NIFTY":
-            return "^NSEI"
-        elif symbol == "BANKNIFTY":
-            return "^NSEBANK"
-        elif symbol == "SENSEX":
-            return "^BSESN"
-        elif not symbol.endswith(".NS") and not symbol.startswith("^"):
-            return symbol + ".NS"
-        return symbol
-
-    @router.get("")
-    async def get_quotes(symbols: str):
-        syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
-        if not syms:
-            raise HTTPException(status_code=400, detail="No symbols provided")
-
-        out = []
-        for sym in syms:
+# /quotes/stream: fastest push rate a client may ask for, and a cap on
+# how many symbols one connection can watch.
+STREAM_MIN_INTERVAL = 0.25
+STREAM_MAX_INTERVAL = 10.0
+STREAM_MAX_SYMBOLS = 200
+
+
+def _quote_row(sym, tick):
+    inst = get_instrument(sym)
+
+    if inst is None:
+        return {
+            "symbol": sym,
+            "mapped_symbol": sym,  # preserve field from your current API
+            "price": None,
+            "change": None,
+            "pct_change": None,
+            "exchange": None,
+            "dayHigh": None,
+            "dayLow": None,
+            "error": "Symbol not found in instruments"
+        }
+
+    price = None
+    change = None
+    pct = None
+    day_high = None
+    day_low = None
+    age = None
+
+    if tick:
+        price = tick.get("last_price")
+        ohlc = tick.get("ohlc") or {}
+        prev = ohlc.get("close")
+        day_high = ohlc.get("high")
+        day_low = ohlc.get("low")
+
+        if price is not None and prev:
+            change = price - prev
+            pct = (change / prev) * 100
+        if tick.get("as_of"):
+            age = max(0.0, time.time() - float(tick["as_of"]))
+
+    return {
+        "symbol": sym,
+        "mapped_symbol": sym,  # keep for backward compatibility
+        "price": round(price, 2) if price is not None else None,
+        "change": round(change, 2) if change is not None else None,
+        "pct_change": round(pct, 2) if pct is not None else None,
+        "exchange": inst.get("exchange"),
+        "dayHigh": round(day_high, 2) if day_high is not None else None,
+        "dayLow": round(day_low, 2) if day_low is not None else None,
+        "lot_size": inst.get("lot_size"),
+        "segment": inst.get("segment"),
+        "instrument_type": inst.get("instrument_type"),
+        # where the price came from (kite / yfinance / snapshot / ...) and
+        # how many seconds old it is; large ages mean a degraded fallback
+        "price_source": (tick or {}).get("source"),
+        "price_age": round(age, 1) if age is not None else None,
+    }
+
+
+def _quote_rows(syms):
+    # Resolve everything first, then one batched upstream call (kite.quote,
+    # or yf.download when Kite isn't configured) for whatever isn't already
+    # in the tick cache. High/low/prev close come from the same payload.
+    ticks = get_ticks(syms)
+    return [_quote_row(sym, ticks.get(sym)) for sym in syms]
+
+
+@router.get("")
+async def get_quotes(symbols: str):
+    syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+    if not syms:
+        raise HTTPException(status_code=400, detail="No symbols provided")
+
+    # upstream fetches + instrument lookups block; keep them off the event loop
+    return await run_blocking(_quote_rows, syms)
+
+
+@router.get("/cache-stats")
+def get_cache_stats():
+    """Tick cache counters (hits, misses, coalesced fetches, evictions) and provider breaker states."""
+    return cache_stats()
+
+
+def _parse_symbols(raw) -> List[str]:
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    out = [str(x).strip().upper() for x in (raw or []) if str(x).strip()]
+    return list(dict.fromkeys(out))[:STREAM_MAX_SYMBOLS]
+
+
+@router.websocket("/stream")
+async def stream_quotes(websocket: WebSocket, symbols: str = "", interval: float = 1.0):
+    """
+    Server-push quotes for a watchlist.
+
+      connect:  ws://<host>/quotes/stream?symbols=RELIANCE,TCS&interval=1
+      change:   send {"symbols": ["RELIANCE", "INFY"]}
+      receive:  {"type": "quotes", "data": [<rows shaped like GET /quotes>]}
+
+    Reads the shared tick cache, so one upstream subscription per symbol
+    serves every connected client. Pushes at most once per `interval`
+    seconds, and only the symbols whose tick changed since the last push.
+    """
+    await websocket.accept()
+    try:
+        interval = float(interval)
+    except Exception:
+        interval = 1.0
+    interval = min(max(interval, STREAM_MIN_INTERVAL), STREAM_MAX_INTERVAL)
+
+    watched: Set[str] = set()
+    subbed: Set[str] = set()      # the watched symbols we hold a stream reference for
+    sent: Dict[str, tuple] = {}   # symbol -> last pushed (ltp, high, low, prev close)
+    lock = threading.Lock()
+
+    def _watch(new_syms: List[str]):
+        """Blocking (subscribe may start the ticker): run via run_blocking."""
+        nonlocal watched
+        new = set(new_syms)
+        with lock:
+            for sym in new - subbed:
+                # None: stream full or not streamable; the symbol is then
+                # served from the REST cache and must not be unsubscribed
+                if manager.subscribe(sym) is not None:
+                    subbed.add(sym)
+            for sym in subbed - new:
+                manager.unsubscribe(sym)
+                subbed.discard(sym)
+            for sym in watched - new:
+                sent.pop(sym, None)
+            watched = new
+
+    await run_blocking(_watch, _parse_symbols(symbols))
+    closed = asyncio.Event()
+
+    async def _reader():
+        try:
+            while True:
+                msg = await websocket.receive_json()
+                if isinstance(msg, dict) and "symbols" in msg:
+                    await run_blocking(_watch, _parse_symbols(msg.get("symbols")))
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            print(f"⚠️ /quotes/stream reader: {e}")
+        finally:
+            closed.set()
+
+    reader = asyncio.create_task(_reader())
+    try:
+        while not closed.is_set():
+            if watched:
+                syms = sorted(watched)
+                ticks = await get_ticks_async(syms)
+                changed = []
+                for sym in syms:
+                    tick = ticks.get(sym) or {}
+                    if not tick:
+                        continue
+                    ohlc = tick.get("ohlc") or {}
+                    sig = (tick.get("last_price"), ohlc.get("high"), ohlc.get("low"), ohlc.get("close"))
+                    if sent.get(sym) != sig:
+                        sent[sym] = sig
+                        changed.append(_quote_row(sym, tick))
+                if changed:
+                    await websocket.send_json({"type": "quotes", "data": changed})
             try:
-                mapped = map_symbol(sym)
-                tk = yf.Ticker(mapped)
-                info = tk.fast_info
-                if MANUAL == 0:
-                    price = info.last_price
-                else:
-                    price = MANUAL_PRICE
-                    prev  = info.previous_close
-                    change = price - prev
-                    pct    = (change/prev)*100 if prev else 0
-                    exch   = info.exchange or "NSE"
-                    day_high = getattr(info, "day_high", None)
-                    day_low  = getattr(info, "day_low", None)
-
-                # ✅ Add dayHigh and dayLow here
-                out.append({
-                    "symbol": sym,
-                    "mapped_symbol": mapped,
-                    "price": round(price, 2),
-                    "change": round(change, 2),
-                    "pct_change": round(pct, 2),
-                    "exchange": exch,
-                    "dayHigh": round(day_high, 2),
-                    "dayLow": round(day_low, 2)
-                })
-            except Exception as e:
-                out.append({
-                    "symbol": sym,
-                    "mapped_symbol": mapped,
-                    "price": None,
-                    "change": None,
-                    "pct_change": None,
-                    "exchange": None,
-                    "dayHigh": None,
-                    "dayLow": None,
-                    "error": str(e)
-                })
-        return out
\ No newline at end of file
+                await asyncio.wait_for(closed.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"⚠️ /quotes/stream error: {e}")
+    finally:
+        reader.cancel()
+        # shielded: on a cancelled connection the references must still go
+        await asyncio.shield(run_blocking(_watch, []))
@@ -1,6 +1,7 @@
 # backend/app/routers/search.py
 from fastapi import APIRouter, Query
-from typing import List, Optional
+from typing import List, Optional, Tuple
+import bisect
 import os
 import pandas as pd
 
@@ -155,13 +156,45 @@ def _build_master_df() -> pd.DataFrame:
 
 # ---- cache the master table (rebuild with ?refresh=1) ----
 _MASTER: Optional[pd.DataFrame] = None
+# sorted (lowercased key, row position) lists for prefix lookups via bisect
+_SYMBOL_KEYS: List[Tuple[str, int]] = []
+_NAME_KEYS: List[Tuple[str, int]] = []
+SEARCH_LIMIT = 50
+
+
 def _get_master(refresh: bool = False) -> pd.DataFrame:
-    global _MASTER
+    global _MASTER, _SYMBOL_KEYS, _NAME_KEYS
     if refresh or _MASTER is None:
-        _MASTER = _build_master_df()
+        master = _build_master_df()
+        _SYMBOL_KEYS = sorted(zip(master["tradingsymbol"].str.lower(), range(len(master))))
+        _NAME_KEYS = sorted(zip(master["name"].str.lower(), range(len(master))))
+        _MASTER = master
     return _MASTER
 
 
+def _prefix_positions(keys: List[Tuple[str, int]], term: str) -> List[int]:
+    i = bisect.bisect_left(keys, (term, -1))
+    out: List[int] = []
+    while i < len(keys) and keys[i][0].startswith(term):
+        out.append(keys[i][1])
+        i += 1
+    return out
+
+
+def _rows_out(sub: pd.DataFrame) -> List[dict]:
+    return [
+        {
+            "symbol": r["tradingsymbol"],
+            "name": r.get("name", ""),
+            "segment": r.get("segment", ""),
+            "instrument_type": r.get("instrument_type", ""),
+            "exchange": r.get("exchange", ""),
+            "display_name": f"{r['tradingsymbol']} ({r.get('exchange','')}) | {r.get('segment','')} | {r.get('instrument_type','')}",
+        }
+        for _, r in sub.iterrows()
+    ]
+
+
 # ---------------------------------- routes ----------------------------------
 @router.get("/", response_model=List[dict])
 def search_scripts(q: Optional[str] = Query(None), refresh: Optional[int] = None):
@@ -184,6 +217,13 @@ def search_scripts(q: Optional[str] = Query(None), refresh: Optional[int] = None
     if not tokens:
         return []
 
+    # Prefix matches (symbol or name) rank first and contain every token;
+    # when they alone fill the page, skip the substring scan.
+    prefix = set(_prefix_positions(_SYMBOL_KEYS, term)) | set(_prefix_positions(_NAME_KEYS, term))
+    if len(prefix) >= SEARCH_LIMIT:
+        sub = df.iloc[sorted(prefix)]
+        return _rows_out(sub.sort_values(by=["tradingsymbol", "exchange"]).head(SEARCH_LIMIT))
+
     mask = pd.Series(True, index=df.index)
     for t in tokens:
         mask &= df["__blob"].str.contains(t, na=False)
@@ -196,19 +236,8 @@ def search_scripts(q: Optional[str] = Query(None), refresh: Optional[int] = None
         sub["name"].str.lower().str.startswith(term)
     )
     sub["_rank"] = (~starts).astype(int)  # 0 → prefix, 1 → contains
-    sub = sub.sort_values(by=["_rank", "tradingsymbol", "exchange"]).head(50)
-
-    return [
-        {
-            "symbol": r["tradingsymbol"],
-            "name": r.get("name", ""),
-            "segment": r.get("segment", ""),
-            "instrument_type": r.get("instrument_type", ""),
-            "exchange": r.get("exchange", ""),
-            "display_name": f"{r['tradingsymbol']} ({r.get('exchange','')}) | {r.get('segment','')} | {r.get('instrument_type','')}",
-        }
-        for _, r in sub.iterrows()
-    ]
+    sub = sub.sort_values(by=["_rank", "tradingsymbol", "exchange"]).head(SEARCH_LIMIT)
+    return _rows_out(sub)
 
 
 @router.get("/scripts")
@@ -221,15 +250,4 @@ def list_scripts(refresh: Optional[int] = None):
     if df.empty:
         return []
     df = df.sort_values(by=["tradingsymbol", "exchange"]).head(1000)
-
-    return [
-        {
-            "symbol": r["tradingsymbol"],
-            "name": r.get("name", ""),
-            "segment": r.get("segment", ""),
-            "instrument_type": r.get("instrument_type", ""),
-            "exchange": r.get("exchange", ""),
-            "display_name": f"{r['tradingsymbol']} ({r.get('exchange','')}) | {r.get('segment','')} | {r.get('instrument_type','')}",
-        }
-        for _, r in df.iterrows()
-    ]
+    return _rows_out(df)
@@ -0,0 +1,94 @@
+# backend/app/services/circuit_breaker.py
+"""
+Per-provider circuit breaker with a latency budget.
+
+closed     -> calls go through; `failure_threshold` consecutive failures
+              (errors, or calls slower than `latency_budget`) open the
+              breaker
+open       -> allow() is False (a lock + a clock read) until `reset_timeout`
+              seconds have passed
+half_open  -> exactly one probe call is let through; success closes the
+              breaker, failure re-opens it
+"""
+import threading
+import time
+from typing import Dict, Any
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        latency_budget: float = 1.0,
+    ):
+        self.name = name
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.latency_budget = float(latency_budget)
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.skipped = 0
+        self.trips = 0
+        self.last_error = None
+        self.last_latency = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                self.calls += 1
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self.calls += 1
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self, elapsed: float) -> None:
+        if elapsed > self.latency_budget:
+            self.record_failure(f"slow: {elapsed:.3f}s > budget {self.latency_budget:.3f}s", elapsed)
+            return
+        with self._lock:
+            self.last_latency = elapsed
+            self.failures = 0
+            self.state = self.CLOSED
+            self._probing = False
+
+    def record_failure(self, reason: str, elapsed: float = None) -> None:
+        with self._lock:
+            self.last_error = reason
+            self.last_latency = elapsed
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "trips": self.trips,
+            "latency_budget": self.latency_budget,
+            "last_latency": round(self.last_latency, 4) if self.last_latency is not None else None,
+            "last_error": self.last_error,
+        }
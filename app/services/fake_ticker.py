@@ -0,0 +1,89 @@
+# backend/app/services/fake_ticker.py
+"""
+Offline stand-in for kiteconnect.KiteTicker.
+
+Same callbacks (on_connect / on_ticks / on_close / on_error) and the same
+subscribe / unsubscribe / set_mode / close surface, but nothing touches the
+network: ticks are injected with push(). Select it with KITE_TICKER=fake.
+
+    from app.services import kite_ws_manager as manager
+    manager.subscribe("RELIANCE")
+    manager._WS.push([{"instrument_token": 738561, "last_price": 2950.5}])
+"""
+import threading
+from typing import Dict, Any, List, Optional
+
+
+class FakeTicker:
+    MODE_FULL = "full"
+    MODE_QUOTE = "quote"
+    MODE_LTP = "ltp"
+
+    def __init__(self, api_key: Optional[str] = None, access_token: Optional[str] = None, **kwargs):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.subscribed_tokens: Dict[int, str] = {}
+        self._connected = False
+        self._lock = threading.Lock()
+
+        # Callbacks, same names as KiteTicker
+        self.on_connect = None
+        self.on_ticks = None
+        self.on_close = None
+        self.on_error = None
+
+    # ---- connection ----
+    def connect(self, threaded: bool = False, **kwargs):
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, {"fake": True})
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def close(self, code=None, reason=None):
+        if not self._connected:
+            return
+        self._connected = False
+        if self.on_close:
+            self.on_close(self, code, reason)
+
+    def stop(self):
+        self.close()
+
+    def stop_retry(self):
+        pass
+
+    # ---- subscriptions ----
+    def subscribe(self, instrument_tokens: List[int]) -> bool:
+        with self._lock:
+            for t in instrument_tokens:
+                self.subscribed_tokens[int(t)] = self.MODE_QUOTE
+        return True
+
+    def unsubscribe(self, instrument_tokens: List[int]) -> bool:
+        with self._lock:
+            for t in instrument_tokens:
+                self.subscribed_tokens.pop(int(t), None)
+        return True
+
+    def set_mode(self, mode: str, instrument_tokens: List[int]) -> bool:
+        with self._lock:
+            for t in instrument_tokens:
+                self.subscribed_tokens[int(t)] = mode
+        return True
+
+    # ---- test helper ----
+    def push(self, ticks: List[Dict[str, Any]]) -> int:
+        """
+        Deliver ticks to on_ticks, like a binary frame from Kite would.
+        Ticks for tokens that aren't subscribed are dropped (as upstream does).
+        Returns how many ticks were delivered.
+        """
+        if not self._connected:
+            return 0
+        with self._lock:
+            live = [t for t in ticks if int(t.get("instrument_token", 0)) in self.subscribed_tokens]
+        if live and self.on_ticks:
+            self.on_ticks(self, live)
+        return len(live)
@@ -1,5 +1,6 @@
 # app/services/history.py
-from typing import List, Dict
+from collections import deque
+from typing import Any, Deque, List, Dict
 from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel
 
@@ -12,62 +13,86 @@ class HistoryItem(BaseModel):
     remaining_qty: int
     is_closed: bool
 
+_IST = timezone(timedelta(hours=5, minutes=30))
+
 def _fmt_time_ist(dt: datetime) -> str:
     # Treat naive as UTC; convert to IST (UTC+5:30)
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=timezone.utc)
-    ist = dt.astimezone(timezone(timedelta(hours=5, minutes=30)))
+    ist = dt.astimezone(_IST)
     return ist.strftime("%H:%M")
 
-def build_history(username: str, orders: List) -> List[HistoryItem]:
+class _Lot:
+    """One BUY lot; a plain slotted record, not a model, while matching."""
+    __slots__ = ("time", "buy_qty", "buy_price", "remaining_qty", "realized_pnl")
+
+    def __init__(self, time: str, qty: int, price: float):
+        self.time = time
+        self.buy_qty = qty
+        self.buy_price = price
+        self.remaining_qty = qty
+        self.realized_pnl = 0.0
+
+def build_history_rows(username: str, orders: List) -> List[Dict[str, Any]]:
+    """
+    FIFO-match SELLs against BUY lots per symbol; one dict per BUY lot,
+    newest BUY time first. Each symbol keeps a deque of lots that still have
+    quantity: a SELL only ever looks at its head, and exhausted lots are
+    popped, so matching is O(fills) instead of rescanning closed lots.
+    """
     # Consider only filled orders
     filled = [o for o in orders if getattr(o, "status", "Filled") == "Filled"]
     filled.sort(key=lambda o: o.created_at)
 
-    # Per-symbol FIFO lots
-    symbol_lots: Dict[str, List[dict]] = {}
+    symbol_lots: Dict[str, List[_Lot]] = {}   # every lot, for output
+    open_lots: Dict[str, Deque[_Lot]] = {}    # lots with remaining qty, oldest first
 
     for o in filled:
         side = o.side.upper()
         sym = o.symbol
-        symbol_lots.setdefault(sym, [])
+        queue = open_lots.get(sym)
+        if queue is None:
+            queue = open_lots[sym] = deque()
+            symbol_lots[sym] = []
 
         if side == "BUY":
-            symbol_lots[sym].append({
-                "time": _fmt_time_ist(o.created_at),
-                "symbol": sym,
-                "buy_qty": int(o.qty),
-                "buy_price": float(o.price),
-                "remaining_qty": int(o.qty),
-                "realized_pnl": 0.0,
-            })
+            lot = _Lot(_fmt_time_ist(o.created_at), int(o.qty), float(o.price))
+            queue.append(lot)
+            symbol_lots[sym].append(lot)
         elif side == "SELL":
             sell_qty_left = int(o.qty)
             sell_price = float(o.price)
-            for lot in symbol_lots[sym]:
-                if sell_qty_left <= 0:
-                    break
-                if lot["remaining_qty"] <= 0:
-                    continue
-                take = min(lot["remaining_qty"], sell_qty_left)
-                lot["realized_pnl"] += (sell_price - lot["buy_price"]) * take
-                lot["remaining_qty"] -= take
+            while sell_qty_left > 0 and queue:
+                lot = queue[0]
+                take = min(lot.remaining_qty, sell_qty_left)
+                lot.realized_pnl += (sell_price - lot.buy_price) * take
+                lot.remaining_qty -= take
                 sell_qty_left -= take
+                if lot.remaining_qty == 0:
+                    queue.popleft()
             # If sell_qty_left > 0, ignore (short not handled)
 
-    items: List[HistoryItem] = []
-    for sym, lots in symbol_lots.items():
-        for lot in lots:
-            items.append(HistoryItem(
-                time=lot["time"],
-                symbol=sym,
-                buy_qty=lot["buy_qty"],
-                buy_price=lot["buy_price"],
-                pnl=round(lot["realized_pnl"], 2),
-                remaining_qty=lot["remaining_qty"],
-                is_closed=(lot["remaining_qty"] == 0),
-            ))
-
+    rows = [
+        {
+            "time": lot.time,
+            "symbol": sym,
+            "buy_qty": lot.buy_qty,
+            "buy_price": lot.buy_price,
+            "pnl": round(lot.realized_pnl, 2),
+            "remaining_qty": lot.remaining_qty,
+            "is_closed": lot.remaining_qty == 0,
+        }
+        for sym, lots in symbol_lots.items()
+        for lot in lots
+    ]
     # newest first (optional)
-    items.sort(key=lambda x: x.time, reverse=True)
-    return items
+    rows.sort(key=lambda r: r["time"], reverse=True)
+    return rows
+
+# The rows above are built from already-typed values, so wrapping them
+# skips validation: model_construct (pydantic v2; construct on v1) only
+# sets attributes. Callers that serialize can use build_history_rows().
+_construct = getattr(HistoryItem, "model_construct", None) or HistoryItem.construct
+
+def build_history(username: str, orders: List) -> List[HistoryItem]:
+    return [_construct(**r) for r in build_history_rows(username, orders)]
@@ -1,14 +1,25 @@
 # backend/app/services/kite_ws_manager.py
+import bisect
 import os
+import threading
 import time
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable
 
 import pandas as pd
 
 try:
-    from kiteconnect import KiteConnect
+    from kiteconnect import KiteConnect, KiteTicker
 except Exception:
     KiteConnect = None
+    KiteTicker = None
+
+from app.services.fake_ticker import FakeTicker
+from app.services.quote_cache import QuoteCache
+from app.services import yf_provider
+from app.services import replay_provider
+from app.services import snapshot_provider
+from app.services.circuit_breaker import CircuitBreaker
 
 # --------------------------------------------------------------------
 # Config
@@ -17,6 +28,44 @@ except Exception:
 # prefer this one unless the caller already provides EXCHANGE:TS.
 PREFERRED_EXCHANGE = os.getenv("PREFERRED_EXCHANGE", "NSE").upper()
 
+# Where snapshot prices come from:
+#   auto     - Kite (if KITE_API_KEY/KITE_ACCESS_TOKEN are set), then Yahoo
+#   kite     - Kite only
+#   yfinance - Yahoo only
+#   replay   - a recorded tick file (see replay_provider; no network at all)
+# Whatever a live provider can't price falls back to the last known tick,
+# then to the newest local snapshot CSV (see snapshot_provider).
+PRICE_PROVIDER = os.getenv("PRICE_PROVIDER", "auto").lower()
+
+# Per-provider latency budgets (seconds). A call slower than its budget
+# counts as a failure; BREAKER_FAILURES in a row open the breaker and the
+# provider is skipped for BREAKER_RESET seconds.
+KITE_LATENCY_BUDGET = float(os.getenv("KITE_LATENCY_BUDGET", "1.0"))
+YF_LATENCY_BUDGET = float(os.getenv("YF_LATENCY_BUDGET", "3.0"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+
+# "kite" (default) streams from Zerodha; "fake" uses the offline FakeTicker.
+TICKER_KIND = os.getenv("KITE_TICKER", "kite").lower()
+
+# kite.py overwrites this after /kite/reload-access-token
+ACCESS_TOKEN = os.getenv("KITE_ACCESS_TOKEN")
+
+# Kite's /quote accepts at most 500 instruments per call.
+KITE_QUOTE_BATCH = 500
+
+# REST snapshots are reused for QUOTE_TTL seconds; streamed symbols never
+# go stale. At most QUOTE_CACHE_SIZE symbols are kept (LRU).
+QUOTE_TTL = float(os.getenv("QUOTE_TTL", "3"))
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", "5000"))
+
+# Stream subscriptions are capped separately from the cache. A KiteTicker
+# connection takes at most KITE_MAX_SUBSCRIPTIONS instruments; symbols
+# that were merely quoted hold at most QUOTE_PIN_MAX of them (LRU), so
+# open orders, positions and ws clients always find room.
+KITE_MAX_SUBSCRIPTIONS = int(os.getenv("KITE_MAX_SUBSCRIPTIONS", "3000"))
+QUOTE_PIN_MAX = int(os.getenv("QUOTE_PIN_MAX", "500"))
+
 # --------------------------------------------------------------------
 # Load instruments.csv once
 # --------------------------------------------------------------------
@@ -30,11 +79,79 @@ except Exception as e:
     INSTRUMENTS_DF = pd.DataFrame()
     EQUITY_DF = pd.DataFrame()
 
+# --------------------------------------------------------------------
+# Instrument registry (built once; symbol resolution is a dict lookup)
+# --------------------------------------------------------------------
+_BY_SYMBOL: Dict[str, Dict[str, Any]] = {}               # TS -> row on PREFERRED_EXCHANGE (else first)
+_BY_EXCH_SYMBOL: Dict[Tuple[str, str], Dict[str, Any]] = {}  # (EX, TS) -> row
+_BY_TOKEN: Dict[int, Dict[str, Any]] = {}                # instrument_token -> row
+_SYMBOL_KEYS: List[Tuple[str, str]] = []                 # sorted (TS, EX) keys of _BY_EXCH_SYMBOL
+
+
+def _build_instrument_index(df: pd.DataFrame) -> None:
+    """Index instruments.csv by upper-cased tradingsymbol, (exchange, symbol) and token."""
+    by_symbol: Dict[str, Dict[str, Any]] = {}
+    by_exch: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    by_token: Dict[int, Dict[str, Any]] = {}
+
+    if not df.empty and "tradingsymbol" in df.columns:
+        for r in df.to_dict("records"):
+            ts = str(r.get("tradingsymbol", "")).upper()
+            if not ts:
+                continue
+            ex = str(r.get("exchange", "") or "").upper()
+
+            # first row wins, unless a later one is on the preferred exchange
+            cur = by_symbol.get(ts)
+            if cur is None or (
+                ex == PREFERRED_EXCHANGE
+                and str(cur.get("exchange", "") or "").upper() != PREFERRED_EXCHANGE
+            ):
+                by_symbol[ts] = r
+
+            by_exch.setdefault((ex, ts), r)
+            try:
+                by_token.setdefault(int(r.get("instrument_token")), r)
+            except Exception:
+                pass
+
+    _BY_SYMBOL.clear(); _BY_SYMBOL.update(by_symbol)
+    _BY_EXCH_SYMBOL.clear(); _BY_EXCH_SYMBOL.update(by_exch)
+    _BY_TOKEN.clear(); _BY_TOKEN.update(by_token)
+    _SYMBOL_KEYS[:] = sorted((ts, ex) for ex, ts in by_exch)
+
+
+def _symbol_prefix_rows(prefix: str):
+    """Rows whose tradingsymbol starts with `prefix`, in (symbol, exchange) order."""
+    i = bisect.bisect_left(_SYMBOL_KEYS, (prefix, ""))
+    while i < len(_SYMBOL_KEYS) and _SYMBOL_KEYS[i][0].startswith(prefix):
+        ts, ex = _SYMBOL_KEYS[i]
+        yield _BY_EXCH_SYMBOL[(ex, ts)]
+        i += 1
+
+
+_build_instrument_index(INSTRUMENTS_DF)
+
+
+def get_instrument_by_token(token: int) -> Dict[str, Any]:
+    """Raw instruments.csv row for an instrument_token ({} if unknown)."""
+    try:
+        return _BY_TOKEN.get(int(token)) or {}
+    except Exception:
+        return {}
+
 # --------------------------------------------------------------------
 # Tick cache
 # --------------------------------------------------------------------
-_LAST_TICKS: Dict[str, Dict[str, Any]] = {}
-_LAST_TS: Dict[str, float] = {}
+# Keyed by the upper-cased symbol callers use. Evicting a symbol also
+# drops the stream subscription get_quote() pinned for it.
+def _on_evict(key: str) -> None:
+    if key in _AUTO_SUBS:
+        _AUTO_SUBS.pop(key, None)
+        unsubscribe(key)
+
+
+TICK_CACHE = QuoteCache(ttl=QUOTE_TTL, maxsize=QUOTE_CACHE_SIZE, on_evict=_on_evict)
 
 # --------------------------------------------------------------------
 # Index shortcuts
@@ -71,23 +188,12 @@ def _map_symbol_zerodha(symbol: str) -> Optional[str]:
     if u in _INDEX_MAP_ZERODHA:
         return _INDEX_MAP_ZERODHA[u]
 
-    # Resolve via instruments.csv
-    if not INSTRUMENTS_DF.empty and "tradingsymbol" in INSTRUMENTS_DF.columns:
-        rows = INSTRUMENTS_DF.loc[
-            INSTRUMENTS_DF["tradingsymbol"].str.upper() == u
-        ]
-
-        if not rows.empty:
-            # If listed multiple times, prefer configured exchange
-            if len(rows) > 1 and "exchange" in rows.columns:
-                pref = rows.loc[rows["exchange"].str.upper() == PREFERRED_EXCHANGE]
-                if not pref.empty:
-                    rows = pref
-
-            r = rows.iloc[0]
-            ex = str(r.get("exchange", PREFERRED_EXCHANGE)).upper()
-            ts = str(r.get("tradingsymbol", u))
-            return f"{ex}:{ts}"
+    # Resolve via the instrument registry (preferred exchange already applied)
+    r = _BY_SYMBOL.get(u)
+    if r is not None:
+        ex = str(r.get("exchange") or PREFERRED_EXCHANGE).upper()
+        ts = str(r.get("tradingsymbol", u))
+        return f"{ex}:{ts}"
 
     # Last resort
     return f"{PREFERRED_EXCHANGE}:{u}"
@@ -100,38 +206,401 @@ def _ensure_kite():
     access_token = os.getenv("KITE_ACCESS_TOKEN")
     if not api_key or not access_token:
         raise RuntimeError("KITE_API_KEY / KITE_ACCESS_TOKEN not set in env")
-    kite = KiteConnect(api_key=api_key)
+    kite = KiteConnect(api_key=api_key, timeout=max(1, int(round(KITE_LATENCY_BUDGET))))
     kite.set_access_token(access_token)
     return kite
 
 
-def subscribe_symbol(symbol: str) -> Dict[str, Any]:
-    """Get live quote from Kite and cache it."""
+def _instrument_token(symbol: str) -> Optional[int]:
+    """instrument_token for a symbol (needed to stream it), or None."""
     z = _map_symbol_zerodha(symbol)
     if not z:
-        return {}
-    kite = _ensure_kite()
-    data = kite.quote([z]) or {}
-    item = data.get(z) or {}
-    tick = {
+        return None
+    ex, _, ts = z.partition(":")
+    r = _BY_EXCH_SYMBOL.get((ex, ts.upper()))
+    if r is None:
+        return None
+    try:
+        return int(r.get("instrument_token"))
+    except Exception:
+        return None
+
+
+def _store_tick(key: str, tick: Dict[str, Any]) -> None:
+    TICK_CACHE.put(key, tick)
+
+
+# Called with the cache keys of every batch of *pushed* ticks (Kite stream,
+# replay feed). REST snapshots don't notify: they are pulled by the same
+# code that would be listening.
+_TICK_LISTENERS: List[Callable[[List[str]], None]] = []
+
+
+def add_tick_listener(fn: Callable[[List[str]], None]) -> None:
+    if fn not in _TICK_LISTENERS:
+        _TICK_LISTENERS.append(fn)
+
+
+def _notify_ticks(keys: List[str]) -> None:
+    if not keys:
+        return
+    for fn in list(_TICK_LISTENERS):
+        try:
+            fn(keys)
+        except Exception as e:
+            print(f"⚠️ tick listener failed: {e}")
+
+
+def _tick_from_quote(z: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "tradingsymbol": z,  # qualified EX:TS
         "last_price": item.get("last_price"),
         "ohlc": item.get("ohlc") or {},
         "timestamp": item.get("timestamp"),
     }
-    key = symbol.upper().strip()
-    _LAST_TICKS[key] = tick
-    _LAST_TS[key] = time.time()
-    return tick
+
+
+def fetch_quotes(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    REST snapshot for many symbols: one kite.quote([...]) per
+    KITE_QUOTE_BATCH instruments. Every tick is cached; the result is keyed
+    by the upper-cased symbol the caller passed in.
+    """
+    wanted: Dict[str, List[str]] = {}   # EX:TS -> caller keys
+    for sym in symbols:
+        key = (sym or "").upper().strip()
+        z = _map_symbol_zerodha(key)
+        if z:
+            wanted.setdefault(z, []).append(key)
+    if not wanted:
+        return {}
+
+    kite = _ensure_kite()
+    out: Dict[str, Dict[str, Any]] = {}
+    zs = list(wanted.keys())
+    for i in range(0, len(zs), KITE_QUOTE_BATCH):
+        chunk = zs[i:i + KITE_QUOTE_BATCH]
+        data = kite.quote(chunk) or {}
+        for z in chunk:
+            item = data.get(z)
+            if not item:
+                continue
+            tick = _tick_from_quote(z, item)
+            for key in wanted[z]:
+                _store_tick(key, tick)
+                out[key] = tick
+    return out
+
+
+def _kite_configured() -> bool:
+    return KiteConnect is not None and bool(os.getenv("KITE_API_KEY")) and bool(os.getenv("KITE_ACCESS_TOKEN"))
+
+
+def publish_tick(symbol: str, tick: Dict[str, Any]) -> None:
+    """Push a tick from a non-Kite feed (e.g. replay) into the tick cache."""
+    key = (symbol or "").upper().strip()
+    if key and tick:
+        _store_tick(key, dict(tick, source=tick.get("source") or "replay", as_of=time.time()))
+        _notify_ticks([key])
+
+
+# --------------------------------------------------------------------
+# Provider fallback chain
+# --------------------------------------------------------------------
+_BREAKERS: Dict[str, CircuitBreaker] = {
+    "kite": CircuitBreaker("kite", BREAKER_FAILURES, BREAKER_RESET, KITE_LATENCY_BUDGET),
+    "yfinance": CircuitBreaker("yfinance", BREAKER_FAILURES, BREAKER_RESET, YF_LATENCY_BUDGET),
+}
+_PROVIDERS = {
+    "kite": lambda syms: fetch_quotes(syms),
+    "yfinance": lambda syms: yf_provider.fetch_quotes(syms),
+}
+
+
+# Ticks fetch_upstream() serves when no live provider answered.
+FALLBACK_SOURCES = ("snapshot", "cache")
+
+
+def is_fallback(tick: Dict[str, Any]) -> bool:
+    return (tick or {}).get("source") in FALLBACK_SOURCES
+
+
+def _live_chain() -> List[str]:
+    if PRICE_PROVIDER in _PROVIDERS:
+        return [PRICE_PROVIDER]
+    return (["kite"] if _kite_configured() else []) + ["yfinance"]
+
+
+def fetch_upstream(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Batched snapshot: live providers in order (each behind its breaker),
+    then the last known tick, then the local snapshot file. Every tick
+    carries `source` and `as_of` (epoch seconds of the price).
+    """
+    if PRICE_PROVIDER == "replay":
+        return replay_provider.get_feed(publish=publish_tick).quotes(symbols)
+
+    out: Dict[str, Dict[str, Any]] = {}
+    todo = list(symbols)
+    for name in _live_chain():
+        if not todo:
+            break
+        breaker = _BREAKERS[name]
+        if not breaker.allow():
+            continue
+        t0 = time.monotonic()
+        try:
+            got = _PROVIDERS[name](todo) or {}
+        except Exception as e:
+            breaker.record_failure(str(e), time.monotonic() - t0)
+            print(f"⚠️ {name} quotes failed: {e}")
+            continue
+        elapsed = time.monotonic() - t0
+        # unknown symbols aren't the provider's fault; only errors and
+        # blown latency budgets count against it
+        breaker.record_success(elapsed)
+        priced = {k: t for k, t in got.items() if k in todo and t and t.get("last_price") is not None}
+        now = time.time()
+        for k, t in priced.items():
+            out[k] = dict(t, source=name, as_of=t.get("as_of") or now)
+        todo = [k for k in todo if k not in out]
+
+    # Degraded: serve what we last saw, however old (as_of says how old).
+    # These are for display only: source is FALLBACK_SOURCES, which the
+    # order and engine paths in price_service treat as "no price".
+    for k in list(todo):
+        last = TICK_CACHE.peek(k)
+        if last and last.get("last_price") is not None:
+            age = TICK_CACHE.age(k) or 0.0
+            out[k] = dict(last, source="cache", as_of=last.get("as_of") or time.time() - age)
+    todo = [k for k in todo if k not in out]
+    if todo:
+        out.update(snapshot_provider.fetch_quotes(todo))
+    return out
+
+
+def subscribe_symbol(symbol: str) -> Dict[str, Any]:
+    """Get a REST snapshot quote from Kite and cache it."""
+    return fetch_quotes([symbol]).get((symbol or "").upper().strip(), {})
+
+
+# --------------------------------------------------------------------
+# Streaming (KiteTicker)
+# --------------------------------------------------------------------
+# One ticker connection per process. Tokens are refcounted so several
+# callers (watchlist streams, open orders, ...) can share a subscription.
+_WS = None
+_WS_LOCK = threading.RLock()
+_WS_CONNECTED = False
+_SUBS: Dict[int, int] = {}                 # instrument_token -> refcount
+_TOKEN_KEYS: Dict[int, Set[str]] = {}      # instrument_token -> cache keys
+_AUTO_SUBS: "OrderedDict[str, None]" = OrderedDict()   # keys pinned by get_quote(), LRU
+
+
+def _ticker_available() -> bool:
+    if PRICE_PROVIDER in ("replay", "yfinance"):
+        return False
+    if TICKER_KIND == "fake":
+        return True
+    return KiteTicker is not None and bool(os.getenv("KITE_API_KEY")) and bool(ACCESS_TOKEN)
+
+
+def _on_connect(ws, response):
+    global _WS_CONNECTED
+    _WS_CONNECTED = True
+    with _WS_LOCK:
+        tokens = list(_SUBS.keys())
+    if tokens:
+        ws.subscribe(tokens)
+        ws.set_mode(ws.MODE_QUOTE, tokens)
+
+
+def _on_close(ws, code, reason):
+    global _WS_CONNECTED
+    _WS_CONNECTED = False
+
+
+def _on_error(ws, code, reason):
+    print(f"⚠️ KiteTicker error {code}: {reason}")
+
+
+def _on_ticks(ws, ticks):
+    """Fill the tick cache straight from the stream."""
+    touched: List[str] = []
+    for t in ticks or []:
+        token = t.get("instrument_token")
+        keys = _TOKEN_KEYS.get(token)
+        if not keys:
+            continue
+        tick = {
+            "tradingsymbol": None,
+            "last_price": t.get("last_price"),
+            "ohlc": t.get("ohlc") or {},
+            "timestamp": t.get("exchange_timestamp") or t.get("last_trade_time"),
+            "source": "kite_ws",
+            "as_of": time.time(),
+        }
+        for key in list(keys):
+            prev = TICK_CACHE.peek(key) or {}
+            _store_tick(key, dict(tick, tradingsymbol=prev.get("tradingsymbol") or _map_symbol_zerodha(key)))
+            touched.append(key)
+    _notify_ticks(touched)
+
+
+def _start_ws():
+    """(Re)start the single ticker connection, e.g. after a token reload."""
+    global _WS, _WS_CONNECTED
+    with _WS_LOCK:
+        if _WS is not None:
+            try:
+                _WS.close()
+            except Exception:
+                pass
+        _WS_CONNECTED = False
+
+        if not _ticker_available():
+            _WS = None
+            return None
+
+        if TICKER_KIND == "fake":
+            ws = FakeTicker()
+        else:
+            ws = KiteTicker(os.getenv("KITE_API_KEY"), ACCESS_TOKEN)
+        ws.on_connect = _on_connect
+        ws.on_ticks = _on_ticks
+        ws.on_close = _on_close
+        ws.on_error = _on_error
+        _WS = ws
+    ws.connect(threaded=True)
+    return ws
+
+
+def _ensure_ws():
+    if _WS is None:
+        _start_ws()
+    return _WS
+
+
+def is_streaming() -> bool:
+    return _WS is not None and _WS_CONNECTED
+
+
+def subscribe(symbol: str) -> Optional[int]:
+    """
+    Add one reference to a symbol's stream. The ticker subscription is
+    only sent on the first reference. Returns the instrument_token, or
+    None if the symbol can't be streamed (callers then rely on REST).
+    """
+    key = (symbol or "").upper().strip()
+    token = _instrument_token(key)
+    if token is None:
+        return None
+    with _WS_LOCK:
+        if token not in _SUBS and len(_SUBS) >= KITE_MAX_SUBSCRIPTIONS:
+            print(f"⚠️ subscription limit ({KITE_MAX_SUBSCRIPTIONS}) reached, {key} stays on REST")
+            return None
+        _TOKEN_KEYS.setdefault(token, set()).add(key)
+        _SUBS[token] = _SUBS.get(token, 0) + 1
+        first = _SUBS[token] == 1
+        ws = _ensure_ws()
+        if first and ws is not None and _WS_CONNECTED:
+            try:
+                ws.subscribe([token])
+                ws.set_mode(ws.MODE_QUOTE, [token])
+            except Exception as e:
+                print(f"⚠️ subscribe failed for {key}: {e}")
+    return token
+
+
+def unsubscribe(symbol: str) -> None:
+    """Drop one reference; the ticker unsubscribes when it reaches zero."""
+    key = (symbol or "").upper().strip()
+    token = _instrument_token(key)
+    if token is None:
+        return
+    with _WS_LOCK:
+        if token not in _SUBS:
+            return
+        n = _SUBS[token] - 1
+        if n > 0:
+            _SUBS[token] = n
+            return
+        _SUBS.pop(token, None)
+        _TOKEN_KEYS.pop(token, None)
+        if _WS is not None and _WS_CONNECTED:
+            try:
+                _WS.unsubscribe([token])
+            except Exception as e:
+                print(f"⚠️ unsubscribe failed for {key}: {e}")
+
+
+def _is_streamed(key: str) -> bool:
+    token = _instrument_token(key)
+    return token is not None and token in _SUBS
+
+
+def is_streamed(symbol: str) -> bool:
+    """True if the symbol's cached tick is kept current by the live stream."""
+    return is_streaming() and _is_streamed((symbol or "").upper().strip())
+
+
+def _pin(key: str) -> None:
+    """
+    First lookup of a symbol pins a stream subscription for it. Only the
+    QUOTE_PIN_MAX most recently quoted symbols stay pinned; older ones are
+    unsubscribed and go back to TTL-cached REST quotes.
+    """
+    if not _ticker_available() or _instrument_token(key) is None:
+        return
+    with _WS_LOCK:
+        if key in _AUTO_SUBS:
+            _AUTO_SUBS.move_to_end(key)
+            return
+        if len(_SUBS) >= KITE_MAX_SUBSCRIPTIONS:
+            return      # stream is full; REST it is
+        _AUTO_SUBS[key] = None
+        drop = []
+        while len(_AUTO_SUBS) > QUOTE_PIN_MAX:
+            drop.append(_AUTO_SUBS.popitem(last=False)[0])
+    for old in drop:
+        unsubscribe(old)
+    if subscribe(key) is None:
+        _AUTO_SUBS.pop(key, None)
+
+
+def get_quotes(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Latest ticks for many symbols.
+
+    Streamed symbols are a pure memory read. Anything else is served from
+    TICK_CACHE while younger than QUOTE_TTL; misses are fetched with one
+    batched fetch_upstream() (Kite, else Yahoo), and concurrent misses for the same symbol share
+    that single fetch.
+    """
+    keys = list(dict.fromkeys((s or "").upper().strip() for s in symbols if (s or "").strip()))
+    for key in keys:
+        _pin(key)
+    pinned = [k for k in keys if _is_streamed(k)] if is_streaming() else []
+    return TICK_CACHE.get_many(keys, fetch_upstream, pinned=pinned)
 
 
 def get_quote(symbol: str) -> Dict[str, Any]:
-    """Return cached quote if <3s old, else fetch fresh."""
-    key = symbol.upper().strip()
-    ts = _LAST_TS.get(key)
-    if ts and (time.time() - ts) <= 3:
-        return _LAST_TICKS.get(key, {})
-    return subscribe_symbol(symbol)
+    """Single-symbol get_quotes()."""
+    key = (symbol or "").upper().strip()
+    if not key:
+        return {}
+    return get_quotes([key]).get(key) or {}
+
+
+def cache_stats() -> Dict[str, Any]:
+    out = TICK_CACHE.stats()
+    out.update({
+        "streaming": is_streaming(),
+        "stream_tokens": len(_SUBS),
+        "stream_pinned": len(_AUTO_SUBS),
+        "providers": {name: b.stats() for name, b in _BREAKERS.items()},
+    })
+    return out
 
 
 def get_instrument(symbol: str) -> Dict[str, Any]:
@@ -157,11 +626,13 @@ def get_instrument(symbol: str) -> Dict[str, Any]:
     if INSTRUMENTS_DF.empty:
         return {}
 
-    rows = INSTRUMENTS_DF.loc[
-        INSTRUMENTS_DF["tradingsymbol"].str.upper() == s
-    ]
+    if ":" in s:
+        ex, _, ts = s.partition(":")
+        r = _BY_EXCH_SYMBOL.get((ex, ts))
+    else:
+        r = _BY_SYMBOL.get(s)  # preferred exchange already resolved
 
-    if rows.empty:
+    if r is None:
         # Not found exactly – return minimal info with preferred exchange
         return {
             "exchange": PREFERRED_EXCHANGE,
@@ -173,13 +644,6 @@ def get_instrument(symbol: str) -> Dict[str, Any]:
             "name": "",
         }
 
-    # Prefer the configured exchange if multiple rows exist
-    if len(rows) > 1 and "exchange" in rows.columns:
-        pref = rows.loc[rows["exchange"].str.upper() == PREFERRED_EXCHANGE]
-        if not pref.empty:
-            rows = pref
-
-    r = rows.iloc[0].to_dict()
     return {
         "exchange": (r.get("exchange") or PREFERRED_EXCHANGE).upper(),
         "segment": r.get("segment", ""),
@@ -203,32 +667,61 @@ def search_instruments(
     """
     Full-text search across instruments.csv.
     Returns NSE/BSE/NFO/etc. so UI can list *all* matches.
+    Exact and prefix symbol matches come first, straight from the registry;
+    the DataFrame is only scanned for substring matches if the limit isn't
+    filled by then.
     """
     if INSTRUMENTS_DF.empty or not query:
         return []
 
-    df = INSTRUMENTS_DF
     q = query.strip().upper()
+    if not q:
+        return []
+    exs = {e.upper() for e in exchanges} if exchanges else None
+    segs = {s.upper() for s in segments} if segments else None
 
-    name_series = df["name"] if "name" in df.columns else pd.Series(index=df.index, dtype=str)
-    mask = (
-        df["tradingsymbol"].str.upper().str.contains(q, na=False) |
-        name_series.astype(str).str.upper().str.contains(q, na=False)
-    )
-    if exchanges and "exchange" in df.columns:
-        mask &= df["exchange"].str.upper().isin([e.upper() for e in exchanges])
-    if segments and "segment" in df.columns:
-        mask &= df["segment"].str.upper().isin([s.upper() for s in segments])
-
-    out = df.loc[mask].head(limit).copy()
-    results: list[dict] = []
-    for _, r in out.iterrows():
-        results.append({
+    def _row(r) -> dict:
+        return {
             "exchange": str(r.get("exchange", "")).upper(),
             "segment": r.get("segment", ""),
             "instrument_type": r.get("instrument_type", ""),
             "lot_size": r.get("lot_size"),
             "tradingsymbol": r.get("tradingsymbol", ""),
             "name": r.get("name", ""),
-        })
+        }
+
+    results: list[dict] = []
+    seen: Set[Tuple[str, str]] = set()
+    for r in _symbol_prefix_rows(q):
+        if len(results) >= limit:
+            return results
+        ex = str(r.get("exchange", "") or "").upper()
+        if exs is not None and ex not in exs:
+            continue
+        if segs is not None and str(r.get("segment", "") or "").upper() not in segs:
+            continue
+        seen.add((ex, str(r.get("tradingsymbol", "")).upper()))
+        results.append(_row(r))
+    if len(results) >= limit:
+        return results
+
+    df = INSTRUMENTS_DF
+    name_series = df["name"] if "name" in df.columns else pd.Series(index=df.index, dtype=str)
+    mask = (
+        df["tradingsymbol"].str.upper().str.contains(q, na=False, regex=False) |
+        name_series.astype(str).str.upper().str.contains(q, na=False, regex=False)
+    )
+    if exs is not None and "exchange" in df.columns:
+        mask &= df["exchange"].str.upper().isin(exs)
+    if segs is not None and "segment" in df.columns:
+        mask &= df["segment"].str.upper().isin(segs)
+
+    for _, r in df.loc[mask].iterrows():
+        if len(results) >= limit:
+            break
+        key = (str(r.get("exchange", "") or "").upper(), str(r.get("tradingsymbol", "")).upper())
+        if key in seen:
+            continue
+        seen.add(key)
+        results.append(_row(r))
     return results
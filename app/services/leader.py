@@ -0,0 +1,141 @@
+# backend/app/services/leader.py
+"""
+SQLite lease so that only ONE process runs background jobs (matching
+engine, EOD) when the API is served by several workers.
+
+    leases(name PRIMARY KEY, holder, expires_at, heartbeat_at)
+
+A process holds the lease while expires_at is in the future; a heartbeat
+thread renews it every ttl/3 seconds. If the holder dies, the lease runs
+out after `ttl` seconds and the next process to try takes it over. Takeover
+is a single BEGIN IMMEDIATE transaction, so two processes can't both win.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "30"))
+
+
+class Lease:
+    def __init__(self, name: str, db_path: str, ttl: float = LEADER_LEASE_TTL,
+                 on_change: Optional[Callable[[bool], None]] = None):
+        self.name = name
+        self.db_path = db_path
+        self.ttl = float(ttl)
+        self.on_change = on_change      # called with True/False when leadership flips
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._expires_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.acquired = 0       # times we became leader
+        self.lost = 0           # times we found someone else holding it after us
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.ttl / 3)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+          )
+        """)
+        return conn
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease; True if this process holds it afterwards."""
+        was_leader = self.is_leader()
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("SELECT holder, expires_at FROM leases WHERE name=?", (self.name,))
+            row = c.fetchone()
+            now = time.time()
+            if row and row[0] != self.holder and float(row[1]) > now:
+                conn.rollback()
+                self._expires_at = 0.0
+                if was_leader:
+                    self.lost += 1
+                    self._changed(False)
+                return False
+            c.execute(
+                """
+                INSERT INTO leases (name, holder, expires_at, heartbeat_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder=excluded.holder,
+                    expires_at=excluded.expires_at, heartbeat_at=excluded.heartbeat_at
+                """,
+                (self.name, self.holder, now + self.ttl, now),
+            )
+            conn.commit()
+            self._expires_at = now + self.ttl
+            if not was_leader:
+                self.acquired += 1
+                print(f"ℹ️ {self.holder} is now leader for '{self.name}'")
+                self._changed(True)
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ lease '{self.name}' heartbeat failed: {e}")
+            return self.is_leader()
+        finally:
+            conn.close()
+
+    def is_leader(self) -> bool:
+        """Local check, no DB access: we renewed the lease and it hasn't run out."""
+        return time.time() < self._expires_at
+
+    def release(self) -> None:
+        was_leader = self.is_leader()
+        self._expires_at = 0.0
+        if was_leader:
+            self._changed(False)
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (self.name, self.holder))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _changed(self, leader: bool) -> None:
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(leader)
+        except Exception as e:
+            print(f"⚠️ lease '{self.name}' on_change failed: {e}")
+
+    # ---- heartbeat ----
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.try_acquire()
+        self._thread = threading.Thread(target=self._beat, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.is_leader():
+            self.release()
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            self.try_acquire()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "holder": self.holder,
+            "leader": self.is_leader(),
+            "expires_in": round(max(0.0, self._expires_at - time.time()), 1),
+            "ttl": self.ttl,
+            "acquired": self.acquired,
+            "lost": self.lost,
+        }
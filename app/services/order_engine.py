@@ -0,0 +1,144 @@
+# backend/app/services/order_engine.py
+"""
+Runs the order matcher when prices move instead of only on a timer.
+
+ENGINE_MODE:
+  poll - (default) the 10 s timer does all the work; ticks are only
+         timestamped so fills can report trigger-to-fill latency
+  tick - every pushed tick marks its symbol dirty and wakes a worker
+         thread that runs the matcher for just the dirty symbols; the
+         timer stays as a safety sweep
+
+Trigger-to-fill latency = fill commit time - arrival of the first tick for
+that symbol since it was last evaluated. It is measured the same way in
+both modes so they can be compared on /orders/engine/stats.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Any
+
+ENGINE_MODE = os.getenv("ENGINE_MODE", "poll").lower()
+# Seconds between timer sweeps (the only trigger in poll mode).
+ENGINE_SWEEP_SECONDS = float(os.getenv("ENGINE_SWEEP_SECONDS", "10"))
+# In tick mode, wait this long after a wake-up so a burst of ticks is
+# handled by one matcher run.
+ENGINE_COALESCE_SECONDS = float(os.getenv("ENGINE_COALESCE_SECONDS", "0.05"))
+
+
+def _pct(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+class OrderEngine:
+    def __init__(
+        self,
+        run: Callable[[Optional[List[str]]], Any],
+        mode: str = ENGINE_MODE,
+        coalesce: float = ENGINE_COALESCE_SECONDS,
+        window: int = 2000,
+    ):
+        self.run = run
+        self.mode = mode
+        self.coalesce = float(coalesce)
+
+        self._dirty: Dict[str, float] = {}      # symbol -> first tick since last evaluation
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._latency: deque = deque(maxlen=window)
+        self.fills = 0
+        self.runs = 0
+        self.ticks = 0
+        self.errors = 0
+
+    # ---- tick side ----
+    def notify(self, symbols: Iterable[str]) -> None:
+        """Tick listener: remember when each symbol first moved; wake the worker in tick mode."""
+        now = time.time()
+        with self._lock:
+            for s in symbols:
+                self._dirty.setdefault(s, now)
+                self.ticks += 1
+        if self.mode == "tick":
+            self._wake.set()
+
+    def take_dirty(self, symbols: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Hand the matcher the tick times it is about to evaluate (all, or just `symbols`)."""
+        with self._lock:
+            if symbols is None:
+                out, self._dirty = self._dirty, {}
+                return out
+            return {s: self._dirty.pop(s) for s in symbols if s in self._dirty}
+
+    def record_fills(self, seen: Dict[str, float], symbols: Iterable[str]) -> None:
+        """One fill per entry of `symbols`; latency is known for those that ticked."""
+        now = time.time()
+        with self._lock:
+            for s in symbols:
+                self.fills += 1
+                t0 = seen.get(s)
+                if t0 is not None:
+                    self._latency.append(now - t0)
+
+    # ---- worker ----
+    def start(self) -> None:
+        if self.mode != "tick" or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="order-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.is_set():
+                return
+            if self.coalesce > 0:
+                time.sleep(self.coalesce)
+            self._wake.clear()
+            with self._lock:
+                symbols = list(self._dirty.keys())
+            if not symbols:
+                continue
+            try:
+                self.runs += 1
+                self.run(symbols)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ order engine run failed: {e}")
+
+    # ---- metrics ----
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = list(self._latency)
+            pending = len(self._dirty)
+        ms = lambda v: round(v * 1000.0, 2) if v is not None else None
+        return {
+            "mode": self.mode,
+            "sweep_seconds": ENGINE_SWEEP_SECONDS,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "ticks": self.ticks,
+            "runs": self.runs,
+            "errors": self.errors,
+            "fills": self.fills,
+            "pending_symbols": pending,
+            "trigger_to_fill_ms": {
+                "samples": len(lat),
+                "p50": ms(_pct(lat, 50)),
+                "p95": ms(_pct(lat, 95)),
+                "p99": ms(_pct(lat, 99)),
+                "max": ms(max(lat) if lat else None),
+            },
+        }
@@ -0,0 +1,191 @@
+# backend/app/services/price_service.py
+"""
+In-process price lookups shared by the orders, portfolio and quotes routers.
+
+Routers used to price a symbol by calling our own /quotes endpoint over
+HTTP. That tied up a worker per lookup and deadlocked on a single worker.
+Everything now goes straight to the tick cache in kite_ws_manager.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Dict, Any, Iterable, List, Callable, TypeVar, Optional, Tuple
+
+from anyio import CapacityLimiter, to_thread
+
+from app.services import kite_ws_manager as manager
+
+T = TypeVar("T")
+
+# Upstream quote fetches (kiteconnect / yfinance) are blocking HTTP calls.
+# Async routes push them onto this bounded pool so the event loop keeps
+# serving other requests while a quote is in flight.
+QUOTE_FETCH_WORKERS = int(os.getenv("QUOTE_FETCH_WORKERS", "8"))
+_QUOTE_LIMITER = CapacityLimiter(QUOTE_FETCH_WORKERS)
+
+# Order placement pricing budget: a cached tick up to ORDER_PRICE_MAX_AGE
+# seconds old is used as-is; an older one triggers ONE upstream fetch that
+# we stop waiting for after ORDER_PRICE_DEADLINE seconds.
+ORDER_PRICE_MAX_AGE = float(os.getenv("ORDER_PRICE_MAX_AGE", "5"))
+ORDER_PRICE_DEADLINE = float(os.getenv("ORDER_PRICE_DEADLINE", "0.8"))
+# Hard cap for anything that trades on a price (order placement, the
+# matching engine, SL/target and EOD square-offs): a tick older than this,
+# or one served from the snapshot / last-known fallback, counts as no price.
+# /quotes still shows those ticks.
+ORDER_PRICE_REJECT_AGE = float(os.getenv("ORDER_PRICE_REJECT_AGE", "60"))
+_DEADLINE_POOL = ThreadPoolExecutor(max_workers=QUOTE_FETCH_WORKERS, thread_name_prefix="price-deadline")
+
+
+async def run_blocking(fn: Callable[..., T], *args) -> T:
+    """Run a blocking quote call on the bounded quote pool."""
+    return await to_thread.run_sync(fn, *args, limiter=_QUOTE_LIMITER)
+
+
+def _to_float(px) -> float:
+    """Parse 53 / "53.00" / "₹53.00" into a float; 0.0 if unusable."""
+    if px is None:
+        return 0.0
+    if isinstance(px, str):
+        px = px.replace("₹", "").replace(",", "").strip()
+    try:
+        return float(px)
+    except Exception:
+        return 0.0
+
+
+def get_tick(symbol: str) -> Dict[str, Any]:
+    """Latest cached tick for a symbol ({} if it can't be priced)."""
+    if not symbol:
+        return {}
+    try:
+        return manager.get_quote(symbol) or {}
+    except Exception as e:
+        print(f"⚠️ price_service: quote failed for {symbol}: {e}")
+        return {}
+
+
+def _tick_age(tick: Dict[str, Any]) -> Optional[float]:
+    as_of = tick.get("as_of")
+    return max(0.0, time.time() - float(as_of)) if as_of else None
+
+
+def _tradable_price(key: str, tick: Dict[str, Any]) -> float:
+    """A tick's price if it may be traded on, else 0.0 (fallback or too old)."""
+    val = _to_float((tick or {}).get("last_price"))
+    if val <= 0 or manager.is_fallback(tick):
+        return 0.0
+    if manager.is_streamed(key):
+        return val
+    age = _tick_age(tick)
+    return 0.0 if age is not None and age > ORDER_PRICE_REJECT_AGE else val
+
+
+def get_live_price(symbol: str) -> float:
+    """
+    Last traded price for a symbol.
+    Returns 0.0 if we can't get a live price no older than
+    ORDER_PRICE_REJECT_AGE.
+    """
+    return _tradable_price((symbol or "").upper().strip(), get_tick(symbol))
+
+
+def get_display_price(symbol: str) -> float:
+    """
+    Last price for showing a symbol (like /quotes), 0.0 if there is none.
+    Unlike get_live_price() it keeps fallback and old ticks; never trade on it.
+    """
+    return _to_float(get_tick(symbol).get("last_price"))
+
+
+def get_prices_within(
+    symbols: Iterable[str],
+    max_age: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Tuple[float, Optional[float]]]:
+    """
+    {SYMBOL: (price, age in seconds)} under a latency budget.
+
+    Cached ticks no older than `max_age` (or kept live by the stream) cost
+    no I/O. The rest are fetched with ONE batched upstream call, abandoned
+    after `deadline` seconds (it still completes in the background and
+    fills the cache). A price is only returned if it is no older than
+    ORDER_PRICE_REJECT_AGE (streamed symbols excepted) and not a fallback
+    tick; otherwise the symbol maps to (0.0, its age), or (0.0, None) if
+    there is nothing at all.
+    """
+    keys = list(dict.fromkeys((s or "").upper().strip() for s in symbols if (s or "").strip()))
+    max_age = ORDER_PRICE_MAX_AGE if max_age is None else max_age
+    deadline = ORDER_PRICE_DEADLINE if deadline is None else deadline
+
+    def priced(key: str, tick: Dict[str, Any], age: Optional[float]) -> Tuple[float, Optional[float]]:
+        price = _to_float(tick.get("last_price"))
+        if price <= 0:
+            return 0.0, None
+        if age is None or manager.is_fallback(tick) or (age > ORDER_PRICE_REJECT_AGE and not manager.is_streamed(key)):
+            return 0.0, age
+        return price, age
+
+    out: Dict[str, Tuple[float, Optional[float]]] = {}
+    stale: List[str] = []
+    for key in keys:
+        out[key] = price, age = priced(key, manager.TICK_CACHE.peek(key) or {}, manager.TICK_CACHE.age(key))
+        if not (price > 0 and (age <= max_age or manager.is_streamed(key))):
+            stale.append(key)
+    if not stale:
+        return out
+
+    fut = _DEADLINE_POOL.submit(get_ticks, stale)
+    try:
+        ticks = fut.result(timeout=deadline)
+        for key in stale:
+            tick = ticks.get(key) or {}
+            age = _tick_age(tick)
+            fresh = priced(key, tick, manager.TICK_CACHE.age(key) if age is None else age)
+            if fresh[0] > 0 or out[key][1] is None:
+                out[key] = fresh
+    except FuturesTimeout:
+        print(f"⚠️ price_service: quotes for {len(stale)} symbol(s) missed the {deadline}s deadline")
+    except Exception as e:
+        print(f"⚠️ price_service: batch quote failed for {len(stale)} symbols: {e}")
+    return out
+
+
+def get_price_within(
+    symbol: str,
+    max_age: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> Tuple[float, Optional[float]]:
+    """Single-symbol get_prices_within()."""
+    key = (symbol or "").upper().strip()
+    if not key:
+        return 0.0, None
+    return get_prices_within([key], max_age, deadline).get(key, (0.0, None))
+
+
+def get_ticks(symbols: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Latest ticks for many symbols with one batched upstream call."""
+    keys: List[str] = list(dict.fromkeys(
+        (s or "").upper().strip() for s in symbols if (s or "").strip()
+    ))
+    if not keys:
+        return {}
+    try:
+        return manager.get_quotes(keys)
+    except Exception as e:
+        print(f"⚠️ price_service: batch quote failed for {len(keys)} symbols: {e}")
+        return {}
+
+
+def get_live_prices(symbols: Iterable[str]) -> Dict[str, float]:
+    """Price several symbols at once; keys are the upper-cased symbols."""
+    keys = [(s or "").upper().strip() for s in symbols if (s or "").strip()]
+    ticks = get_ticks(keys)
+    out: Dict[str, float] = {}
+    for key in keys:
+        out[key] = _tradable_price(key, ticks.get(key) or {})
+    return out
+
+
+async def get_ticks_async(symbols: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """get_ticks() without blocking the event loop."""
+    return await run_blocking(get_ticks, list(symbols))
@@ -0,0 +1,198 @@
+# backend/app/services/quote_cache.py
+"""
+Bounded TTL cache for ticks, with single-flight fetches.
+
+- entries older than `ttl` seconds are stale (unless the caller pins them,
+  e.g. symbols that are being streamed)
+- at most `maxsize` symbols, least-recently-used evicted first
+- concurrent misses for the same symbol share ONE upstream fetch
+- hit / miss / coalesced / eviction / error counters for /quotes/cache-stats
+
+A tick's age is measured from its "as_of" epoch when it has one, else
+from when it was stored.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Iterable, List, Tuple
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Dict[str, Any] = {}
+        self.error: Optional[BaseException] = None
+
+
+class QuoteCache:
+    def __init__(
+        self,
+        ttl: float = 3.0,
+        maxsize: int = 5000,
+        on_evict: Optional[Callable[[str], None]] = None,
+        wait_timeout: float = 10.0,
+    ):
+        self.ttl = float(ttl)
+        self.maxsize = int(maxsize)
+        self.on_evict = on_evict
+        self.wait_timeout = wait_timeout
+
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+
+    # ---- plain access ----
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def put(self, key: str, tick: Dict[str, Any], ts: Optional[float] = None) -> None:
+        with self._lock:
+            evicted = self._put_locked(key, tick, ts)
+        self._notify_evicted(evicted)
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached tick regardless of age (no counters, no LRU bump)."""
+        e = self._data.get(key)
+        return e[1] if e else None
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since the tick was stored, or None if absent."""
+        e = self._data.get(key)
+        return (time.time() - e[0]) if e else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "inflight": len(self._inflight),
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    # ---- single-flight lookups ----
+    def get_many(
+        self,
+        keys: Iterable[str],
+        fetch_many: Callable[[List[str]], Dict[str, Dict[str, Any]]],
+        pinned: Iterable[str] = (),
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Fresh ticks for `keys`. Misses are fetched with ONE fetch_many() call;
+        keys another thread is already fetching are waited on, not refetched.
+        Keys in `pinned` are served from cache whatever their age.
+        """
+        pinned = set(pinned)
+        out: Dict[str, Dict[str, Any]] = {}
+        mine: List[Tuple[str, _Flight]] = []
+        waits: List[Tuple[str, _Flight]] = []
+        now = time.time()
+
+        with self._lock:
+            for key in keys:
+                if key in out:
+                    continue
+                e = self._data.get(key)
+                if e and (key in pinned or now - e[0] <= self.ttl):
+                    self._data.move_to_end(key)
+                    out[key] = e[1]
+                    self.hits += 1
+                elif key in self._inflight:
+                    waits.append((key, self._inflight[key]))
+                    self.coalesced += 1
+                else:
+                    f = _Flight()
+                    self._inflight[key] = f
+                    mine.append((key, f))
+                    self.misses += 1
+
+        if mine:
+            err: Optional[BaseException] = None
+            try:
+                res = fetch_many([k for k, _ in mine]) or {}
+            except Exception as e:
+                err, res = e, {}
+            evicted: List[str] = []
+            with self._lock:
+                if err is not None:
+                    self.errors += 1
+                ts = time.time()
+                for key, f in mine:
+                    tick = res.get(key) or {}
+                    if tick:
+                        evicted += self._put_locked(key, tick, ts)
+                    f.value, f.error = tick, err
+                    self._inflight.pop(key, None)
+            for key, f in mine:
+                f.event.set()
+                out[key] = f.value
+            self._notify_evicted(evicted)
+            if err is not None:
+                raise err
+
+        for key, f in waits:
+            f.event.wait(self.wait_timeout)
+            if f.error is not None:
+                raise f.error
+            out[key] = f.value
+        return out
+
+    def get(
+        self,
+        key: str,
+        fetch: Callable[[str], Dict[str, Any]],
+        pinned: bool = False,
+    ) -> Dict[str, Any]:
+        """Single-key get_many()."""
+        res = self.get_many(
+            [key],
+            lambda ks: {ks[0]: fetch(ks[0])},
+            pinned=(key,) if pinned else (),
+        )
+        return res.get(key) or {}
+
+    # ---- internals ----
+    def _put_locked(self, key: str, tick: Dict[str, Any], ts: Optional[float] = None) -> List[str]:
+        # A tick that says how old it is (as_of) keeps that age: a stale
+        # fallback price must not look fresh just because we cached it now.
+        if tick.get("as_of"):
+            ts = float(tick["as_of"])
+        elif ts is None:
+            ts = time.time()
+        self._data[key] = (ts, tick)
+        self._data.move_to_end(key)
+        evicted: List[str] = []
+        while len(self._data) > self.maxsize:
+            old, _ = self._data.popitem(last=False)
+            evicted.append(old)
+            self.evictions += 1
+        return evicted
+
+    def _notify_evicted(self, keys: List[str]) -> None:
+        if not keys or not self.on_evict:
+            return
+        for k in keys:
+            try:
+                self.on_evict(k)
+            except Exception:
+                pass
@@ -0,0 +1,179 @@
+# backend/app/services/replay_provider.py
+"""
+Replay a recorded tick file instead of talking to Kite / Yahoo.
+
+File: CSV with a header row
+    symbol,timestamp,ltp[,open,high,low,close]
+timestamp is ISO ("2025-09-18 09:15:01"); close is the previous day's close,
+as in Kite's ohlc block.
+
+Select it with PRICE_PROVIDER=replay and REPLAY_FILE=<path>. REPLAY_SPEED
+is the playback rate: 1 = real time, 10 = ten times faster, 0 = as fast as
+possible. Every tick is published into the same tick cache get_quote()
+reads, so orders, positions and the EOD pipeline run unchanged offline.
+
+For deterministic runs set REPLAY_MANUAL=1 (or build a ReplayFeed
+yourself) and drive it by hand:
+    feed = ReplayFeed("ticks.csv", publish=manager.publish_tick)
+    feed.step()                      # next tick
+    feed.advance_to("2025-09-18 10:00:00")
+"""
+import csv
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+REPLAY_FILE = os.getenv("REPLAY_FILE", "")
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))
+REPLAY_LOOP = os.getenv("REPLAY_LOOP", "0") == "1"
+# 1 = don't start the playback thread; advance with get_feed().step()/advance_to()
+REPLAY_MANUAL = os.getenv("REPLAY_MANUAL", "0") == "1"
+
+
+def _f(x) -> Optional[float]:
+    try:
+        return float(x) if x not in (None, "") else None
+    except Exception:
+        return None
+
+
+def _ts(x: str) -> datetime:
+    x = (x or "").strip().replace("T", " ")
+    try:
+        return datetime.fromisoformat(x)
+    except Exception:
+        return datetime.strptime(x[:19], "%Y-%m-%d %H:%M:%S")
+
+
+def load_ticks(path: str) -> List[Tuple[datetime, str, Dict[str, Any]]]:
+    """Parse a tick file into (timestamp, SYMBOL, tick) sorted by time."""
+    rows: List[Tuple[datetime, str, Dict[str, Any]]] = []
+    with open(path, newline="") as fh:
+        for r in csv.DictReader(fh):
+            r = {(k or "").strip().lower(): v for k, v in r.items()}
+            sym = (r.get("symbol") or "").strip().upper()
+            ltp = _f(r.get("ltp") or r.get("last_price"))
+            if not sym or ltp is None:
+                continue
+            ts = _ts(r.get("timestamp") or "")
+            rows.append((ts, sym, {
+                "tradingsymbol": sym,
+                "last_price": ltp,
+                "ohlc": {
+                    "open": _f(r.get("open")),
+                    "high": _f(r.get("high")),
+                    "low": _f(r.get("low")),
+                    "close": _f(r.get("close")),
+                },
+                "timestamp": ts,
+            }))
+    rows.sort(key=lambda x: x[0])
+    return rows
+
+
+class ReplayFeed:
+    def __init__(
+        self,
+        path: str,
+        speed: float = 1.0,
+        loop: bool = False,
+        publish: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ):
+        self.path = path
+        self.speed = float(speed)
+        self.loop = loop
+        self.publish = publish
+        self.ticks = load_ticks(path)
+        self.pos = 0
+        self.latest: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    # ---- manual driving ----
+    def step(self) -> Optional[Tuple[datetime, str, Dict[str, Any]]]:
+        """Publish the next tick; None when the file is exhausted."""
+        with self._lock:
+            if self.pos >= len(self.ticks):
+                if not (self.loop and self.ticks):
+                    return None
+                self.pos = 0
+            item = self.ticks[self.pos]
+            self.pos += 1
+            self.latest[item[1]] = item[2]
+        if self.publish:
+            self.publish(item[1], item[2])
+        return item
+
+    def advance_to(self, ts) -> int:
+        """Publish every tick up to and including `ts`; returns how many."""
+        ts = _ts(ts) if isinstance(ts, str) else ts
+        n = 0
+        while self.pos < len(self.ticks) and self.ticks[self.pos][0] <= ts:
+            self.step()
+            n += 1
+        return n
+
+    def quotes(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Latest replayed tick for each symbol that has one."""
+        out: Dict[str, Dict[str, Any]] = {}
+        for s in symbols:
+            key = (s or "").upper().strip()
+            t = self.latest.get(key)
+            if t:
+                out[key] = t
+        return out
+
+    # ---- timed playback ----
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replay-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        prev_ts: Optional[datetime] = None
+        while not self._stop.is_set():
+            if self.pos >= len(self.ticks) and not self.loop:
+                return
+            if self.pos >= len(self.ticks):
+                prev_ts = None
+            nxt = self.ticks[self.pos % max(len(self.ticks), 1)] if self.ticks else None
+            if nxt is None:
+                return
+            if prev_ts is not None and self.speed > 0:
+                gap = (nxt[0] - prev_ts).total_seconds() / self.speed
+                if gap > 0 and self._stop.wait(gap):
+                    return
+            self.step()
+            prev_ts = nxt[0]
+
+
+_FEED: Optional[ReplayFeed] = None
+_FEED_LOCK = threading.Lock()
+
+
+def get_feed(publish: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> ReplayFeed:
+    """Process-wide feed built from REPLAY_FILE / REPLAY_SPEED, started on first use
+    (unless REPLAY_MANUAL=1)."""
+    global _FEED
+    with _FEED_LOCK:
+        if _FEED is None:
+            if not REPLAY_FILE:
+                raise RuntimeError("PRICE_PROVIDER=replay needs REPLAY_FILE")
+            _FEED = ReplayFeed(REPLAY_FILE, speed=REPLAY_SPEED, loop=REPLAY_LOOP, publish=publish)
+            # prime with the first tick of every symbol so prices exist at t0
+            seen = set()
+            for _, sym, tick in _FEED.ticks:
+                if sym not in seen:
+                    seen.add(sym)
+                    _FEED.latest[sym] = tick
+            if not REPLAY_MANUAL:
+                _FEED.start()
+        return _FEED
+
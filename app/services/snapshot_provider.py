@@ -0,0 +1,96 @@
+# backend/app/services/snapshot_provider.py
+"""
+Last-resort prices from the newest local snapshot CSV
+(app/data/nse_fno_list_*.csv: symbol,lastPrice,pChange,open,dayHigh,dayLow,fetchTime).
+
+The file is read once and re-read only when a newer/changed one appears.
+Ticks carry as_of = the snapshot's fetchTime, so callers can see how old
+the price really is.
+"""
+import csv
+import glob
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from pytz import timezone
+
+SNAPSHOT_GLOB = os.getenv(
+    "PRICE_SNAPSHOT_GLOB",
+    os.path.join(os.path.dirname(__file__), "..", "data", "nse_fno_list_*.csv"),
+)
+
+_IST = timezone("Asia/Kolkata")
+_LOCK = threading.Lock()
+_LOADED: Tuple[Optional[str], float] = (None, 0.0)   # (path, mtime)
+_PRICES: Dict[str, Dict[str, Any]] = {}
+
+
+def _f(x) -> Optional[float]:
+    try:
+        return float(x) if x not in (None, "") else None
+    except Exception:
+        return None
+
+
+def _epoch(ts: str, fallback: float) -> float:
+    try:
+        return _IST.localize(datetime.strptime(ts.strip()[:19], "%Y-%m-%d %H:%M:%S")).timestamp()
+    except Exception:
+        return fallback
+
+
+def _latest_file() -> Optional[str]:
+    files = sorted(glob.glob(SNAPSHOT_GLOB))
+    return files[-1] if files else None
+
+
+def _load() -> None:
+    global _LOADED, _PRICES
+    path = _latest_file()
+    if not path:
+        return
+    mtime = os.path.getmtime(path)
+    if _LOADED == (path, mtime):
+        return
+    prices: Dict[str, Dict[str, Any]] = {}
+    with open(path, newline="") as fh:
+        for r in csv.DictReader(fh):
+            sym = (r.get("symbol") or "").strip().upper()
+            ltp = _f(r.get("lastPrice"))
+            if not sym or ltp is None:
+                continue
+            pchg = _f(r.get("pChange"))
+            prev = ltp / (1 + pchg / 100.0) if pchg not in (None, -100.0) else None
+            prices[sym] = {
+                "tradingsymbol": sym,
+                "last_price": ltp,
+                "ohlc": {
+                    "open": _f(r.get("open")),
+                    "high": _f(r.get("dayHigh")),
+                    "low": _f(r.get("dayLow")),
+                    "close": round(prev, 2) if prev else None,
+                },
+                "timestamp": (r.get("fetchTime") or "").strip() or None,
+                "as_of": _epoch(r.get("fetchTime") or "", mtime),
+                "source": "snapshot",
+            }
+    _PRICES = prices
+    _LOADED = (path, mtime)
+
+
+def fetch_quotes(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    with _LOCK:
+        try:
+            _load()
+        except Exception as e:
+            print(f"⚠️ snapshot load failed: {e}")
+    out: Dict[str, Dict[str, Any]] = {}
+    for s in symbols:
+        key = (s or "").upper().strip()
+        base = key.partition(":")[2] if ":" in key else key
+        t = _PRICES.get(base)
+        if t:
+            out[key] = t
+    return out
@@ -0,0 +1,269 @@
+# backend/app/services/trigger_book.py
+"""
+In-memory, price-indexed book of OPEN limit orders.
+
+Per symbol two sorted lists:
+  up    - BUY and SELL FIRST triggers, ascending. They fire when
+          live <= trigger, i.e. every entry with trigger >= live - eps:
+          a suffix of the list.
+  down  - normal SELL triggers, descending (stored as -trigger so the list
+          is still ascending). They fire when live >= trigger, i.e. every
+          entry with -trigger >= -(live + eps): again a suffix.
+
+So a price update costs one bisect per list plus the orders it actually
+crossed; orders far from the market are never looked at.
+
+With NumPy installed the same orders are also kept in parallel arrays
+(symbol index, side, trigger, id) so crossed_all() can test a whole price
+snapshot in one vectorized pass instead of a bisect per symbol. Which path
+is used is set by TRIGGER_EVAL:
+  bisect - per-symbol bisect only
+  numpy  - vectorized pass whenever NumPy is available
+  auto   - (default) vectorized while the book holds at most
+           TRIGGER_VECTOR_PER_SYMBOL orders per priced symbol. The bisect
+           cost grows with the symbols priced, the vectorized one with the
+           whole book, so a tick for a handful of symbols stays on bisect
+           (see benchmarks/bench_trigger_eval.py for the crossover).
+
+The book only says *which* orders to look at. The caller still claims the
+row in the DB and re-checks the price before filling.
+"""
+import os
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple, Iterable
+
+try:
+    import numpy as np
+except Exception:  # optional: the bisect path needs nothing
+    np = None
+
+TRIGGER_EVAL = os.getenv("TRIGGER_EVAL", "auto").lower()
+TRIGGER_VECTOR_PER_SYMBOL = int(os.getenv("TRIGGER_VECTOR_PER_SYMBOL", "150"))
+
+UP = "up"
+DOWN = "down"
+
+
+def side_of(order_type: str, is_short) -> str:
+    """Which list an order lives in."""
+    if str(order_type or "").upper() == "SELL" and not is_short:
+        return DOWN
+    return UP
+
+
+class _Ladder:
+    __slots__ = ("keys", "ids")
+
+    def __init__(self):
+        self.keys: List[float] = []
+        self.ids: List[int] = []
+
+    def insert(self, key: float, order_id: int) -> None:
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.ids.insert(i, order_id)
+
+    def remove(self, key: float, order_id: int) -> bool:
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.ids[i] == order_id:
+                del self.keys[i]
+                del self.ids[i]
+                return True
+            i += 1
+        return False
+
+    def suffix(self, threshold: float) -> List[int]:
+        return self.ids[bisect_left(self.keys, threshold):]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class _Columns:
+    """
+    Parallel NumPy arrays, one slot per order: id, symbol index, side (up?)
+    and trigger. Removal only clears `alive`; dead slots are squeezed out
+    once they make up half the arrays.
+    """
+    __slots__ = ("ids", "sym", "up", "trig", "alive", "n", "dead", "slot", "sym_ix", "sym_names")
+
+    def __init__(self, capacity: int = 1024):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.sym = np.zeros(capacity, dtype=np.int32)
+        self.up = np.zeros(capacity, dtype=bool)
+        self.trig = np.zeros(capacity, dtype=np.float64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.n = 0
+        self.dead = 0
+        self.slot: Dict[int, int] = {}          # order id -> array index
+        self.sym_ix: Dict[str, int] = {}
+        self.sym_names: List[str] = []
+
+    def add(self, order_id: int, symbol: str, up: bool, trigger: float) -> None:
+        if self.n == len(self.ids):
+            self._grow()
+        ix = self.sym_ix.get(symbol)
+        if ix is None:
+            ix = self.sym_ix[symbol] = len(self.sym_names)
+            self.sym_names.append(symbol)
+        i = self.n
+        self.ids[i], self.sym[i], self.up[i], self.trig[i], self.alive[i] = order_id, ix, up, trigger, True
+        self.slot[order_id] = i
+        self.n += 1
+
+    def remove(self, order_id: int) -> None:
+        i = self.slot.pop(order_id, None)
+        if i is None:
+            return
+        self.alive[i] = False
+        self.dead += 1
+        if self.dead > 1024 and self.dead * 2 > self.n:
+            self._compact()
+
+    def crossed(self, prices: Dict[str, float], eps: float) -> List[int]:
+        n = self.n
+        if not n:
+            return []
+        px_by_sym = np.fromiter((prices.get(s) or 0.0 for s in self.sym_names),
+                                dtype=np.float64, count=len(self.sym_names))
+        px = px_by_sym[self.sym[:n]]
+        trig = self.trig[:n]
+        # same tolerance as le()/ge(): up fires on live <= trig + eps, down on live >= trig - eps
+        hit = np.where(self.up[:n], px <= trig + eps, px >= trig - eps)
+        hit &= self.alive[:n]
+        hit &= px > 0
+        return self.ids[:n][hit].tolist()
+
+    def _grow(self) -> None:
+        cap = len(self.ids) * 2
+        for name in ("ids", "sym", "up", "trig", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(cap, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self.alive[:self.n])
+        m = len(keep)
+        for name in ("ids", "sym", "up", "trig", "alive"):
+            arr = getattr(self, name)
+            arr[:m] = arr[keep]
+        self.alive[m:self.n] = False
+        self.n = m
+        self.dead = 0
+        self.slot = {int(oid): i for i, oid in enumerate(self.ids[:m].tolist())}
+
+
+class TriggerBook:
+    def __init__(self, eps: float = 0.01, mode: str = TRIGGER_EVAL,
+                 vector_per_symbol: int = TRIGGER_VECTOR_PER_SYMBOL):
+        self.eps = float(eps)
+        self._books: Dict[str, Dict[str, _Ladder]] = {}
+        self._where: Dict[int, Tuple[str, str, float]] = {}   # id -> (symbol, side, key)
+        self._cols: Optional[_Columns] = _Columns() if np is not None else None
+        self.mode = mode if np is not None else "bisect"
+        self.vector_per_symbol = int(vector_per_symbol)
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    # ---- maintenance ----
+    def add(self, order_id: int, symbol: str, order_type: str, trigger, is_short=0) -> None:
+        """Insert (or re-price) an open order. Orders without a positive trigger are dropped."""
+        order_id = int(order_id)
+        sym = (symbol or "").upper().strip()
+        try:
+            trig = float(trigger or 0)
+        except Exception:
+            trig = 0.0
+        with self._lock:
+            self._remove_locked(order_id)
+            if not sym or trig <= 0:
+                return
+            side = side_of(order_type, is_short)
+            key = trig if side == UP else -trig
+            book = self._books.setdefault(sym, {UP: _Ladder(), DOWN: _Ladder()})
+            book[side].insert(key, order_id)
+            self._where[order_id] = (sym, side, key)
+            if self._cols is not None:
+                self._cols.add(order_id, sym, side == UP, trig)
+
+    def remove(self, order_id: int) -> None:
+        with self._lock:
+            self._remove_locked(int(order_id))
+
+    def remove_many(self, order_ids: Iterable[int]) -> None:
+        with self._lock:
+            for oid in order_ids:
+                self._remove_locked(int(oid))
+
+    def load(self, rows: Iterable[Tuple]) -> None:
+        """Replace the book with `rows` of (id, script, order_type, price, is_short)."""
+        with self._lock:
+            self._books.clear()
+            self._where.clear()
+            if self._cols is not None:
+                self._cols = _Columns()
+        for oid, script, otype, trig, is_short in rows:
+            self.add(oid, script, otype, trig, is_short)
+        self.loaded = True
+
+    # ---- queries ----
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._books.keys())
+
+    def crossed(self, symbol: str, live: float) -> List[int]:
+        """Ids of orders on `symbol` whose trigger `live` has crossed."""
+        if not live or live <= 0:
+            return []
+        with self._lock:
+            book = self._books.get((symbol or "").upper().strip())
+            if not book:
+                return []
+            return book[UP].suffix(live - self.eps) + book[DOWN].suffix(-(live + self.eps))
+
+    def crossed_all(self, prices: Dict[str, float]) -> List[int]:
+        """Ids of crossed orders on every symbol in `prices` (symbols absent there are skipped)."""
+        if self._vectorized(len(prices)):
+            with self._lock:
+                return self._cols.crossed(prices, self.eps)
+        out: List[int] = []
+        for sym, live in prices.items():
+            out += self.crossed(sym, live)
+        return out
+
+    def _vectorized(self, n_symbols: int) -> bool:
+        if self._cols is None or self.mode == "bisect":
+            return False
+        return self.mode == "numpy" or len(self._where) <= self.vector_per_symbol * n_symbols
+
+    def __contains__(self, order_id: int) -> bool:
+        return int(order_id) in self._where
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "orders": len(self._where),
+                "symbols": len(self._books),
+                "eval": self.mode,
+            }
+
+    # ---- internals ----
+    def _remove_locked(self, order_id: int) -> Optional[str]:
+        loc = self._where.pop(order_id, None)
+        if not loc:
+            return None
+        sym, side, key = loc
+        book = self._books.get(sym)
+        if self._cols is not None:
+            self._cols.remove(order_id)
+        if book:
+            book[side].remove(key, order_id)
+            if not book[UP] and not book[DOWN]:
+                del self._books[sym]
+        return sym
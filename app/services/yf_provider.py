@@ -0,0 +1,155 @@
+# backend/app/services/yf_provider.py
+"""
+Yahoo Finance fallback provider (used when Kite isn't configured).
+
+One yf.download() per batch of tickers instead of one Ticker().fast_info
+per symbol. Daily fields that don't move intraday (previous close) are
+fetched once per IST session and reused. Ticks come back in the same
+shape as the Kite path and land in the same tick cache.
+"""
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from pytz import timezone
+
+try:
+    import yfinance as yf
+except Exception:
+    yf = None
+
+# Keep each download to a sane URL size
+YF_BATCH = 200
+# Per-request HTTP timeout; the fallback chain gives up on Yahoo after this.
+YF_TIMEOUT = float(os.getenv("YF_TIMEOUT", "3"))
+
+_INDEX_MAP_YF: Dict[str, str] = {
+    "NIFTY": "^NSEI",
+    "BANKNIFTY": "^NSEBANK",
+    "SENSEX": "^BSESN",
+}
+
+# mapped ticker -> {"session": "YYYY-MM-DD", "previous_close": float}
+_DAILY: Dict[str, Dict[str, Any]] = {}
+_DAILY_LOCK = threading.Lock()
+
+
+def map_symbol(symbol: str) -> str:
+    symbol = (symbol or "").upper().strip()
+    if symbol in _INDEX_MAP_YF:
+        return _INDEX_MAP_YF[symbol]
+    if ":" in symbol:
+        ex, _, ts = symbol.partition(":")
+        return ts + (".BO" if ex == "BSE" else ".NS")
+    if not symbol.endswith((".NS", ".BO")) and not symbol.startswith("^"):
+        return symbol + ".NS"
+    return symbol
+
+
+def _session() -> str:
+    return datetime.now(timezone("Asia/Kolkata")).strftime("%Y-%m-%d")
+
+
+def _frame_for(df, ticker: str):
+    """Per-ticker OHLC frame from a (possibly multi-index) download."""
+    if df is None or df.empty:
+        return None
+    cols = df.columns
+    if getattr(cols, "nlevels", 1) > 1:
+        if ticker not in cols.get_level_values(0):
+            return None
+        sub = df[ticker]
+    else:
+        sub = df
+    sub = sub.dropna(how="all")
+    return sub if not sub.empty else None
+
+
+def _download(tickers: List[str], period: str, interval: str):
+    return yf.download(
+        tickers=tickers,
+        period=period,
+        interval=interval,
+        group_by="ticker",
+        auto_adjust=False,
+        threads=True,
+        progress=False,
+        timeout=YF_TIMEOUT,
+    )
+
+
+def _ensure_daily(tickers: List[str]) -> None:
+    """Fill previous_close for tickers not yet fetched this session."""
+    session = _session()
+    with _DAILY_LOCK:
+        need = [t for t in tickers if (_DAILY.get(t) or {}).get("session") != session]
+    for i in range(0, len(need), YF_BATCH):
+        chunk = need[i:i + YF_BATCH]
+        try:
+            df = _download(chunk, period="5d", interval="1d")
+        except Exception as e:
+            print(f"⚠️ yfinance daily download failed: {e}")
+            continue
+        with _DAILY_LOCK:
+            for t in chunk:
+                sub = _frame_for(df, t)
+                prev: Optional[float] = None
+                if sub is not None and "Close" in sub.columns:
+                    closes = sub["Close"].dropna()
+                    # last row is today's (live) bar once the session opens
+                    if len(closes) >= 2 and str(closes.index[-1])[:10] == session:
+                        prev = float(closes.iloc[-2])
+                    elif len(closes) >= 1:
+                        prev = float(closes.iloc[-1])
+                _DAILY[t] = {"session": session, "previous_close": prev}
+
+
+def fetch_quotes(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Batched snapshot for many symbols. Returns {SYMBOL: tick} with the
+    same keys as kite_ws_manager.fetch_quotes().
+    """
+    if yf is None:
+        raise RuntimeError("yfinance not installed. pip install yfinance")
+
+    wanted: Dict[str, List[str]] = {}   # yahoo ticker -> caller keys
+    for sym in symbols:
+        key = (sym or "").upper().strip()
+        if key:
+            wanted.setdefault(map_symbol(key), []).append(key)
+    if not wanted:
+        return {}
+
+    tickers = list(wanted.keys())
+    _ensure_daily(tickers)
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(tickers), YF_BATCH):
+        chunk = tickers[i:i + YF_BATCH]
+        try:
+            df = _download(chunk, period="1d", interval="1m")
+        except Exception as e:
+            print(f"⚠️ yfinance download failed for {len(chunk)} tickers: {e}")
+            continue
+        for t in chunk:
+            sub = _frame_for(df, t)
+            if sub is None or "Close" not in sub.columns:
+                continue
+            closes = sub["Close"].dropna()
+            if closes.empty:
+                continue
+            tick = {
+                "tradingsymbol": t,
+                "last_price": float(closes.iloc[-1]),
+                "ohlc": {
+                    "open": float(sub["Open"].dropna().iloc[0]) if "Open" in sub and not sub["Open"].dropna().empty else None,
+                    "high": float(sub["High"].max()) if "High" in sub else None,
+                    "low": float(sub["Low"].min()) if "Low" in sub else None,
+                    "close": (_DAILY.get(t) or {}).get("previous_close"),
+                },
+                "timestamp": closes.index[-1].to_pydatetime() if hasattr(closes.index[-1], "to_pydatetime") else None,
+            }
+            for key in wanted[t]:
+                out[key] = tick
+    return out
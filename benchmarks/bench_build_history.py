@@ -0,0 +1,107 @@
+# Backend/benchmarks/bench_build_history.py
+"""
+services.history.build_history on N synthetic fills.
+
+  old  - the previous matcher: each SELL rescans the symbol's lot list from
+         the start, one pydantic HistoryItem per lot
+  rows - build_history_rows(): deque lots, plain dicts
+  new  - build_history(): the same rows wrapped with model_construct
+         (no second validation pass)
+
+The old and new results are compared before timing.
+
+    python benchmarks/bench_build_history.py [--fills 100000] [--symbols 20]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app.services import history
+from app.services.history import HistoryItem, _fmt_time_ist
+
+
+def _old_build_history(username, orders):
+    filled = [o for o in orders if getattr(o, "status", "Filled") == "Filled"]
+    filled.sort(key=lambda o: o.created_at)
+    symbol_lots = {}
+    for o in filled:
+        side = o.side.upper()
+        sym = o.symbol
+        symbol_lots.setdefault(sym, [])
+        if side == "BUY":
+            symbol_lots[sym].append({
+                "time": _fmt_time_ist(o.created_at), "symbol": sym, "buy_qty": int(o.qty),
+                "buy_price": float(o.price), "remaining_qty": int(o.qty), "realized_pnl": 0.0,
+            })
+        elif side == "SELL":
+            sell_qty_left = int(o.qty)
+            sell_price = float(o.price)
+            for lot in symbol_lots[sym]:
+                if sell_qty_left <= 0:
+                    break
+                if lot["remaining_qty"] <= 0:
+                    continue
+                take = min(lot["remaining_qty"], sell_qty_left)
+                lot["realized_pnl"] += (sell_price - lot["buy_price"]) * take
+                lot["remaining_qty"] -= take
+                sell_qty_left -= take
+    items = []
+    for sym, lots in symbol_lots.items():
+        for lot in lots:
+            items.append(HistoryItem(
+                time=lot["time"], symbol=sym, buy_qty=lot["buy_qty"], buy_price=lot["buy_price"],
+                pnl=round(lot["realized_pnl"], 2), remaining_qty=lot["remaining_qty"],
+                is_closed=(lot["remaining_qty"] == 0),
+            ))
+    items.sort(key=lambda x: x.time, reverse=True)
+    return items
+
+
+def _fills(n: int, n_symbols: int, rng: random.Random):
+    t0 = datetime(2025, 1, 1, 3, 45)
+    out = []
+    for i in range(n):
+        # BUY-heavy, so lots pile up and the old rescan has work to do
+        out.append(SimpleNamespace(
+            symbol=f"SYM{rng.randrange(n_symbols):03d}",
+            side="BUY" if rng.random() < 0.55 else "SELL",
+            qty=rng.randint(1, 10),
+            price=round(100 + rng.random() * 50, 2),
+            status="Filled",
+            created_at=t0 + timedelta(seconds=i),
+        ))
+    return out
+
+
+def _time(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def run(n: int, n_symbols: int, check: bool):
+    orders = _fills(n, n_symbols, random.Random(42))
+    if check:
+        assert history.build_history("u", orders) == _old_build_history("u", orders), "results differ"
+    print(f"{'fills':>8} {'old ms':>10} {'rows ms':>10} {'new ms':>10}")
+    old = _time(_old_build_history, "u", orders)
+    rows = _time(history.build_history_rows, "u", orders)
+    new = _time(history.build_history, "u", orders)
+    print(f"{n:>8} {old:>10.1f} {rows:>10.1f} {new:>10.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fills", type=int, default=100000)
+    ap.add_argument("--symbols", type=int, default=20)
+    ap.add_argument("--no-check", action="store_true")
+    a = ap.parse_args()
+    run(a.fills, a.symbols, not a.no_check)
@@ -0,0 +1,106 @@
+# Backend/benchmarks/bench_process_open_orders.py
+"""
+Cycle time of process_open_orders() against the number of open orders.
+
+Builds a throwaway SQLite DB with N open LIMIT orders spread over a set of
+symbols and users, prices them from a fixed in-memory snapshot (no
+Kite/Yahoo access), and times:
+
+  idle  - a cycle where no trigger is crossed (the common case)
+  fill  - a cycle where ~--cross-pct of the orders trigger and fill
+
+    python benchmarks/bench_process_open_orders.py [--sizes 100,1000,10000] [--symbols 50] [--cross-pct 1]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app.routers import orders
+
+
+def _seed(db_path: str, n: int, symbols, users, prices, cross_pct: float, rng: random.Random):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    orders._ensure_tables(c)
+    c.executemany("INSERT INTO funds (username, available_amount) VALUES (?, ?)",
+                  [(u, 1e12) for u in users])
+    rows = []
+    for i in range(n):
+        sym = symbols[i % len(symbols)]
+        live = prices[sym]
+        cross = rng.random() * 100 < cross_pct
+        kind = rng.choice(("BUY", "SELL", "SELL_FIRST"))
+        # BUY / SELL FIRST trigger when live <= trigger; SELL when live >= trigger
+        if kind == "SELL":
+            trig = live * (0.98 if cross else 1.02 + rng.random() * 0.05)
+        else:
+            trig = live * (1.02 if cross else 0.98 - rng.random() * 0.05)
+        rows.append((rng.choice(users), sym, "BUY" if kind == "BUY" else "SELL", 1, round(trig, 2),
+                     "NSE", "intraday", "Open", "2025-01-01 09:15:00", int(kind == "SELL_FIRST")))
+    c.executemany(
+        """
+        INSERT INTO orders (username, script, order_type, qty, price, exchange, segment, status, datetime, is_short)
+        VALUES (?,?,?,?,?,?,?,?,?,?)
+        """,
+        rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def _time_cycle() -> float:
+    t0 = time.perf_counter()
+    orders.process_open_orders()
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def run(sizes, n_symbols: int, n_users: int, cross_pct: float, repeat: int):
+    rng = random.Random(42)
+    symbols = [f"SYM{i:03d}" for i in range(n_symbols)]
+    users = [f"user{i:03d}" for i in range(n_users)]
+    prices = {s: round(100 + rng.random() * 900, 2) for s in symbols}
+    orders.get_live_prices = lambda syms: {s: prices.get(s, 0.0) for s in syms}
+
+    print(f"{'open orders':>12} {'idle ms':>10} {'fill ms':>10} {'filled':>8}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            orders.DB_PATH = os.path.join(tmp, "bench.db")
+
+            # idle: every trigger is away from the market
+            _seed(orders.DB_PATH, n, symbols, users, prices, 0.0, rng)
+            orders.TRIGGER_BOOK.loaded = False
+            _time_cycle()                       # loads the trigger book
+            idle = min(_time_cycle() for _ in range(repeat))
+
+            # fill: a fresh DB where ~cross_pct% of the orders trigger
+            os.remove(orders.DB_PATH)
+            _seed(orders.DB_PATH, n, symbols, users, prices, cross_pct, rng)
+            orders.TRIGGER_BOOK.loaded = False
+            conn = sqlite3.connect(orders.DB_PATH)
+            orders._load_trigger_book(conn.cursor())
+            conn.close()
+            fill = _time_cycle()
+
+            conn = sqlite3.connect(orders.DB_PATH)
+            filled = conn.execute("SELECT COUNT(*) FROM orders WHERE status='Closed'").fetchone()[0]
+            conn.close()
+        print(f"{n:>12} {idle:>10.2f} {fill:>10.2f} {filled:>8}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100,1000,10000")
+    ap.add_argument("--symbols", type=int, default=50)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--cross-pct", type=float, default=1.0)
+    ap.add_argument("--repeat", type=int, default=5)
+    a = ap.parse_args()
+    run([int(x) for x in a.sizes.split(",") if x.strip()], a.symbols, a.users, a.cross_pct, a.repeat)
@@ -0,0 +1,107 @@
+# Backend/benchmarks/bench_quotes_async.py
+"""
+p99 latency of an unrelated endpoint (/healthz) while /quotes is under load.
+
+Compares the old handler (blocking upstream call made directly inside
+`async def`) with the current one (offloaded to the bounded quote pool).
+Upstream is simulated with a sleep, so no Kite/Yahoo access is needed.
+
+    python benchmarks/bench_quotes_async.py [--upstream-ms 200] [--clients 20] [--seconds 5]
+
+Needs httpx (same as FastAPI's TestClient).
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+import httpx
+from fastapi import FastAPI
+
+from app.services import kite_ws_manager as manager
+from app.services import price_service
+from app.routers import quotes
+
+
+def _fake_upstream(delay_s: float):
+    def get_quotes(symbols):
+        time.sleep(delay_s)  # blocking, like kite.quote()
+        return {s: {"last_price": 100.0, "ohlc": {"close": 99.0, "high": 101.0, "low": 98.0}} for s in symbols}
+    return get_quotes
+
+
+def _build_app(blocking: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/healthz")
+    def healthz():
+        return {"ok": True}
+
+    if blocking:
+        @app.get("/quotes")
+        async def get_quotes_blocking(symbols: str):
+            syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+            return quotes._quote_rows(syms)
+    else:
+        app.include_router(quotes.router)
+    return app
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+async def _run(app: FastAPI, clients: int, seconds: float):
+    transport = httpx.ASGITransport(app=app)
+    stop_at = time.perf_counter() + seconds
+    probe_ms, quote_count = [], 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def load():
+            nonlocal quote_count
+            while time.perf_counter() < stop_at:
+                await client.get("/quotes", params={"symbols": "RELIANCE,TCS,INFY"})
+                quote_count += 1
+
+        async def probe():
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                await client.get("/healthz")
+                probe_ms.append((time.perf_counter() - t0) * 1000.0)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(probe(), *(load() for _ in range(clients)))
+    return probe_ms, quote_count
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--upstream-ms", type=float, default=200.0)
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+
+    manager.get_quotes = _fake_upstream(args.upstream_ms / 1000.0)
+
+    print(f"upstream={args.upstream_ms:.0f}ms  clients={args.clients}  duration={args.seconds:.0f}s  "
+          f"pool={price_service.QUOTE_FETCH_WORKERS}")
+    print(f"{'mode':<10} {'/quotes done':>12} {'healthz n':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label, blocking in (("blocking", True), ("offload", False)):
+        probe_ms, n = asyncio.run(_run(_build_app(blocking), args.clients, args.seconds))
+        print(f"{label:<10} {n:>12} {len(probe_ms):>10} "
+              f"{statistics.median(probe_ms) if probe_ms else 0:>9.1f} "
+              f"{_pct(probe_ms, 99):>9.1f} {max(probe_ms or [0]):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
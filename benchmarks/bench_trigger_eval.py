@@ -0,0 +1,100 @@
+# Backend/benchmarks/bench_trigger_eval.py
+"""
+Cost of finding the crossed orders for one full price snapshot, three ways:
+
+  rows   - the old scan: le()/ge() on every open order in Python
+  bisect - TriggerBook, one bisect per symbol list
+  numpy  - TriggerBook parallel arrays, one vectorized pass
+
+All three must return the same ids; the script checks that before timing.
+No DB or network is involved: this is the evaluation step alone.
+
+    python benchmarks/bench_trigger_eval.py [--sizes 1000,10000,100000] [--symbols 200] [--cross-pct 1]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app.services import trigger_book as tb
+
+EPS = 0.01
+
+
+def _orders(n: int, symbols, prices, cross_pct: float, rng: random.Random):
+    rows = []
+    for i in range(n):
+        sym = symbols[i % len(symbols)]
+        live = prices[sym]
+        cross = rng.random() * 100 < cross_pct
+        kind = rng.choice(("BUY", "SELL", "SELL_FIRST"))
+        if kind == "SELL":
+            trig = live * (0.98 if cross else 1.02 + rng.random() * 0.05)
+        else:
+            trig = live * (1.02 if cross else 0.98 - rng.random() * 0.05)
+        rows.append((i + 1, sym, "BUY" if kind == "BUY" else "SELL", round(trig, 2), int(kind == "SELL_FIRST")))
+    return rows
+
+
+def _rows_scan(rows, prices):
+    out = []
+    for oid, sym, otype, trig, is_short in rows:
+        live = prices.get(sym, 0.0)
+        if live <= 0:
+            continue
+        if otype == "SELL" and not is_short:
+            if live >= trig - EPS:
+                out.append(oid)
+        elif live <= trig + EPS:
+            out.append(oid)
+    return out
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+
+def run(sizes, n_symbols: int, cross_pct: float, repeat: int):
+    if tb.np is None:
+        print("numpy is not installed; only the bisect path is available")
+        return
+    rng = random.Random(42)
+    symbols = [f"SYM{i:03d}" for i in range(n_symbols)]
+    prices = {s: round(100 + rng.random() * 900, 2) for s in symbols}
+
+    print(f"{'open orders':>12} {'crossed':>8} {'rows ms':>9} {'bisect ms':>10} {'numpy ms':>9}")
+    for n in sizes:
+        rows = _orders(n, symbols, prices, cross_pct, rng)
+        by_bisect = tb.TriggerBook(eps=EPS, mode="bisect")
+        by_numpy = tb.TriggerBook(eps=EPS, mode="numpy")
+        by_bisect.load(rows)
+        by_numpy.load(rows)
+
+        expect = sorted(_rows_scan(rows, prices))
+        assert sorted(by_bisect.crossed_all(prices)) == expect, "bisect disagrees with row scan"
+        assert sorted(by_numpy.crossed_all(prices)) == expect, "numpy disagrees with row scan"
+
+        t_rows = _best(lambda: _rows_scan(rows, prices), repeat)
+        t_bisect = _best(lambda: by_bisect.crossed_all(prices), repeat)
+        t_numpy = _best(lambda: by_numpy.crossed_all(prices), repeat)
+        print(f"{n:>12} {len(expect):>8} {t_rows:>9.2f} {t_bisect:>10.2f} {t_numpy:>9.2f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000,100000")
+    ap.add_argument("--symbols", type=int, default=200)
+    ap.add_argument("--cross-pct", type=float, default=1.0)
+    ap.add_argument("--repeat", type=int, default=20)
+    a = ap.parse_args()
+    run([int(x) for x in a.sizes.split(",") if x.strip()], a.symbols, a.cross_pct, a.repeat)
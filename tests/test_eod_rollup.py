@@ -0,0 +1,45 @@
+# tests/test_eod_rollup.py
+import sqlite3
+
+import pytest
+
+from app.routers import orders
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "paper_trading.db")
+    monkeypatch.setattr(orders, "DB_PATH", path)
+    monkeypatch.setattr(orders, "is_after_market_close", lambda: True)
+    monkeypatch.setattr(orders, "get_live_price", lambda script: 100.0)
+    monkeypatch.setattr(orders, "get_price_within", lambda script, *a: (100.0, 0.1))
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    orders._ensure_tables(c)
+    c.execute("INSERT INTO funds (username, available_amount) VALUES ('u', 100000)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_eod_rollup_keeps_delivery_buys(db):
+    orders.place_order(orders.OrderData(username="u", script="TCS", order_type="BUY", qty=3, price=0,
+                                        segment="delivery"))
+    orders.place_order(orders.OrderData(username="u", script="INFY", order_type="BUY", qty=2, price=0,
+                                        segment="intraday"))
+    orders.run_eod_pipeline("u")
+
+    conn = sqlite3.connect(db)
+    c = conn.cursor()
+    # the delivery BUY moved to portfolio and left orders...
+    c.execute("SELECT COUNT(*) FROM orders WHERE username='u' AND script='TCS'")
+    assert c.fetchone()[0] == 0
+    c.execute("SELECT qty FROM portfolio WHERE username='u' AND script='TCS'")
+    assert c.fetchone()[0] == 3
+    # ...but today's rollup still counts it
+    c.execute("SELECT script, segment, turnover, buy_qty, sell_qty, trades, source FROM pnl_daily ORDER BY script")
+    assert c.fetchall() == [
+        ("INFY", "intraday", 400.0, 2, 2, 2, "eod"),    # BUY + EOD square-off SELL
+        ("TCS", "delivery", 300.0, 3, 0, 1, "eod"),
+    ]
+    conn.close()